@@ -1 +1,3 @@
 from .runner import version as __version__  # noqa
+from ._runner import StackOverflow  # noqa
+from .effects import StackEffectError  # noqa
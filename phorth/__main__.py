@@ -1,6 +1,7 @@
 import click
 
 from phorth.runner import run_phorth
+from phorth.stream import filter_main
 
 
 @click.command()
@@ -9,22 +10,160 @@ from phorth.runner import run_phorth
     '--stack-size',
     default=30000,
     type=int,
-    help='The size the the stack for the phorth program.',
+    help='The maximum size of the stack for the phorth program.',
 )
 @click.option(
     '-m',
     '--memory',
     default=65535,
     type=int,
-    help='The size the the memory space for the phorth program.',
+    help='The maximum size of the memory space for the phorth program.',
 )
 @click.option(
     '--with-stdlib/--without-stdlib',
     default=True,
     help='Include stdlib.fs in the default vocabulary?',
 )
-def main(memory, stack_size, with_stdlib):
-    run_phorth(stack_size, memory, stdlib=with_stdlib)
+@click.option(
+    '--autoload/--no-autoload',
+    default=True,
+    help='Compile stdlib words the first time they are referenced instead of'
+    ' at startup?',
+)
+@click.option(
+    '-l',
+    '--library',
+    'libraries',
+    multiple=True,
+    type=click.Path(exists=True, dir_okay=False),
+    help='A phorth source file whose definitions are compiled the first time'
+    ' they are referenced. May be passed more than once.',
+)
+@click.option(
+    '--optimize/--no-optimize',
+    default=True,
+    help='Run the peephole optimizer on each colon definition?',
+)
+@click.option(
+    '--int-cells',
+    is_flag=True,
+    help='Compile colon definitions which only work with ints to run on'
+    ' native 64 bit cells.',
+)
+@click.option(
+    '--subroutine-threaded',
+    is_flag=True,
+    help='Compile colon definitions to subroutine threaded code.',
+)
+@click.option(
+    '--profile',
+    type=click.Path(dir_okay=False, writable=True),
+    help='Write a sampling profile of the session as collapsed stacks.',
+)
+@click.option(
+    '--filter',
+    'filter_word',
+    metavar='WORD',
+    help='Run WORD on each record of the input and write the values it'
+    ' leaves instead of starting the repl.',
+)
+@click.option(
+    '-i',
+    '--input',
+    'input_',
+    type=click.File('rb'),
+    default='-',
+    help='The file to read records from with --filter. Defaults to stdin.',
+)
+@click.option(
+    '--record-size',
+    type=click.IntRange(min=1),
+    help='Split the input into records of this many bytes instead of lines.',
+)
+@click.option(
+    '--fields',
+    is_flag=True,
+    help='Also push a tuple of the fields of each record.',
+)
+@click.option(
+    '-d',
+    '--delimiter',
+    help='The string that separates fields. Defaults to runs of whitespace.',
+)
+@click.option(
+    '--binary',
+    is_flag=True,
+    help='Pass records as bytes instead of decoding them as utf-8.',
+)
+@click.option(
+    '--mmap',
+    'use_mmap',
+    is_flag=True,
+    help='Memory map the input instead of reading it. The input must be a'
+    ' regular file.',
+)
+@click.argument(
+    'script',
+    required=False,
+    type=click.Path(exists=True, dir_okay=False),
+)
+def main(memory,
+         stack_size,
+         with_stdlib,
+         autoload,
+         libraries,
+         optimize,
+         int_cells,
+         subroutine_threaded,
+         profile,
+         filter_word,
+         input_,
+         record_size,
+         fields,
+         delimiter,
+         binary,
+         use_mmap,
+         script):
+    if filter_word is None:
+        if script is not None:
+            raise click.UsageError('SCRIPT may only be passed with --filter')
+    else:
+        if profile is not None:
+            raise click.UsageError('--profile may not be used with --filter')
+        try:
+            filter_main(
+                filter_word,
+                script,
+                input_,
+                record_size=record_size,
+                fields=fields,
+                delimiter=delimiter,
+                use_mmap=use_mmap,
+                encoding=None if binary else 'utf-8',
+                stack_size=stack_size,
+                memory=memory,
+                stdlib=with_stdlib,
+                autoload=autoload,
+                libraries=libraries,
+                optimize=optimize,
+                int_cells=int_cells,
+                subroutine_threaded=subroutine_threaded,
+            )
+        except Exception as e:
+            raise click.ClickException(str(e))
+        return
+
+    run_phorth(
+        stack_size,
+        memory,
+        stdlib=with_stdlib,
+        autoload=autoload,
+        libraries=libraries,
+        profile=profile,
+        optimize=optimize,
+        int_cells=int_cells,
+        subroutine_threaded=subroutine_threaded,
+    )
 
 
 if __name__ == '__main__':
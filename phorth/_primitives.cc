@@ -1,14 +1,18 @@
 #include <array>
 #include <cstdio>
+#include <cstring>
 #include <optional>
 #include <tuple>
+#include <utility>
 #include <vector>
 
 #include <Python.h>
 #include <frameobject.h>
+#include <opcode.h>
 #include <structmember.h>
 
 #include "phorth/constants.h"
+#include "phorth/context.h"
 
 namespace phorth {
 struct word {
@@ -16,6 +20,13 @@ struct word {
     PyObject* name;
     std::uint16_t addr;
     bool immediate;
+    // the value of latest when this word was created
+    PyObject* link;
+    // the definition of ``name`` that this word shadows, or nullptr
+    PyObject* shadowed;
+    // the size of the literal table when this word was created, or -1 for
+    // words which were not created with ``create``
+    Py_ssize_t nliterals;
 };
 
 namespace detail {
@@ -64,11 +75,17 @@ word* innernewword(PyTypeObject* cls, PyObject* name, PyObject* addr_ob, bool im
     self->name = name;
     self->addr = *addr;
     self->immediate = immediate;
+    Py_INCREF(Py_None);
+    self->link = Py_None;
+    self->shadowed = nullptr;
+    self->nliterals = -1;
     return self;
 }
 
 void deallocate(word* self) {
     Py_CLEAR(self->name);
+    Py_CLEAR(self->link);
+    Py_CLEAR(self->shadowed);
     PyObject_Del(self);
 }
 
@@ -145,6 +162,158 @@ PyTypeObject wordtype = {
     (newfunc) newword,                                     // tp_new
 };
 
+context* newcontext(PyTypeObject* cls, PyObject* args, PyObject* kwargs) {
+    const char* const keywords[] = {"max_memory", "max_stack_size", nullptr};
+    Py_ssize_t max_memory;
+    Py_ssize_t max_stack_size;
+    if (!PyArg_ParseTupleAndKeywords(args,
+                                     kwargs,
+                                     "nn",
+                                     const_cast<char**>(keywords),
+                                     &max_memory,
+                                     &max_stack_size)) {
+        return nullptr;
+    }
+
+    context* self = PyObject_New(context, cls);
+    if (!self) {
+        return nullptr;
+    }
+
+    try {
+        self->cstack = new std::vector<long>;
+    }
+    catch (const std::bad_alloc&) {
+        self->cstack = nullptr;
+        Py_DECREF(self);
+        PyErr_NoMemory();
+        return nullptr;
+    }
+    self->stack_size = 0;
+    self->max_memory = max_memory;
+    self->max_stack_size = max_stack_size;
+    self->dispatches = 0;
+    self->deref_jumps = 0;
+    self->max_stack_depth = 0;
+    self->max_cstack_depth = 0;
+    self->exceptions = 0;
+    return self;
+}
+
+void deletecontext(context* self) {
+    delete self->cstack;
+    PyObject_Del(self);
+}
+
+PyObject* contextrepr(context* self) {
+    return PyUnicode_FromFormat("<Context: cstack_depth=%zd, stack_size=%zd,"
+                                " dispatches=%zd, exceptions=%zd>",
+                                static_cast<Py_ssize_t>(self->cstack->size()),
+                                self->stack_size,
+                                self->dispatches,
+                                self->exceptions);
+}
+
+/**
+   Copy the cstack into a list.
+*/
+PyObject* cstack_as_list(context* self) {
+    PyObject* out = PyList_New(self->cstack->size());
+    if (!out) {
+        return nullptr;
+    }
+
+    for (std::size_t n = 0; n < self->cstack->size(); ++n) {
+        PyObject* addr = PyLong_FromLong((*self->cstack)[n]);
+        if (!addr) {
+            Py_DECREF(out);
+            return nullptr;
+        }
+        PyList_SET_ITEM(out, n, addr);
+    }
+    return out;
+}
+
+PyObject* context_get_cstack(context* self, void*) {
+    return cstack_as_list(self);
+}
+
+PyObject* context_get_cstack_depth(context* self, void*) {
+    return PyLong_FromSize_t(self->cstack->size());
+}
+
+PyGetSetDef context_getset[] = {
+    {const_cast<char*>("cstack"),
+     (getter) context_get_cstack,
+     nullptr,
+     const_cast<char*>("A copy of the return addresses, innermost last."),
+     nullptr},
+    {const_cast<char*>("cstack_depth"),
+     (getter) context_get_cstack_depth,
+     nullptr,
+     const_cast<char*>("The number of return addresses."),
+     nullptr},
+    {nullptr},
+};
+
+PyMemberDef context_members[] = {
+    {"stack_size", T_PYSSIZET, offsetof(context, stack_size), READONLY, ""},
+    {"max_memory", T_PYSSIZET, offsetof(context, max_memory), READONLY, ""},
+    {"max_stack_size", T_PYSSIZET, offsetof(context, max_stack_size), READONLY, ""},
+    {"dispatches", T_PYSSIZET, offsetof(context, dispatches), READONLY, ""},
+    {"deref_jumps", T_PYSSIZET, offsetof(context, deref_jumps), READONLY, ""},
+    {"max_stack_depth", T_PYSSIZET, offsetof(context, max_stack_depth), READONLY, ""},
+    {"max_cstack_depth", T_PYSSIZET, offsetof(context, max_cstack_depth), READONLY, ""},
+    {"exceptions", T_PYSSIZET, offsetof(context, exceptions), READONLY, ""},
+    {nullptr},
+};
+
+PyTypeObject contexttype = {
+    PyVarObject_HEAD_INIT(&PyType_Type, 0) "phorth.Context",  // tp_name
+    sizeof(context),                                          // tp_basicsize
+    0,                                                        // tp_itemsize
+    (destructor) deletecontext,                               // tp_dealloc
+    0,                                                        // tp_print
+    0,                                                        // tp_getattr
+    0,                                                        // tp_setattr
+    0,                                                        // tp_reserved
+    (reprfunc) contextrepr,                                   // tp_repr
+    0,                                                        // tp_as_number
+    0,                                                        // tp_as_sequence
+    0,                                                        // tp_as_mapping
+    0,                                                        // tp_hash
+    0,                                                        // tp_call
+    0,                                                        // tp_str
+    0,                                                        // tp_getattro
+    0,                                                        // tp_setattro
+    0,                                                        // tp_as_buffer
+    Py_TPFLAGS_DEFAULT,                                       // tp_flags
+    0,                                                        // tp_doc
+    0,                                                        // tp_traverse
+    0,                                                        // tp_clear
+    0,                                                        // tp_richcompare
+    0,                                                        // tp_weaklistoffset
+    0,                                                        // tp_iter
+    0,                                                        // tp_iternext
+    0,                                                        // tp_methods
+    context_members,                                          // tp_members
+    context_getset,                                           // tp_getset
+    0,                                                        // tp_base
+    0,                                                        // tp_dict
+    0,                                                        // tp_descr_get
+    0,                                                        // tp_descr_set
+    0,                                                        // tp_dictoffset
+    0,                                                        // tp_init
+    0,                                                        // tp_alloc
+    (newfunc) newcontext,                                     // tp_new
+};
+
+/**
+   Check the frame that called a primitive.
+
+   This runs on every primitive call so it only checks the number of locals.
+   The runner checks the context of a frame every time it resumes it.
+*/
 bool checkframe(PyFrameObject* f) {
     if (f->f_code->co_nlocals != EXPECTED_NLOCALS) {
         PyErr_Format(PyExc_AssertionError,
@@ -156,6 +325,22 @@ bool checkframe(PyFrameObject* f) {
     return true;
 }
 
+/**
+   Check a frame that was passed in from Python, which may not have been
+   resumed by the runner.
+*/
+bool checkcontext(PyFrameObject* f) {
+    if (!checkframe(f)) {
+        return false;
+    }
+    PyObject* ctx = f->f_localsplus[CONTEXT];
+    if (!(ctx && Py_TYPE(ctx) == &contexttype)) {
+        PyErr_SetString(PyExc_AssertionError, "frame has no phorth.Context");
+        return false;
+    }
+    return true;
+}
+
 PyFrameObject* getframe() {
     PyFrameObject* f;
 
@@ -171,6 +356,27 @@ inline char* frame_memory(PyFrameObject* f) {
     return PyBytes_AS_STRING(f->f_code->co_code);
 }
 
+/**
+   Get a pointer to `width` bytes of memory starting at `addr`.
+
+   Memory is grown between jumps so it may be smaller than the context's
+   `max_memory`.
+
+   @return The pointer, or nullptr with an exception raised if the bytes are
+           not all in the memory allocated so far.
+*/
+char* memory_at(PyFrameObject* f, std::size_t addr, std::size_t width) {
+    Py_ssize_t size = PyBytes_GET_SIZE(f->f_code->co_code);
+    if (addr + width > static_cast<std::size_t>(size)) {
+        PyErr_Format(PyExc_IndexError,
+                     "address %zu is out of range for a memory of %zd bytes",
+                     addr,
+                     size);
+        return nullptr;
+    }
+    return &frame_memory(f)[addr];
+}
+
 template<typename Char, Char... cs>
 std::integer_sequence<Char, cs...> operator""_add_method_literal() {
     return {};
@@ -216,8 +422,11 @@ METHOD(pop_return_addr, METH_NOARGS, PyObject*) {
         return nullptr;
     }
 
-    PyObject* cstack = f->f_localsplus[CSTACK];
-    return PyObject_CallMethod(cstack, "pop", nullptr);
+    auto addr = pop_cstack(frame_context(f));
+    if (!addr) {
+        return nullptr;
+    }
+    return PyLong_FromLong(*addr);
 }
 
 /**
@@ -232,18 +441,33 @@ METHOD(push_return_addr, METH_NOARGS, PyObject*) {
         return nullptr;
     }
 
-    PyObject* return_addr = PyLong_FromLong(f->f_lasti + 6);
-    if (!return_addr) {
+    if (!push_cstack(frame_context(f), f->f_lasti + 6)) {
         return nullptr;
     }
+    Py_RETURN_NONE;
+}
 
-    PyObject* cstack = f->f_localsplus[CSTACK];
-    int err = PyList_Append(cstack, return_addr);
-    Py_DECREF(return_addr);
-    if (err) {
+/**
+   Push an address onto the cstack.
+
+   @param unused
+   @param addr The address to return to.
+   @return None
+*/
+METHOD(push_return_impl, METH_O, PyObject*, PyObject* addr_ob) {
+    PyFrameObject* f;
+
+    if (!(f = getframe())) {
         return nullptr;
     }
 
+    long addr = PyLong_AsLong(addr_ob);
+    if (addr == -1 && PyErr_Occurred()) {
+        return nullptr;
+    }
+    if (!push_cstack(frame_context(f), addr)) {
+        return nullptr;
+    }
     Py_RETURN_NONE;
 }
 
@@ -259,18 +483,11 @@ METHOD(docol_impl, METH_NOARGS, PyObject*) {
         return nullptr;
     }
 
-    PyObject* cstack = f->f_localsplus[CSTACK];
-    PyObject* addr_ob = PyObject_CallMethod(cstack, "pop", nullptr);
-    if (!addr_ob) {
-        return nullptr;
-    }
-    long addr = PyLong_AsLong(addr_ob);
-    if (PyErr_Occurred()) {
+    auto addr = pop_cstack(frame_context(f));
+    if (!addr) {
         return nullptr;
     }
-    Py_DECREF(addr_ob);
-
-    return PyLong_FromLong(-(addr + 1));
+    return PyLong_FromLong(-(*addr + 1));
 }
 
 /**
@@ -280,25 +497,47 @@ METHOD(docol_impl, METH_NOARGS, PyObject*) {
    @param distance The amount to add to the current top of the cstack.
    @return The location to jump to.
 */
-METHOD(branch_impl, METH_O, PyObject* self, PyObject* distance_ob) {
-    PyObject* base_ob = pop_return_addr(self);
-    if (!base_ob) {
+METHOD(branch_impl, METH_O, PyObject*, PyObject* distance_ob) {
+    PyFrameObject* f;
+
+    if (!(f = getframe())) {
+        return nullptr;
+    }
+
+    auto distance = ob_as_int<std::int16_t>(distance_ob);
+    if (!distance) {
         return nullptr;
     }
-    auto base = ob_as_int<std::uint16_t>(base_ob);
-    Py_DECREF(base_ob);
+
+    auto base = pop_cstack(frame_context(f));
     if (!base) {
         return nullptr;
     }
 
-    auto distance = ob_as_int<std::int16_t>(distance_ob);
-    if (!distance) {
+    // the entry must be the address of the branch's offset cell, anything
+    // else, like a deref marker, would resume the frame mid-instruction
+    long size = PyBytes_GET_SIZE(f->f_code->co_code);
+    if (*base < 0 || *base >= size) {
+        PyErr_Format(PyExc_IndexError,
+                     "branch from address %ld is out of range for a memory of"
+                     " %ld bytes",
+                     *base,
+                     size);
+        return nullptr;
+    }
+    long target = *base + *distance;
+    if (target < 0 || target >= size) {
+        PyErr_Format(PyExc_IndexError,
+                     "branch to address %ld is out of range for a memory of"
+                     " %ld bytes",
+                     target,
+                     size);
         return nullptr;
     }
 
     // subtract 1 because we yield the value of last_i which is 1 less than
     // the index we want to jump to
-    return PyLong_FromUnsignedLong(*base + *distance - 1);
+    return PyLong_FromLong(target - 1);
 }
 
 /**
@@ -321,7 +560,11 @@ METHOD(read_impl, METH_O, PyObject*, PyObject* addr_ob) {
     if (!addr) {
         return nullptr;
     }
-    return PyLong_FromLong(*reinterpret_cast<std::uint16_t*>(&frame_memory(f)[*addr]));
+    char* p = memory_at(f, *addr, 2);
+    if (!p) {
+        return nullptr;
+    }
+    return PyLong_FromLong(*reinterpret_cast<std::uint16_t*>(p));
 }
 
 /**
@@ -344,7 +587,11 @@ METHOD(bread_impl, METH_O, PyObject*, PyObject* addr_ob) {
     if (!addr) {
         return nullptr;
     }
-    return PyLong_FromLong(*reinterpret_cast<std::uint8_t*>(&frame_memory(f)[*addr]));
+    char* p = memory_at(f, *addr, 1);
+    if (!p) {
+        return nullptr;
+    }
+    return PyLong_FromLong(*reinterpret_cast<std::uint8_t*>(p));
 }
 
 /**
@@ -377,7 +624,11 @@ METHOD(write_impl, METH_VARARGS, PyObject*, PyObject* args) {
         return nullptr;
     }
 
-    *reinterpret_cast<std::uint16_t*>(&frame_memory(f)[*addr]) = *val;
+    char* p = memory_at(f, *addr, 2);
+    if (!p) {
+        return nullptr;
+    }
+    *reinterpret_cast<std::uint16_t*>(p) = *val;
     Py_RETURN_NONE;
 }
 
@@ -411,7 +662,11 @@ METHOD(bwrite_impl, METH_VARARGS, PyObject*, PyObject* args) {
         return nullptr;
     }
 
-    *reinterpret_cast<std::uint8_t*>(&frame_memory(f)[*addr]) = *val;
+    char* p = memory_at(f, *addr, 1);
+    if (!p) {
+        return nullptr;
+    }
+    *reinterpret_cast<std::uint8_t*>(p) = *val;
     Py_RETURN_NONE;
 }
 
@@ -440,6 +695,13 @@ METHOD(find_impl, METH_O, PyObject*, PyObject* word) {
     return ret;
 }
 
+/**
+   Implementation for the .s forth word.
+
+   Write the contents of the data stack to the context's output.
+
+   @return None
+*/
 METHOD(print_stack_impl, METH_NOARGS, PyObject*) {
     PyFrameObject* f;
 
@@ -447,18 +709,159 @@ METHOD(print_stack_impl, METH_NOARGS, PyObject*) {
         return nullptr;
     }
 
-    PyObject* stack_size_ob = f->f_localsplus[STACK_SIZE];
-    auto stack_size = ob_as_int<std::size_t>(stack_size_ob);
-    if (!stack_size) {
+    Py_ssize_t stack_size = frame_context(f)->stack_size;
+    PyObject* values = PyTuple_New(stack_size);
+    if (!values) {
+        return nullptr;
+    }
+    for (Py_ssize_t n = 0; n < stack_size; ++n) {
+        Py_INCREF(f->f_valuestack[n]);
+        PyTuple_SET_ITEM(values, n, f->f_valuestack[n]);
+    }
+
+    return PyObject_CallMethod(f->f_localsplus[OUT], "print_stack", "N", values);
+}
+
+/**
+   Read values from the top of a phorth frame's data stack without popping
+   them. The frame must have been synced.
+
+   @param unused
+   @param f The phorth frame.
+   @param n The number of values to read.
+   @param skip The number of values on the top of the stack to skip over.
+   @return A tuple of the values, bottom first.
+*/
+METHOD(stack_peek, METH_VARARGS, PyObject*, PyObject* args) {
+    PyObject* fo;
+    Py_ssize_t n;
+    Py_ssize_t skip;
+    if (!PyArg_ParseTuple(args, "Onn", &fo, &n, &skip)) {
+        return nullptr;
+    }
+
+    if (!PyObject_IsInstance(fo, reinterpret_cast<PyObject*>(&PyFrame_Type))) {
+        PyErr_SetString(PyExc_TypeError, "f must be a frame object");
+        return nullptr;
+    }
+
+    auto f = reinterpret_cast<PyFrameObject*>(fo);
+    if (!checkcontext(f)) {
+        return nullptr;
+    }
+
+    Py_ssize_t stack_size = frame_context(f)->stack_size;
+    if (n < 0 || skip < 0 || n + skip > stack_size) {
+        PyErr_Format(PyExc_IndexError,
+                     "stack underflow: needed %zd values but the stack has %zd",
+                     n + skip,
+                     stack_size);
         return nullptr;
     }
-    std::fprintf(stdout, "<%ld>", *stack_size);
 
-    for (std::size_t n = 0; n < *stack_size; ++n) {
-        std::fputc(' ', stdout);
-        PyObject_Print(f->f_valuestack[n], stdout, 0);
+    PyObject* out = PyTuple_New(n);
+    if (!out) {
+        return nullptr;
+    }
+    PyObject** base = &f->f_valuestack[stack_size - skip - n];
+    for (Py_ssize_t ix = 0; ix < n; ++ix) {
+        Py_INCREF(base[ix]);
+        PyTuple_SET_ITEM(out, ix, base[ix]);
     }
-    std::fputc('\n', stdout);
+
+    return out;
+}
+
+/**
+   Overwrite memory of a phorth frame.
+
+   This is used by the peephole optimizer which runs in Python and so cannot
+   use the primitives that write to the running frame.
+
+   @param unused
+   @param f The phorth frame.
+   @param addr The address to start writing at.
+   @param data The bytes to write.
+   @return None.
+*/
+METHOD(write_memory, METH_VARARGS, PyObject*, PyObject* args) {
+    PyObject* fo;
+    Py_ssize_t addr;
+    PyObject* data;
+    if (!PyArg_ParseTuple(args,
+                          "O!nO!:write_memory",
+                          &PyFrame_Type,
+                          &fo,
+                          &addr,
+                          &PyBytes_Type,
+                          &data)) {
+        return nullptr;
+    }
+
+    auto f = reinterpret_cast<PyFrameObject*>(fo);
+    if (!checkcontext(f)) {
+        return nullptr;
+    }
+
+    if (addr < 0) {
+        PyErr_Format(PyExc_IndexError, "negative address: %zd", addr);
+        return nullptr;
+    }
+    char* p = memory_at(f, addr, PyBytes_GET_SIZE(data));
+    if (!p) {
+        return nullptr;
+    }
+    std::memcpy(p, PyBytes_AS_STRING(data), PyBytes_GET_SIZE(data));
+
+    Py_RETURN_NONE;
+}
+
+/**
+   Replace the value of a literal of a phorth frame.
+
+   @param unused
+   @param f The phorth frame.
+   @param ix The index into ``co_consts`` of the literal, as returned by
+             ``append_lit``.
+   @param value The new value.
+   @return None.
+*/
+METHOD(set_literal, METH_VARARGS, PyObject*, PyObject* args) {
+    PyObject* fo;
+    Py_ssize_t ix;
+    PyObject* value;
+    if (!PyArg_ParseTuple(args,
+                          "O!nO:set_literal",
+                          &PyFrame_Type,
+                          &fo,
+                          &ix,
+                          &value)) {
+        return nullptr;
+    }
+
+    auto f = reinterpret_cast<PyFrameObject*>(fo);
+    if (!checkcontext(f)) {
+        return nullptr;
+    }
+
+    PyObject* literals = f->f_localsplus[LITERALS];
+    PyObject* consts = f->f_code->co_consts;
+    Py_ssize_t lit_ix = ix - (PyTuple_GET_SIZE(consts) - MAX_LITERALS);
+    if (lit_ix < 0 || lit_ix >= PyList_GET_SIZE(literals)) {
+        PyErr_Format(PyExc_IndexError, "%zd is not the index of a literal", ix);
+        return nullptr;
+    }
+
+    Py_INCREF(value);
+    if (PyList_SetItem(literals, lit_ix, value)) {
+        return nullptr;
+    }
+
+    PyObject* old = PyTuple_GET_ITEM(consts, ix);
+    Py_INCREF(value);
+    PyTuple_SET_ITEM(consts, ix, value);
+    Py_DECREF(old);
+
     Py_RETURN_NONE;
 }
 
@@ -469,20 +872,136 @@ METHOD(clear_cstack, METH_O, PyObject*, PyObject* fo) {
     }
 
     auto f = reinterpret_cast<PyFrameObject*>(fo);
-    if (!checkframe(f)) {
+    if (!checkcontext(f)) {
         return nullptr;
     }
 
-    PyObject* cstack = f->f_localsplus[CSTACK];
-
-    if (!(f->f_localsplus[CSTACK] = PyList_New(0))) {
-        f->f_localsplus[CSTACK] = cstack;
+    context* ctx = frame_context(f);
+    PyObject* cstack = cstack_as_list(ctx);
+    if (!cstack) {
         return nullptr;
     }
+    ctx->cstack->clear();
 
+    // the cstack is only cleared when an exception is reported
+    ++ctx->exceptions;
     return cstack;
 }
 
+namespace {
+bool set_stat(PyObject* out, const char* key, Py_ssize_t value) {
+    PyObject* value_ob = PyLong_FromSsize_t(value);
+    if (!value_ob) {
+        return false;
+    }
+    int err = PyDict_SetItemString(out, key, value_ob);
+    Py_DECREF(value_ob);
+    return !err;
+}
+}  // namespace
+
+/**
+   Collect the resource usage of a phorth frame.
+
+   @param unused
+   @param f The phorth frame. The stack depth is read from the context so
+            the frame must have been synced.
+   @return A dict of the counters from the frame's `Context` along with the
+           current and maximum size of the stack, memory and literal table and
+           the number of words in the dictionary.
+*/
+METHOD(context_stats, METH_O, PyObject*, PyObject* fo) {
+    if (!PyObject_IsInstance(fo, reinterpret_cast<PyObject*>(&PyFrame_Type))) {
+        PyErr_SetString(PyExc_TypeError, "f must be a frame object");
+        return nullptr;
+    }
+
+    auto f = reinterpret_cast<PyFrameObject*>(fo);
+    if (!checkcontext(f)) {
+        return nullptr;
+    }
+
+    context* ctx = frame_context(f);
+    auto here = ob_as_int<Py_ssize_t>(f->f_localsplus[HERE]);
+    if (!here) {
+        return nullptr;
+    }
+
+    Py_ssize_t words = 0;
+    Py_ssize_t pos = 0;
+    PyObject* value;
+    while (PyDict_Next(f->f_globals, &pos, nullptr, &value)) {
+        words += PyObject_TypeCheck(value, &wordtype);
+    }
+
+    PyObject* out = PyDict_New();
+    if (!out) {
+        return nullptr;
+    }
+
+    std::pair<const char*, Py_ssize_t> items[] = {
+        {"dispatches", ctx->dispatches},
+        {"deref_jumps", ctx->deref_jumps},
+        {"exceptions", ctx->exceptions},
+        {"stack_depth", ctx->stack_size},
+        {"max_stack_depth", ctx->max_stack_depth},
+        {"stack_allocated", f->f_code->co_stacksize},
+        {"max_stack_size", ctx->max_stack_size},
+        {"cstack_depth", static_cast<Py_ssize_t>(ctx->cstack->size())},
+        {"max_cstack_depth", ctx->max_cstack_depth},
+        {"here", *here},
+        {"memory_allocated", PyBytes_GET_SIZE(f->f_code->co_code)},
+        {"max_memory", ctx->max_memory},
+        {"literals", PyList_GET_SIZE(f->f_localsplus[LITERALS])},
+        {"max_literals", static_cast<Py_ssize_t>(MAX_LITERALS)},
+        {"words", words},
+    };
+    for (const auto& [key, count] : items) {
+        if (!set_stat(out, key, count)) {
+            Py_DECREF(out);
+            return nullptr;
+        }
+    }
+
+    return out;
+}
+
+/**
+   Capture the state of a phorth frame for the sampling profiler.
+
+   @param unused
+   @param f The phorth frame to sample.
+   @return A tuple of ``(f_lasti, cstack, latest)`` where ``cstack`` is a copy
+           of the control stack.
+*/
+METHOD(sample_frame, METH_O, PyObject*, PyObject* fo) {
+    if (!PyObject_IsInstance(fo, reinterpret_cast<PyObject*>(&PyFrame_Type))) {
+        PyErr_SetString(PyExc_TypeError, "f must be a frame object");
+        return nullptr;
+    }
+
+    auto f = reinterpret_cast<PyFrameObject*>(fo);
+    if (!checkcontext(f)) {
+        return nullptr;
+    }
+
+    context* ctx = frame_context(f);
+    PyObject* cstack = PyTuple_New(ctx->cstack->size());
+    if (!cstack) {
+        return nullptr;
+    }
+    for (std::size_t n = 0; n < ctx->cstack->size(); ++n) {
+        PyObject* addr = PyLong_FromLong((*ctx->cstack)[n]);
+        if (!addr) {
+            Py_DECREF(cstack);
+            return nullptr;
+        }
+        PyTuple_SET_ITEM(cstack, n, addr);
+    }
+
+    return Py_BuildValue("(iNO)", f->f_lasti, cstack, f->f_localsplus[LATEST]);
+}
+
 METHOD(create_impl, METH_O, PyObject*, PyObject* name) {
     PyFrameObject* f;
 
@@ -495,6 +1014,17 @@ METHOD(create_impl, METH_O, PyObject*, PyObject* name) {
         return nullptr;
     }
 
+    // record enough state to roll the context back to before this word
+    Py_INCREF(f->f_localsplus[LATEST]);
+    Py_SETREF(latest->link, f->f_localsplus[LATEST]);
+    latest->nliterals = PyList_GET_SIZE(f->f_localsplus[LITERALS]);
+
+    PyObject* shadowed = PyDict_GetItem(f->f_globals, name);
+    if (shadowed && PyObject_TypeCheck(shadowed, &wordtype)) {
+        Py_INCREF(shadowed);
+        latest->shadowed = shadowed;
+    }
+
     if (PyDict_SetItem(f->f_globals, name, reinterpret_cast<PyObject*>(latest))) {
         Py_DECREF(latest);
         return nullptr;
@@ -518,7 +1048,11 @@ METHOD(comma_impl, METH_O, PyObject*, PyObject* val_ob) {
     if (!here) {
         return nullptr;
     }
-    *reinterpret_cast<std::uint16_t*>(&frame_memory(f)[*here]) = *val;
+    char* p = memory_at(f, *here, 2);
+    if (!p) {
+        return nullptr;
+    }
+    *reinterpret_cast<std::uint16_t*>(p) = *val;
 
     return PyLong_FromUnsignedLong(*here + 2);
 }
@@ -538,52 +1072,271 @@ METHOD(bcomma_impl, METH_O, PyObject*, PyObject* val_ob) {
     if (!here) {
         return nullptr;
     }
-    *reinterpret_cast<std::uint8_t*>(&frame_memory(f)[*here]) = *val;
+    char* p = memory_at(f, *here, 1);
+    if (!p) {
+        return nullptr;
+    }
+    *reinterpret_cast<std::uint8_t*>(p) = *val;
 
     return PyLong_FromUnsignedLong(*here + 1);
 }
 
-METHOD(append_lit, METH_O, PyObject*, PyObject* lit) {
+/**
+   Release the literals at the end of the literal table of a phorth frame.
+
+   @param f The phorth frame.
+   @param count The number of literals to keep.
+   @return Zero on success, nonzero with an exception raised otherwise.
+*/
+int truncate_literals(PyFrameObject* f, Py_ssize_t count) {
+    PyObject* literals = f->f_localsplus[LITERALS];
+    PyObject* consts = f->f_code->co_consts;
+    Py_ssize_t base = PyTuple_GET_SIZE(consts) - MAX_LITERALS;
+    for (Py_ssize_t ix = count; ix < PyList_GET_SIZE(literals); ++ix) {
+        PyObject* old = PyTuple_GET_ITEM(consts, base + ix);
+        Py_INCREF(Py_None);
+        PyTuple_SET_ITEM(consts, base + ix, Py_None);
+        Py_DECREF(old);
+    }
+    return PyList_SetSlice(literals, count, PyList_GET_SIZE(literals), nullptr);
+}
+
+/**
+   Roll a phorth frame back to the state it was in before `target` was
+   created.
+
+   This resets here and latest, removes the dictionary entries for every word
+   defined since `target` (restoring any definitions they shadowed), and
+   releases the literals defined since `target`.
+
+   @param f The phorth frame.
+   @param target The oldest word to forget.
+   @return None.
+*/
+PyObject* forget(PyFrameObject* f, PyObject* target_ob) {
+    if (!PyObject_TypeCheck(target_ob, &wordtype)) {
+        PyErr_Format(PyExc_TypeError, "cannot forget non-word: %R", target_ob);
+        return nullptr;
+    }
+    auto target = reinterpret_cast<word*>(target_ob);
+    if (target->nliterals < 0) {
+        PyErr_Format(PyExc_ValueError, "cannot forget builtin word %R", target->name);
+        return nullptr;
+    }
+
+    auto here = ob_as_int<std::uint16_t>(f->f_localsplus[HERE]);
+    if (!here) {
+        return nullptr;
+    }
+
+    // restore the dictionary
+    PyObject* names = PyDict_Keys(f->f_globals);
+    if (!names) {
+        return nullptr;
+    }
+    for (Py_ssize_t ix = 0; ix < PyList_GET_SIZE(names); ++ix) {
+        PyObject* name = PyList_GET_ITEM(names, ix);
+        PyObject* ob = PyDict_GetItem(f->f_globals, name);
+        if (!(ob && PyObject_TypeCheck(ob, &wordtype))) {
+            continue;
+        }
+
+        auto w = reinterpret_cast<word*>(ob);
+        while (w && w->addr >= target->addr && w->nliterals >= 0) {
+            w = reinterpret_cast<word*>(w->shadowed);
+        }
+        if (w == reinterpret_cast<word*>(ob)) {
+            continue;
+        }
+
+        int err = (w) ? PyDict_SetItem(f->f_globals,
+                                       name,
+                                       reinterpret_cast<PyObject*>(w)) :
+                        PyDict_DelItem(f->f_globals, name);
+        if (err) {
+            Py_DECREF(names);
+            return nullptr;
+        }
+    }
+    Py_DECREF(names);
+
+    // release the literals
+    if (truncate_literals(f, target->nliterals)) {
+        return nullptr;
+    }
+
+    // reclaim the memory
+    PyObject* new_here = PyLong_FromUnsignedLong(target->addr);
+    if (!new_here) {
+        return nullptr;
+    }
+    if (*here > target->addr) {
+        std::memset(&frame_memory(f)[target->addr], NOP, *here - target->addr);
+    }
+    Py_SETREF(f->f_localsplus[HERE], new_here);
+
+    Py_INCREF(target->link);
+    Py_SETREF(f->f_localsplus[LATEST], target->link);
+
+    Py_RETURN_NONE;
+}
+
+/**
+   Implementation for the forget forth word.
+
+   @param unused
+   @param target The oldest word to forget.
+   @return None.
+*/
+METHOD(forget_impl, METH_O, PyObject*, PyObject* target_ob) {
     PyFrameObject* f;
 
     if (!(f = getframe())) {
         return nullptr;
     }
+    return forget(f, target_ob);
+}
+
+/**
+   Forget words in a phorth frame which is not the running frame.
+
+   This is used by ``;`` to drop a definition which is rejected by a pass
+   which runs in Python and so cannot use `forget_impl`.
+
+   @param unused
+   @param f The phorth frame.
+   @param target The oldest word to forget.
+   @return None.
+*/
+METHOD(forget_frame, METH_VARARGS, PyObject*, PyObject* args) {
+    PyObject* fo;
+    PyObject* target;
+    if (!PyArg_ParseTuple(args,
+                          "O!O:forget_frame",
+                          &PyFrame_Type,
+                          &fo,
+                          &target)) {
+        return nullptr;
+    }
+
+    auto f = reinterpret_cast<PyFrameObject*>(fo);
+    if (!checkcontext(f)) {
+        return nullptr;
+    }
+    return forget(f, target);
+}
+
+/**
+   Release the literals of a phorth frame from a literal onward.
+
+   This is used by the peephole optimizer to free the slots of literals which
+   it removed from the thread of the latest definition.
+
+   @param unused
+   @param f The phorth frame.
+   @param ix The index into ``co_consts`` of the first literal to release.
+   @return None.
+*/
+METHOD(release_literals, METH_VARARGS, PyObject*, PyObject* args) {
+    PyObject* fo;
+    Py_ssize_t ix;
+    if (!PyArg_ParseTuple(args,
+                          "O!n:release_literals",
+                          &PyFrame_Type,
+                          &fo,
+                          &ix)) {
+        return nullptr;
+    }
+
+    auto f = reinterpret_cast<PyFrameObject*>(fo);
+    if (!checkcontext(f)) {
+        return nullptr;
+    }
 
     PyObject* literals = f->f_localsplus[LITERALS];
+    Py_ssize_t lit_ix = ix - (PyTuple_GET_SIZE(f->f_code->co_consts) - MAX_LITERALS);
+    if (lit_ix < 0 || lit_ix > PyList_GET_SIZE(literals)) {
+        PyErr_Format(PyExc_IndexError, "%zd is not the index of a literal", ix);
+        return nullptr;
+    }
+    if (truncate_literals(f, lit_ix)) {
+        return nullptr;
+    }
+
+    Py_RETURN_NONE;
+}
+
+/**
+   Add a literal to the literal table of a phorth frame.
+
+   The literal is stored in one of the ``MAX_LITERALS`` slots reserved at the
+   end of ``co_consts`` so that it may be pushed with a single ``LOAD_CONST``.
+
+   @return The index into ``co_consts`` where the literal was stored.
+*/
+PyObject* frame_append_lit(PyFrameObject* f, PyObject* lit) {
+    PyObject* literals = f->f_localsplus[LITERALS];
+    Py_ssize_t count = PyList_GET_SIZE(literals);
+    if (count >= static_cast<Py_ssize_t>(MAX_LITERALS)) {
+        PyErr_Format(PyExc_OverflowError,
+                     "literal table is full; at most %zu literals may be defined",
+                     MAX_LITERALS);
+        return nullptr;
+    }
+
+    PyObject* consts = f->f_code->co_consts;
+    Py_ssize_t ix = PyTuple_GET_SIZE(consts) - MAX_LITERALS + count;
     if (PyList_Append(literals, lit)) {
         return nullptr;
     }
 
-    return PyLong_FromSsize_t(PyList_GET_SIZE(literals) - 1);
+    PyObject* old = PyTuple_GET_ITEM(consts, ix);
+    Py_INCREF(lit);
+    PyTuple_SET_ITEM(consts, ix, lit);
+    Py_DECREF(old);
+
+    return PyLong_FromSsize_t(ix);
 }
 
-METHOD(lit_impl, METH_O, PyObject*, PyObject* ret_ob) {
+/**
+   Add a literal to the context's literal table.
+
+   @param unused
+   @param lit The literal value.
+   @return The index into ``co_consts`` where the literal was stored.
+*/
+METHOD(append_lit, METH_O, PyObject*, PyObject* lit) {
     PyFrameObject* f;
 
     if (!(f = getframe())) {
         return nullptr;
     }
 
-    auto ret = ob_as_int<long>(ret_ob);
-    if (!ret) {
+    return frame_append_lit(f, lit);
+}
+
+/**
+   Add a literal to the literal table of a phorth frame from outside of the
+   frame.
+
+   @param unused
+   @param f The phorth frame.
+   @param lit The literal value.
+   @return The index into ``co_consts`` where the literal was stored.
+*/
+METHOD(append_literal, METH_VARARGS, PyObject*, PyObject* args) {
+    PyObject* fo;
+    PyObject* lit;
+    if (!PyArg_ParseTuple(args, "O!O:append_literal", &PyFrame_Type, &fo, &lit)) {
         return nullptr;
     }
-    PyObject* literals = f->f_localsplus[LITERALS];
-    long idx = -*ret;
-
-    PyObject* lit = PyList_GET_ITEM(literals,
-                                    *reinterpret_cast<std::uint16_t*>(
-                                        &frame_memory(f)[idx]));
 
-    PyObject* new_ret = PyLong_FromLong(*ret - 2);
-    if (!new_ret) {
+    auto f = reinterpret_cast<PyFrameObject*>(fo);
+    if (!checkcontext(f)) {
         return nullptr;
     }
 
-    PyObject* out = PyTuple_Pack(2, new_ret, lit);
-    Py_DECREF(new_ret);
-    return out;
+    return frame_append_lit(f, lit);
 }
 
 PyDoc_STRVAR(module_doc,
@@ -600,7 +1353,7 @@ PyModuleDef module = {
 };
 
 PyMODINIT_FUNC PyInit__primitives(void) {
-    if (PyType_Ready(&wordtype)) {
+    if (PyType_Ready(&wordtype) || PyType_Ready(&contexttype)) {
         return nullptr;
     }
 
@@ -624,10 +1377,10 @@ PyMODINIT_FUNC PyInit__primitives(void) {
     locals[IMMEDIATE_MODE] = "immediate";
     locals[HERE] = "here";
     locals[LATEST] = "latest";
-    locals[CSTACK] = "cstack";
-    locals[STACK_SIZE] = "stack_size";
     locals[LITERALS] = "literals";
     locals[TMP] = "tmp";
+    locals[OUT] = "out";
+    locals[CONTEXT] = "context";
 
     for (std::size_t ix = 0; ix < EXPECTED_NLOCALS; ++ix) {
         if (!locals[ix]) {
@@ -650,11 +1403,42 @@ PyMODINIT_FUNC PyInit__primitives(void) {
         return nullptr;
     }
 
+    PyObject* max_literals = PyLong_FromSize_t(MAX_LITERALS);
+    if (!max_literals) {
+        Py_DECREF(m);
+        return nullptr;
+    }
+
+    err = PyObject_SetAttrString(m, "max_literals", max_literals);
+    Py_DECREF(max_literals);
+    if (err) {
+        Py_DECREF(m);
+        return nullptr;
+    }
+
+    PyObject* stack_headroom = PyLong_FromSsize_t(STACK_HEADROOM);
+    if (!stack_headroom) {
+        Py_DECREF(m);
+        return nullptr;
+    }
+
+    err = PyObject_SetAttrString(m, "stack_headroom", stack_headroom);
+    Py_DECREF(stack_headroom);
+    if (err) {
+        Py_DECREF(m);
+        return nullptr;
+    }
+
     if (PyObject_SetAttrString(m, "Word", reinterpret_cast<PyObject*>(&wordtype))) {
         Py_DECREF(m);
         return nullptr;
     }
 
+    if (PyObject_SetAttrString(m, "Context", reinterpret_cast<PyObject*>(&contexttype))) {
+        Py_DECREF(m);
+        return nullptr;
+    }
+
     return m;
 }
 }  // namespace phorth
@@ -1,13 +1,236 @@
+#include <algorithm>
 #include <cstdint>
+#include <cstring>
+#include <iterator>
+#include <memory>
+#include <utility>
+#include <vector>
 
 #include <Python.h>
 #include <frameobject.h>
+#include <opcode.h>
+#include <structmember.h>
 
 #include "phorth/constants.h"
+#include "phorth/context.h"
 
 namespace phorth {
+/**
+   Raised when the data stack of a context would grow past its
+   `max_stack_size`.
+*/
+PyObject* stack_overflow;
+
+/**
+   The `phorth.Context` type from `_primitives`.
+*/
+PyTypeObject* context_type;
+
+/**
+   Get the context of a phorth frame, checking that the frame has one.
+*/
+context* checked_context(PyFrameObject* f) {
+    PyObject* ob = f->f_localsplus[CONTEXT];
+    if (!(ob && Py_TYPE(ob) == context_type)) {
+        PyErr_Format(PyExc_TypeError,
+                     "context must be a phorth.Context, got %R",
+                     ob ? ob : Py_None);
+        return nullptr;
+    }
+    return reinterpret_cast<context*>(ob);
+}
+
+/**
+   Read an int local of a phorth frame.
+*/
+bool local_as_ssize_t(PyFrameObject* f, std::size_t ix, Py_ssize_t* out) {
+    *out = PyLong_AsSsize_t(f->f_localsplus[ix]);
+    return !(*out == -1 && PyErr_Occurred());
+}
+
+/**
+   Grow the memory of a suspended context so that there are at least
+   `MEMORY_HEADROOM` free bytes past `here`, without going over the context's
+   `max_memory`.
+
+   The memory is the `co_code` of the context, which is replaced with a larger
+   copy. This is only safe while the frame is suspended because the eval loop
+   holds a pointer into the `co_code` while it runs.
+*/
+bool reserve_memory(PyFrameObject* f) {
+    Py_ssize_t here;
+    if (!local_as_ssize_t(f, HERE, &here)) {
+        return false;
+    }
+
+    PyCodeObject* co = f->f_code;
+    Py_ssize_t size = PyBytes_GET_SIZE(co->co_code);
+    if (size - here >= MEMORY_HEADROOM) {
+        return true;
+    }
+
+    Py_ssize_t max_memory = frame_context(f)->max_memory;
+    if (size >= max_memory) {
+        // the primitives which write to memory check the bounds
+        return true;
+    }
+
+    Py_ssize_t new_size = std::min(std::max(size * 2, here + MEMORY_HEADROOM),
+                                   max_memory);
+    PyObject* memory = PyBytes_FromStringAndSize(nullptr, new_size);
+    if (!memory) {
+        return false;
+    }
+    std::memcpy(PyBytes_AS_STRING(memory), PyBytes_AS_STRING(co->co_code), size);
+    std::memset(&PyBytes_AS_STRING(memory)[size], NOP, new_size - size);
+    Py_SETREF(co->co_code, memory);
+    return true;
+}
+
+/**
+   Replace the frame of a suspended context with a frame that has room for
+   `size` values on the data stack.
+
+   The data stack is allocated inline with the frame so it cannot be resized
+   in place. Instead, the state of the old frame is moved into a new frame
+   which is installed in the generator.
+
+   @return The new frame.
+*/
+PyFrameObject* resize_stack(PyGenObject* gen, Py_ssize_t size) {
+    PyFrameObject* f = gen->gi_frame;
+    PyCodeObject* co = f->f_code;
+
+    if (size > INT_MAX) {
+        PyErr_SetString(PyExc_OverflowError, "stack size is too large");
+        return nullptr;
+    }
+
+    // PyFrame_New allocates the value stack based on `co_stacksize` and
+    // reuses the frame cached on the code object, which is too small
+    if (co->co_zombieframe) {
+        PyObject_GC_Del(co->co_zombieframe);
+        co->co_zombieframe = nullptr;
+    }
+    int old_size = co->co_stacksize;
+    co->co_stacksize = static_cast<int>(size);
+    PyFrameObject* new_f = PyFrame_New(PyThreadState_GET(), co, f->f_globals, nullptr);
+    if (!new_f) {
+        co->co_stacksize = old_size;
+        return nullptr;
+    }
+
+    // PyFrame_New links the new frame to the running frame, but this frame is
+    // only ever resumed by the runner, which sets ``f_back`` itself
+    Py_CLEAR(new_f->f_back);
+
+    // move the locals
+    Py_ssize_t nlocals = co->co_nlocals +
+        PyTuple_GET_SIZE(co->co_cellvars) +
+        PyTuple_GET_SIZE(co->co_freevars);
+    for (Py_ssize_t ix = 0; ix < nlocals; ++ix) {
+        new_f->f_localsplus[ix] = f->f_localsplus[ix];
+        f->f_localsplus[ix] = nullptr;
+    }
+
+    // move the data stack
+    Py_ssize_t depth = f->f_stacktop - f->f_valuestack;
+    std::memcpy(new_f->f_valuestack, f->f_valuestack, depth * sizeof(PyObject*));
+    new_f->f_stacktop = new_f->f_valuestack + depth;
+    f->f_stacktop = f->f_valuestack;
+
+    // move the block stack, the handlers are absolute addresses and the
+    // levels are stack depths so they are still valid
+    new_f->f_iblock = f->f_iblock;
+    std::memcpy(new_f->f_blockstack, f->f_blockstack, sizeof(f->f_blockstack));
+    f->f_iblock = 0;
+
+    new_f->f_lasti = f->f_lasti;
+    new_f->f_lineno = f->f_lineno;
+    std::swap(new_f->f_locals, f->f_locals);
+    std::swap(new_f->f_trace, f->f_trace);
+    std::swap(new_f->f_exc_type, f->f_exc_type);
+    std::swap(new_f->f_exc_value, f->f_exc_value);
+    std::swap(new_f->f_exc_traceback, f->f_exc_traceback);
+
+    new_f->f_gen = f->f_gen;
+    f->f_gen = nullptr;
+    gen->gi_frame = new_f;
+    Py_DECREF(f);
+
+    // the old frame may have been cached on the code object, but it is too
+    // small to ever be reused
+    if (co->co_zombieframe) {
+        PyObject_GC_Del(co->co_zombieframe);
+        co->co_zombieframe = nullptr;
+    }
+
+    return new_f;
+}
+
+/**
+   Make sure that the data stack of a suspended context has room for `n` more
+   values plus `STACK_HEADROOM`, growing the stack if needed.
+
+   @return The frame of the context, which may be a new frame; or nullptr
+           with `StackOverflow` raised if the stack would grow past the
+           context's `max_stack_size`.
+*/
+PyFrameObject* reserve_stack(PyGenObject* gen, Py_ssize_t n) {
+    PyFrameObject* f = gen->gi_frame;
+    Py_ssize_t depth = f->f_stacktop - f->f_valuestack;
+    Py_ssize_t size = f->f_code->co_stacksize;
+    if (depth + n + STACK_HEADROOM <= size) {
+        return f;
+    }
+
+    Py_ssize_t max_stack_size = frame_context(f)->max_stack_size;
+    if (depth + n > max_stack_size) {
+        PyErr_Format(stack_overflow,
+                     "stack overflow: %zd values exceeds the maximum stack"
+                     " size of %zd",
+                     depth + n,
+                     max_stack_size);
+        return nullptr;
+    }
+
+    // the stack may hold up to `STACK_HEADROOM` values past the maximum
+    // because it is only checked between jumps
+    Py_ssize_t new_size = std::min(
+        std::max(size * 2, depth + n + STACK_HEADROOM),
+        max_stack_size + STACK_HEADROOM);
+    if (new_size <= size) {
+        return f;
+    }
+    return resize_stack(gen, new_size);
+}
+
+/**
+   The values yielded by the continuations of inline literals, indexed by the
+   number of bytes of code between the literal's ``LOAD_CONST`` and
+   ``JUMP_ABSOLUTE``. This is 0 unless the peephole optimizer fused an
+   instruction into the literal.
+*/
+PyObject* lit_next[4];
+
+/**
+   Get the number of fused bytes of a value yielded by a literal continuation.
+
+   @return The number of bytes, or -1 if `ob` was not yielded by a literal
+           continuation.
+*/
+int lit_next_extra(PyObject* ob) {
+    for (std::size_t extra = 0; extra < std::size(lit_next); ++extra) {
+        if (ob == lit_next[extra]) {
+            return static_cast<int>(extra);
+        }
+    }
+    return -1;
+}
+
+PyObject* resume(PyGenObject* gen, PyFrameObject* f, int throwflag);
+
 PyObject* jump(PyGenObject* gen, PyObject* arg) {
-    PyThreadState* tstate = PyThreadState_GET();
     PyFrameObject* f = gen->gi_frame;
 
     if (gen->gi_running) {
@@ -18,6 +241,11 @@ PyObject* jump(PyGenObject* gen, PyObject* arg) {
         return nullptr;
     }
 
+    context* ctx = checked_context(f);
+    if (!ctx) {
+        return nullptr;
+    }
+
     if (f->f_lasti == -1) {
         if (arg != Py_None) {
             PyErr_SetString(PyExc_AssertionError, "tried to prime with non None value");
@@ -27,26 +255,36 @@ PyObject* jump(PyGenObject* gen, PyObject* arg) {
     else if (arg != Py_None) {
         // when arg is None we should just send right back in to the same
         // place set the f_lasti to the jump index
-        long idx = PyLong_AsLong(arg);
-        if (PyErr_Occurred()) {
-            return nullptr;
+        long idx;
+        int extra = lit_next_extra(arg);
+        if (extra >= 0) {
+            // the deref jump into the literal pushed the address of the
+            // literal's code, the next cell comes right after that code
+            auto ret = pop_cstack(ctx);
+            if (!ret) {
+                // raise the error inside of the context so that it is
+                // reported and the context is reset like any other error
+                return resume(gen, f, 1);
+            }
+            idx = *ret - INLINE_LITERAL_SIZE - extra;
+        }
+        else {
+            idx = PyLong_AsLong(arg);
+            if (PyErr_Occurred()) {
+                return nullptr;
+            }
         }
+        ++ctx->dispatches;
 
         if (idx < 0) {
             // idx < 0 means we do a deref jump, this is used to implement
             // the DTC model. Note that we are using the absolute value
             // as the address, the sign is just used to say what kind of
             // jump to use.
-            PyObject* cstack = f->f_localsplus[CSTACK];
-            PyObject* new_ix = PyLong_FromLong(idx - 2);
-            if (!new_ix) {
-                return nullptr;
-            }
-            int err = PyList_Append(cstack, new_ix);
-            Py_DECREF(new_ix);
-            if (err) {
+            if (!push_cstack(ctx, idx - 2)) {
                 return nullptr;
             }
+            ++ctx->deref_jumps;
             idx = *reinterpret_cast<std::uint16_t*>(
                 &PyBytes_AS_STRING(f->f_code->co_code)[-idx]);
         }
@@ -54,6 +292,40 @@ PyObject* jump(PyGenObject* gen, PyObject* arg) {
         f->f_lasti = idx;
     }
 
+    // the cstack is also pushed by primitives, sample it before every jump
+    ctx->max_cstack_depth = std::max(ctx->max_cstack_depth,
+                                     static_cast<Py_ssize_t>(ctx->cstack->size()));
+
+    if (!reserve_memory(f)) {
+        return nullptr;
+    }
+
+    int throwflag = 0;
+    if (!(f = reserve_stack(gen, 0))) {
+        if (!PyErr_ExceptionMatches(stack_overflow)) {
+            return nullptr;
+        }
+        // raise the overflow inside of the context so that it is reported
+        // and the context is reset like any other error
+        f = gen->gi_frame;
+        throwflag = 1;
+    }
+
+    return resume(gen, f, throwflag);
+}
+
+/**
+   Resume a suspended context.
+
+   @param gen The context.
+   @param f The frame of the context.
+   @param throwflag Raise the current exception inside of the context instead
+                    of resuming at `f_lasti`.
+   @return The value yielded by the context.
+*/
+PyObject* resume(PyGenObject* gen, PyFrameObject* f, int throwflag) {
+    PyThreadState* tstate = PyThreadState_GET();
+
     /* Generators always return to their most recent caller, not
      * necessarily their creator. */
     Py_XINCREF(tstate->frame);
@@ -61,7 +333,7 @@ PyObject* jump(PyGenObject* gen, PyObject* arg) {
     f->f_back = tstate->frame;
 
     gen->gi_running = 1;
-    PyObject* result = PyEval_EvalFrameEx(f, 0);
+    PyObject* result = PyEval_EvalFrameEx(f, throwflag);
     gen->gi_running = 0;
 
     /* Don't keep the reference to f_back any longer than necessary.  It
@@ -99,41 +371,740 @@ PyObject* jump(PyGenObject* gen, PyObject* arg) {
         }
     }
     else {
+        context* ctx = frame_context(f);
+        Py_ssize_t depth = f->f_stacktop - f->f_valuestack;
+        ctx->max_stack_depth = std::max(ctx->max_stack_depth, depth);
+
         // set the stack size for use later
-        PyObject* stack_size = PyLong_FromLong(f->f_stacktop - f->f_valuestack);
-        if (!stack_size) {
-            Py_CLEAR(result);
+        ctx->stack_size = depth;
+    }
+
+    return result;
+}
+
+/**
+   The operations of a native kernel. Each operation is named after the
+   builtin word that it implements.
+*/
+enum class op : std::uint8_t {
+    lit,
+    add,
+    sub,
+    mul,
+    mod,
+    bit_and,
+    bit_or,
+    bit_xor,
+    lshift,
+    rshift,
+    eq,
+    ne,
+    lt,
+    le,
+    gt,
+    ge,
+    swap,
+    drop,
+    dup,
+    dup2,
+    rot,
+    over,
+    nip,
+    nop,
+    fetch,
+    bfetch,
+    store,
+    bstore,
+};
+
+struct op_info {
+    const char* name;
+    op code;
+    Py_ssize_t pops;
+    Py_ssize_t pushes;
+};
+
+constexpr op_info ops[] = {
+    {"lit", op::lit, 0, 1},
+    {"+", op::add, 2, 1},
+    {"-", op::sub, 2, 1},
+    {"*", op::mul, 2, 1},
+    {"mod", op::mod, 2, 1},
+    {"&", op::bit_and, 2, 1},
+    {"|", op::bit_or, 2, 1},
+    {"^", op::bit_xor, 2, 1},
+    {"xor", op::bit_xor, 2, 1},
+    {"<<", op::lshift, 2, 1},
+    {">>", op::rshift, 2, 1},
+    {"=", op::eq, 2, 1},
+    {"<>", op::ne, 2, 1},
+    {"<", op::lt, 2, 1},
+    {"<=", op::le, 2, 1},
+    {">", op::gt, 2, 1},
+    {">=", op::ge, 2, 1},
+    {"swap", op::swap, 2, 2},
+    {"drop", op::drop, 1, 0},
+    {"dup", op::dup, 1, 2},
+    {"2dup", op::dup2, 2, 4},
+    {"rot", op::rot, 3, 3},
+    {"over", op::over, 2, 3},
+    {"nip", op::nip, 2, 1},
+    {"nop", op::nop, 0, 0},
+    {"@", op::fetch, 1, 1},
+    {"b@", op::bfetch, 1, 1},
+    {"!", op::store, 2, 0},
+    {"b!", op::bstore, 2, 0},
+};
+
+struct instr {
+    op code;
+    std::int64_t arg;
+};
+
+/**
+   A colon definition compiled to run on native 64 bit cells.
+
+   When a context yields a kernel, the runner copies the kernel's arguments
+   off of the data stack into an array of `int64_t`, runs the kernel over the
+   array, pushes the results back onto the data stack, and then returns like
+   `exit`.
+*/
+struct kernel {
+    PyObject ob;
+    PyObject* name;
+    // the ``(name, arg)`` pairs the kernel was built from
+    PyObject* program;
+    std::vector<instr>* code;
+    // the native stack, reused between runs
+    std::vector<std::int64_t>* cells;
+    Py_ssize_t nargs;
+    Py_ssize_t nresults;
+};
+
+kernel* newkernel(PyTypeObject* cls, PyObject* args, PyObject* kwargs) {
+    const char* const keywords[] = {"name", "program", nullptr};
+
+    PyObject* name;
+    PyObject* program_ob;
+    if (!PyArg_ParseTupleAndKeywords(args,
+                                     kwargs,
+                                     "UO:Kernel",
+                                     const_cast<char**>(keywords),
+                                     &name,
+                                     &program_ob)) {
+        return nullptr;
+    }
+
+    PyObject* program = PySequence_Tuple(program_ob);
+    if (!program) {
+        return nullptr;
+    }
+
+    auto code = std::make_unique<std::vector<instr>>();
+    Py_ssize_t depth = 0;
+    Py_ssize_t low = 0;
+    Py_ssize_t high = 0;
+    for (Py_ssize_t ix = 0; ix < PyTuple_GET_SIZE(program); ++ix) {
+        const char* op_name;
+        long long arg;
+        if (!PyArg_ParseTuple(PyTuple_GET_ITEM(program, ix),
+                              "sL:Kernel",
+                              &op_name,
+                              &arg)) {
+            Py_DECREF(program);
             return nullptr;
         }
-        Py_DECREF(f->f_localsplus[STACK_SIZE]);
-        f->f_localsplus[STACK_SIZE] = stack_size;
+
+        const op_info* info = nullptr;
+        for (const op_info& candidate : ops) {
+            if (!std::strcmp(candidate.name, op_name)) {
+                info = &candidate;
+                break;
+            }
+        }
+        if (!info) {
+            PyErr_Format(PyExc_ValueError, "'%s' has no native implementation", op_name);
+            Py_DECREF(program);
+            return nullptr;
+        }
+
+        code->push_back({info->code, arg});
+        depth -= info->pops;
+        low = std::min(low, depth);
+        depth += info->pushes;
+        high = std::max(high, depth);
     }
 
-    return result;
+    kernel* self = PyObject_New(kernel, cls);
+    if (!self) {
+        Py_DECREF(program);
+        return nullptr;
+    }
+
+    Py_INCREF(name);
+    self->name = name;
+    self->program = program;
+    self->code = code.release();
+    // the arguments are the values below the lowest depth the kernel reaches
+    self->nargs = -low;
+    self->nresults = depth - low;
+    self->cells = new std::vector<std::int64_t>(std::max<Py_ssize_t>(high - low, 1));
+    return self;
 }
 
-PyObject* prime(PyGenObject* gen) {
-    return jump(gen, Py_None);
+void deallocate_kernel(kernel* self) {
+    Py_CLEAR(self->name);
+    Py_CLEAR(self->program);
+    delete self->code;
+    delete self->cells;
+    PyObject_Del(self);
 }
 
-PyObject* jump_handler(PyObject*, PyObject* gen) {
-    if (!PyGen_CheckExact(gen)) {
-        PyErr_SetString(PyExc_AssertionError, "gen must be a generator");
+PyObject* kernelrepr(kernel* self) {
+    return PyUnicode_FromFormat("<Kernel %R: nargs=%zd, nresults=%zd>",
+                                self->name,
+                                self->nargs,
+                                self->nresults);
+}
+
+PyMemberDef kernel_members[] = {
+    {"name", T_OBJECT_EX, offsetof(kernel, name), READONLY, ""},
+    {"program", T_OBJECT_EX, offsetof(kernel, program), READONLY, ""},
+    {"nargs", T_PYSSIZET, offsetof(kernel, nargs), READONLY, ""},
+    {"nresults", T_PYSSIZET, offsetof(kernel, nresults), READONLY, ""},
+    {nullptr},
+};
+
+PyTypeObject kerneltype = {
+    PyVarObject_HEAD_INIT(&PyType_Type, 0) "phorth.Kernel",  // tp_name
+    sizeof(kernel),                                          // tp_basicsize
+    0,                                                       // tp_itemsize
+    (destructor) deallocate_kernel,                          // tp_dealloc
+    0,                                                       // tp_print
+    0,                                                       // tp_getattr
+    0,                                                       // tp_setattr
+    0,                                                       // tp_reserved
+    (reprfunc) kernelrepr,                                   // tp_repr
+    0,                                                       // tp_as_number
+    0,                                                       // tp_as_sequence
+    0,                                                       // tp_as_mapping
+    0,                                                       // tp_hash
+    0,                                                       // tp_call
+    0,                                                       // tp_str
+    0,                                                       // tp_getattro
+    0,                                                       // tp_setattro
+    0,                                                       // tp_as_buffer
+    Py_TPFLAGS_DEFAULT,                                      // tp_flags
+    0,                                                       // tp_doc
+    0,                                                       // tp_traverse
+    0,                                                       // tp_clear
+    0,                                                       // tp_richcompare
+    0,                                                       // tp_weaklistoffset
+    0,                                                       // tp_iter
+    0,                                                       // tp_iternext
+    0,                                                       // tp_methods
+    kernel_members,                                          // tp_members
+    0,                                                       // tp_getset
+    0,                                                       // tp_base
+    0,                                                       // tp_dict
+    0,                                                       // tp_descr_get
+    0,                                                       // tp_descr_set
+    0,                                                       // tp_dictoffset
+    0,                                                       // tp_init
+    0,                                                       // tp_alloc
+    (newfunc) newkernel,                                     // tp_new
+};
+
+namespace {
+// arithmetic on cells wraps around like unsigned arithmetic
+std::int64_t wrap(std::uint64_t n) {
+    return static_cast<std::int64_t>(n);
+}
+
+std::int64_t floor_mod(std::int64_t a, std::int64_t b) {
+    if (b == -1) {
+        // INT64_MIN % -1 overflows
+        return 0;
+    }
+    std::int64_t r = a % b;
+    if (r && ((r < 0) != (b < 0))) {
+        r += b;
+    }
+    return r;
+}
+
+/**
+   Get a pointer to `width` bytes of the memory of a context.
+*/
+char* cell_memory(PyFrameObject* f, std::int64_t addr, std::int64_t width) {
+    Py_ssize_t size = PyBytes_GET_SIZE(f->f_code->co_code);
+    if (addr < 0 || addr + width > size) {
+        PyErr_Format(PyExc_IndexError,
+                     "address %lld is out of range for a memory of %zd bytes",
+                     static_cast<long long>(addr),
+                     size);
+        return nullptr;
+    }
+    return &PyBytes_AS_STRING(f->f_code->co_code)[addr];
+}
+
+/**
+   Run the instructions of a kernel over its native stack.
+
+   @return The depth of the native stack, or -1 with an exception raised.
+*/
+Py_ssize_t run_cells(PyFrameObject* f, kernel* k, Py_ssize_t top) {
+    std::int64_t* s = k->cells->data();
+
+    for (const instr& i : *k->code) {
+        std::int64_t a;
+        std::int64_t b;
+        std::int64_t c;
+        switch (i.code) {
+        case op::lit:
+            s[top++] = i.arg;
+            continue;
+        case op::swap:
+            std::swap(s[top - 1], s[top - 2]);
+            continue;
+        case op::drop:
+            --top;
+            continue;
+        case op::dup:
+            s[top] = s[top - 1];
+            ++top;
+            continue;
+        case op::dup2:
+            s[top] = s[top - 2];
+            s[top + 1] = s[top - 1];
+            top += 2;
+            continue;
+        case op::rot:
+            // ROT_THREE: the top moves down to the third position
+            c = s[top - 1];
+            s[top - 1] = s[top - 2];
+            s[top - 2] = s[top - 3];
+            s[top - 3] = c;
+            continue;
+        case op::over:
+            s[top] = s[top - 2];
+            ++top;
+            continue;
+        case op::nip:
+            s[top - 2] = s[top - 1];
+            --top;
+            continue;
+        case op::nop:
+            continue;
+        case op::fetch: {
+            char* p = cell_memory(f, s[top - 1], 2);
+            if (!p) {
+                return -1;
+            }
+            std::uint16_t n;
+            std::memcpy(&n, p, sizeof(n));
+            s[top - 1] = n;
+            continue;
+        }
+        case op::bfetch: {
+            char* p = cell_memory(f, s[top - 1], 1);
+            if (!p) {
+                return -1;
+            }
+            s[top - 1] = static_cast<std::uint8_t>(*p);
+            continue;
+        }
+        case op::store: {
+            // ( addr n -- )
+            char* p = cell_memory(f, s[top - 2], 2);
+            if (!p) {
+                return -1;
+            }
+            auto n = static_cast<std::uint16_t>(s[top - 1]);
+            std::memcpy(p, &n, sizeof(n));
+            top -= 2;
+            continue;
+        }
+        case op::bstore: {
+            char* p = cell_memory(f, s[top - 2], 1);
+            if (!p) {
+                return -1;
+            }
+            *p = static_cast<char>(s[top - 1]);
+            top -= 2;
+            continue;
+        }
+        default:
+            break;
+        }
+
+        // binary operators
+        b = s[--top];
+        a = s[top - 1];
+        switch (i.code) {
+        case op::add:
+            c = wrap(static_cast<std::uint64_t>(a) + static_cast<std::uint64_t>(b));
+            break;
+        case op::sub:
+            c = wrap(static_cast<std::uint64_t>(a) - static_cast<std::uint64_t>(b));
+            break;
+        case op::mul:
+            c = wrap(static_cast<std::uint64_t>(a) * static_cast<std::uint64_t>(b));
+            break;
+        case op::mod:
+            if (!b) {
+                PyErr_SetString(PyExc_ZeroDivisionError,
+                                "integer division or modulo by zero");
+                return -1;
+            }
+            c = floor_mod(a, b);
+            break;
+        case op::bit_and:
+            c = a & b;
+            break;
+        case op::bit_or:
+            c = a | b;
+            break;
+        case op::bit_xor:
+            c = a ^ b;
+            break;
+        case op::lshift:
+        case op::rshift:
+            if (b < 0) {
+                PyErr_SetString(PyExc_ValueError, "negative shift count");
+                return -1;
+            }
+            if (i.code == op::lshift) {
+                c = (b >= 64) ? 0 : wrap(static_cast<std::uint64_t>(a) << b);
+            }
+            else {
+                c = (b >= 64) ? (a < 0 ? -1 : 0) : a >> b;
+            }
+            break;
+        case op::eq:
+            c = a == b;
+            break;
+        case op::ne:
+            c = a != b;
+            break;
+        case op::lt:
+            c = a < b;
+            break;
+        case op::le:
+            c = a <= b;
+            break;
+        case op::gt:
+            c = a > b;
+            break;
+        case op::ge:
+            c = a >= b;
+            break;
+        default:
+            PyErr_SetString(PyExc_AssertionError, "unknown kernel op");
+            return -1;
+        }
+        s[top - 1] = c;
+    }
+
+    return top;
+}
+}  // namespace
+
+/**
+   Run a kernel yielded by a suspended context.
+
+   The data stack is only changed if the kernel succeeds.
+
+   @return The address to jump to next, popped from the cstack; or nullptr
+           with an exception raised.
+*/
+PyObject* run_kernel(PyGenObject* gen, kernel* k) {
+    PyFrameObject* f = gen->gi_frame;
+    Py_ssize_t depth = f->f_stacktop - f->f_valuestack;
+    if (depth < k->nargs) {
+        PyErr_Format(PyExc_IndexError,
+                     "stack underflow: %R needs %zd values but the stack has %zd",
+                     k->name,
+                     k->nargs,
+                     depth);
+        return nullptr;
+    }
+
+    context* ctx = frame_context(f);
+    if (ctx->cstack->empty()) {
+        PyErr_SetString(PyExc_IndexError, "pop from empty cstack");
+        return nullptr;
+    }
+
+    // unbox the arguments, values outside of the range of a cell wrap around
+    std::int64_t* cells = k->cells->data();
+    PyObject** args = f->f_stacktop - k->nargs;
+    for (Py_ssize_t ix = 0; ix < k->nargs; ++ix) {
+        if (!PyLong_Check(args[ix])) {
+            PyErr_Format(PyExc_TypeError,
+                         "%R only accepts ints, got %R",
+                         k->name,
+                         args[ix]);
+            return nullptr;
+        }
+        unsigned long long n = PyLong_AsUnsignedLongLongMask(args[ix]);
+        if (n == static_cast<unsigned long long>(-1) && PyErr_Occurred()) {
+            return nullptr;
+        }
+        cells[ix] = wrap(n);
+    }
+
+    Py_ssize_t top = run_cells(f, k, k->nargs);
+    if (top < 0) {
         return nullptr;
     }
 
-    PyObject* jump_index = prime(reinterpret_cast<PyGenObject*>(gen));
-    while (jump_index) {
-        PyObject* tmp = jump(reinterpret_cast<PyGenObject*>(gen), jump_index);
+    if (!(f = reserve_stack(gen, top))) {
+        return nullptr;
+    }
+
+    std::vector<PyObject*> results(top);
+    for (Py_ssize_t ix = 0; ix < top; ++ix) {
+        if (!(results[ix] = PyLong_FromLongLong(cells[ix]))) {
+            for (Py_ssize_t jx = 0; jx < ix; ++jx) {
+                Py_DECREF(results[jx]);
+            }
+            return nullptr;
+        }
+    }
+
+    // replace the arguments with the results
+    for (Py_ssize_t ix = 0; ix < k->nargs; ++ix) {
+        Py_DECREF(*--f->f_stacktop);
+    }
+    for (PyObject* result : results) {
+        *f->f_stacktop++ = result;
+    }
+
+    // return like exit
+    return PyLong_FromLong(*pop_cstack(ctx));
+}
+
+/**
+   Run a context until it suspends itself.
+
+   @param g The context.
+   @param jump_index The value yielded by the context, or None to resume it
+                     in place. This reference is stolen.
+   @return The value the context suspended itself with.
+*/
+PyObject* run(PyGenObject* g, PyObject* jump_index) {
+    // The context yields integers to jump, None to sync the frame, kernels
+    // to run native code and `lit_next` values to continue the thread after
+    // an inline literal; any other value suspends the context and is returned
+    // to the caller, who may resume it later.
+    while (jump_index && (jump_index == Py_None || PyLong_Check(jump_index) ||
+                          Py_TYPE(jump_index) == &kerneltype ||
+                          lit_next_extra(jump_index) >= 0)) {
+        PyObject* tmp;
+        if (Py_TYPE(jump_index) == &kerneltype) {
+            PyObject* addr = run_kernel(g, reinterpret_cast<kernel*>(jump_index));
+            if (addr) {
+                tmp = jump(g, addr);
+                Py_DECREF(addr);
+            }
+            else {
+                // raise the error inside of the context so that it is
+                // reported and the context is reset like any other error
+                tmp = resume(g, g->gi_frame, 1);
+            }
+        }
+        else {
+            tmp = jump(g, jump_index);
+        }
         Py_DECREF(jump_index);
         jump_index = tmp;
     }
 
-    return nullptr;
+    return jump_index;
+}
+
+PyObject* jump_handler(PyObject*, PyObject* args) {
+    PyObject* gen;
+    PyObject* jump_index = Py_None;
+    if (!PyArg_ParseTuple(args, "O|O:jump_handler", &gen, &jump_index)) {
+        return nullptr;
+    }
+
+    if (!PyGen_CheckExact(gen)) {
+        PyErr_SetString(PyExc_AssertionError, "gen must be a generator");
+        return nullptr;
+    }
+
+    Py_INCREF(jump_index);
+    return run(reinterpret_cast<PyGenObject*>(gen), jump_index);
+}
+
+/**
+   Get the frame of a suspended phorth context.
+*/
+PyFrameObject* suspended_frame(PyObject* gen) {
+    if (!PyGen_CheckExact(gen)) {
+        PyErr_SetString(PyExc_AssertionError, "gen must be a generator");
+        return nullptr;
+    }
+
+    auto g = reinterpret_cast<PyGenObject*>(gen);
+    if (g->gi_running) {
+        PyErr_SetString(PyExc_ValueError, "generator already executing");
+        return nullptr;
+    }
+
+    PyFrameObject* f = g->gi_frame;
+    if (!(f && f->f_stacktop)) {
+        PyErr_SetString(PyExc_ValueError, "context is not suspended");
+        return nullptr;
+    }
+
+    return f;
+}
+
+/**
+   The number of values on the data stack of a suspended context.
+*/
+PyObject* stack_depth(PyObject*, PyObject* gen) {
+    PyFrameObject* f;
+    if (!(f = suspended_frame(gen))) {
+        return nullptr;
+    }
+
+    return PyLong_FromSsize_t(f->f_stacktop - f->f_valuestack);
+}
+
+/**
+   Push a tuple of values onto the data stack of a suspended context.
+*/
+PyObject* push_values(PyObject*, PyObject* args) {
+    PyObject* gen;
+    PyObject* values;
+    if (!PyArg_ParseTuple(args, "OO!:push_values", &gen, &PyTuple_Type, &values)) {
+        return nullptr;
+    }
+
+    PyFrameObject* f;
+    if (!suspended_frame(gen)) {
+        return nullptr;
+    }
+
+    Py_ssize_t n = PyTuple_GET_SIZE(values);
+    if (!(f = reserve_stack(reinterpret_cast<PyGenObject*>(gen), n))) {
+        return nullptr;
+    }
+
+    for (Py_ssize_t ix = 0; ix < n; ++ix) {
+        PyObject* value = PyTuple_GET_ITEM(values, ix);
+        Py_INCREF(value);
+        *f->f_stacktop++ = value;
+    }
+
+    Py_RETURN_NONE;
+}
+
+/**
+   Pop values from the data stack of a suspended context.
+
+   @return A tuple of the values, bottom first.
+*/
+PyObject* pop_values(PyObject*, PyObject* args) {
+    PyObject* gen;
+    Py_ssize_t n;
+    if (!PyArg_ParseTuple(args, "On:pop_values", &gen, &n)) {
+        return nullptr;
+    }
+
+    PyFrameObject* f;
+    if (!(f = suspended_frame(gen))) {
+        return nullptr;
+    }
+
+    if (n < 0 || n > f->f_stacktop - f->f_valuestack) {
+        PyErr_Format(PyExc_IndexError,
+                     "cannot pop %zd values from a stack of %zd",
+                     n,
+                     f->f_stacktop - f->f_valuestack);
+        return nullptr;
+    }
+
+    PyObject* out = PyTuple_New(n);
+    if (!out) {
+        return nullptr;
+    }
+
+    // the stack's references are moved into the tuple
+    f->f_stacktop -= n;
+    for (Py_ssize_t ix = 0; ix < n; ++ix) {
+        PyTuple_SET_ITEM(out, ix, f->f_stacktop[ix]);
+    }
+
+    return out;
+}
+
+/**
+   Push a return address onto the cstack of a suspended context.
+*/
+PyObject* push_return(PyObject*, PyObject* args) {
+    PyObject* gen;
+    long addr;
+    if (!PyArg_ParseTuple(args, "Ol:push_return", &gen, &addr)) {
+        return nullptr;
+    }
+
+    PyFrameObject* f;
+    context* ctx;
+    if (!((f = suspended_frame(gen)) && (ctx = checked_context(f)))) {
+        return nullptr;
+    }
+
+    if (!push_cstack(ctx, addr)) {
+        return nullptr;
+    }
+
+    Py_RETURN_NONE;
+}
+
+/**
+   Raise an exception inside of a suspended context so that it is reported
+   and the context is reset like any other error, then run the context until
+   it suspends itself again.
+
+   @param gen The context.
+   @param exc The exception to raise.
+   @return The value the context suspended itself with.
+*/
+PyObject* throw_exception(PyObject*, PyObject* args) {
+    PyObject* gen;
+    PyObject* exc;
+    if (!PyArg_ParseTuple(args, "OO:throw", &gen, &exc)) {
+        return nullptr;
+    }
+
+    if (!PyExceptionInstance_Check(exc)) {
+        PyErr_Format(PyExc_TypeError, "expected an exception, got %R", exc);
+        return nullptr;
+    }
+
+    PyFrameObject* f = suspended_frame(gen);
+    if (!(f && checked_context(f))) {
+        return nullptr;
+    }
+
+    auto g = reinterpret_cast<PyGenObject*>(gen);
+    PyErr_SetObject(reinterpret_cast<PyObject*>(Py_TYPE(exc)), exc);
+    return run(g, resume(g, f, 1));
 }
 
 static PyMethodDef methods[] = {
-    {"jump_handler", reinterpret_cast<PyCFunction>(jump_handler), METH_O, nullptr},
+    {"jump_handler", reinterpret_cast<PyCFunction>(jump_handler), METH_VARARGS, nullptr},
+    {"stack_depth", reinterpret_cast<PyCFunction>(stack_depth), METH_O, nullptr},
+    {"push_values", reinterpret_cast<PyCFunction>(push_values), METH_VARARGS, nullptr},
+    {"pop_values", reinterpret_cast<PyCFunction>(pop_values), METH_VARARGS, nullptr},
+    {"push_return", reinterpret_cast<PyCFunction>(push_return), METH_VARARGS, nullptr},
+    {"throw", reinterpret_cast<PyCFunction>(throw_exception), METH_VARARGS, nullptr},
     {nullptr},
 };
 
@@ -148,6 +1119,101 @@ static struct PyModuleDef module = {
 };
 
 PyMODINIT_FUNC PyInit__runner(void) {
-    return PyModule_Create(&module);
+    if (PyType_Ready(&kerneltype)) {
+        return nullptr;
+    }
+
+    PyObject* m = PyModule_Create(&module);
+    if (!m) {
+        return nullptr;
+    }
+
+    if (PyObject_SetAttrString(m, "Kernel", reinterpret_cast<PyObject*>(&kerneltype))) {
+        Py_DECREF(m);
+        return nullptr;
+    }
+
+    // the names of the operations that a kernel may be built from
+    PyObject* kernel_ops = PyTuple_New(std::size(ops));
+    if (!kernel_ops) {
+        Py_DECREF(m);
+        return nullptr;
+    }
+    for (std::size_t ix = 0; ix < std::size(ops); ++ix) {
+        PyObject* name = PyUnicode_FromString(ops[ix].name);
+        if (!name) {
+            Py_DECREF(kernel_ops);
+            Py_DECREF(m);
+            return nullptr;
+        }
+        PyTuple_SET_ITEM(kernel_ops, ix, name);
+    }
+    if (PyModule_AddObject(m, "kernel_ops", kernel_ops)) {
+        Py_DECREF(kernel_ops);
+        Py_DECREF(m);
+        return nullptr;
+    }
+
+    PyObject* lit_next_ob = PyTuple_New(std::size(lit_next));
+    if (!lit_next_ob) {
+        Py_DECREF(m);
+        return nullptr;
+    }
+    for (std::size_t extra = 0; extra < std::size(lit_next); ++extra) {
+        PyObject* marker = PyObject_CallObject(
+            reinterpret_cast<PyObject*>(&PyBaseObject_Type), nullptr);
+        if (!marker) {
+            Py_DECREF(lit_next_ob);
+            Py_DECREF(m);
+            return nullptr;
+        }
+        // the tuple is owned by the module for the lifetime of the process
+        lit_next[extra] = marker;
+        PyTuple_SET_ITEM(lit_next_ob, extra, marker);
+    }
+    if (PyModule_AddObject(m, "lit_next", lit_next_ob)) {
+        Py_DECREF(lit_next_ob);
+        Py_DECREF(m);
+        return nullptr;
+    }
+
+    stack_overflow = PyErr_NewExceptionWithDoc(
+        "phorth.StackOverflow",
+        "Raised when the data stack of a phorth context is full.",
+        PyExc_OverflowError,
+        nullptr);
+    if (!stack_overflow) {
+        Py_DECREF(m);
+        return nullptr;
+    }
+
+    Py_INCREF(stack_overflow);
+    if (PyModule_AddObject(m, "StackOverflow", stack_overflow)) {
+        Py_DECREF(stack_overflow);
+        Py_DECREF(m);
+        return nullptr;
+    }
+
+    PyObject* primitives = PyImport_ImportModule("phorth._primitives");
+    if (!primitives) {
+        Py_DECREF(m);
+        return nullptr;
+    }
+    PyObject* context_ob = PyObject_GetAttrString(primitives, "Context");
+    Py_DECREF(primitives);
+    if (!context_ob) {
+        Py_DECREF(m);
+        return nullptr;
+    }
+    if (!PyType_Check(context_ob)) {
+        PyErr_SetString(PyExc_TypeError, "phorth._primitives.Context is not a type");
+        Py_DECREF(context_ob);
+        Py_DECREF(m);
+        return nullptr;
+    }
+    // the module holds the reference for the lifetime of the process
+    context_type = reinterpret_cast<PyTypeObject*>(context_ob);
+
+    return m;
 }
 }  // namespace phorth
@@ -0,0 +1,266 @@
+from collections import deque
+import os.path as pth
+
+
+# the words which start a definition that ends with ``;``
+_openers = frozenset({':', 'memo:'})
+
+
+def _references(words):
+    """The words which may be references to other words, skipping ``( )``
+    comments.
+    """
+    comment = False
+    for word in words:
+        if comment:
+            comment = word != ')'
+        elif word == '(':
+            comment = True
+        else:
+            yield word
+
+
+class Definition:
+    """A colon definition in a library.
+
+    Parameters
+    ----------
+    name : str
+        The name of the word.
+    tokens : list[str]
+        The words of the definition, from ``:`` through ``;``.
+    origin : str
+        The file the definition was read from.
+    lines : tuple[int, int]
+        The first and last line of the definition in ``origin``.
+    """
+    def __init__(self, name, tokens, origin, lines):
+        self.name = name
+        self.tokens = tokens
+        self.origin = origin
+        self.lines = lines
+        # the names of the other definitions this one calls, set by the index
+        self.dependencies = frozenset()
+
+    def __repr__(self):
+        return '<Definition %r: %s:%d-%d>' % (
+            self.name,
+            self.origin,
+            self.lines[0],
+            self.lines[1],
+        )
+
+
+class AutoloadIndex:
+    """An index of the definitions in phorth libraries which are compiled the
+    first time they are referenced.
+
+    Notes
+    -----
+    A library is split into colon definitions and everything else. The
+    definitions are indexed by name along with the other definitions that
+    they reference. Everything else is the library's preamble, which is run
+    when the library is loaded because it may have side effects.
+
+    When a library defines a name more than once, the last definition wins.
+    """
+    def __init__(self):
+        self.definitions = {}
+        self.preamble = []
+
+    def add_source(self, source, origin='<string>'):
+        """Index the definitions in phorth source code.
+
+        Parameters
+        ----------
+        source : str
+            The source code.
+        origin : str, optional
+            The name of the file the source was read from.
+        """
+        current = None
+        start = None
+        for lineno, line in enumerate(source.splitlines(), 1):
+            for word in line.split():
+                word = word.lower()
+                if current is None:
+                    if word in _openers:
+                        current = [word]
+                        start = lineno
+                    else:
+                        self.preamble.append(word)
+                    continue
+
+                current.append(word)
+                if word == ';':
+                    if len(current) > 2:
+                        name = current[1]
+                        self.definitions[name] = Definition(
+                            name,
+                            current,
+                            origin,
+                            (start, lineno),
+                        )
+                    current = None
+
+        if current is not None:
+            raise ValueError(
+                '%s:%d: unterminated definition of %r' % (
+                    origin,
+                    start,
+                    current[1] if len(current) > 1 else None,
+                ),
+            )
+
+        self._resolve()
+
+    def add_file(self, path):
+        """Index the definitions in a phorth source file.
+
+        Parameters
+        ----------
+        path : str
+            The path to the file.
+        """
+        with open(path) as f:
+            self.add_source(f.read(), path)
+
+    def _resolve(self):
+        definitions = self.definitions
+        for name, definition in definitions.items():
+            definition.dependencies = frozenset(
+                word for word in _references(definition.tokens[2:])
+                if word in definitions and word != name
+            )
+
+    def tokens_for(self, names, defined):
+        """The words which define some library words and everything they
+        depend on.
+
+        Parameters
+        ----------
+        names : iterable[str]
+            The words which are about to be used. Names which are not in the
+            index are ignored.
+        defined : container[str]
+            The words which are already defined.
+
+        Returns
+        -------
+        tokens : list[str]
+            The definitions, with each word's dependencies defined first.
+        """
+        definitions = self.definitions
+        tokens = []
+        seen = set()
+
+        def visit(name):
+            if name in seen or name in defined or name not in definitions:
+                return
+            seen.add(name)
+            definition = definitions[name]
+            for dependency in sorted(definition.dependencies):
+                visit(dependency)
+            tokens.extend(definition.tokens)
+
+        for name in names:
+            visit(name)
+        return tokens
+
+
+def stdlib_index():
+    """Create an index of ``stdlib.fs``.
+
+    Returns
+    -------
+    index : AutoloadIndex
+        The index.
+    """
+    index = AutoloadIndex()
+    index.add_file(pth.join(pth.dirname(__file__), 'stdlib.fs'))
+    return index
+
+
+class Autoloader:
+    """A word reader which defines library words before they are used.
+
+    Parameters
+    ----------
+    index : AutoloadIndex
+        The library words.
+    read_word : callable[[], str or None]
+        The function which reads the next word. It may return None to suspend
+        the context until more input is available.
+    preamble : bool, optional
+        Define the words of the index's preamble before the first word read.
+        Pass False when the context already has them, like a context rebuilt
+        from a copy of another context.
+
+    Notes
+    -----
+    A definition cannot be compiled in the middle of another definition, so
+    when the reader sees ``:`` it reads ahead to the matching ``;`` before
+    handing the definition to the context. Any library words referenced by
+    the definition, or by a word outside of a definition, which are not in
+    :attr:`dictionary` are defined first.
+
+    If the input runs out in the middle of a definition the words read so far
+    are held in :attr:`pending` until the rest of the definition arrives.
+    """
+    def __init__(self, index, read_word, *, preamble=True):
+        self.index = index
+        self._read_word = read_word
+        self._ready = deque(index.preamble if preamble else ())
+        self.pending = []
+        # the context's dictionary, set once the context is built
+        self.dictionary = {}
+
+    def require(self, names):
+        """Define library words the next time the context reads a word.
+
+        Parameters
+        ----------
+        names : iterable[str]
+            The words to define.
+
+        Returns
+        -------
+        queued : bool
+            Were any words queued?
+        """
+        tokens = self.index.tokens_for(names, self.dictionary)
+        self._ready.extend(tokens)
+        return bool(tokens)
+
+    def clear(self):
+        """Discard the words which have been read or queued but not handed to
+        the context.
+        """
+        self._ready.clear()
+        self.pending.clear()
+
+    def _release(self, words):
+        # the name of a definition is not a reference
+        self.require(_references(
+            words[2:] if words[0] in _openers else words,
+        ))
+        self._ready.extend(words)
+
+    def __call__(self):
+        ready = self._ready
+        pending = self.pending
+        while not ready:
+            word = self._read_word()
+            if word is None:
+                return None
+
+            if pending or word in _openers:
+                pending.append(word)
+                if word == ';':
+                    self._release(pending)
+                    pending.clear()
+                continue
+
+            self._release((word,))
+
+        return ready.popleft()
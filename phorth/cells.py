@@ -0,0 +1,172 @@
+from dis import opmap
+
+from ._primitives import Word, append_literal, write_memory
+from ._runner import Kernel, kernel_ops
+from .peephole import decode_thread, docol_header
+
+
+_LOAD_CONST = opmap['LOAD_CONST']
+_YIELD_VALUE = opmap['YIELD_VALUE']
+_NOP = opmap['NOP']
+
+# the flags are cells like any other value
+_flags = {'true': 1, 'false': 0}
+
+
+def _wrap(n):
+    """Wrap an int around to a signed 64 bit cell.
+    """
+    return (n + 2 ** 63) % 2 ** 64 - 2 ** 63
+
+
+class IntCells:
+    """The compiler for int cell mode, which compiles colon definitions that
+    only work with ints into native kernels when ``;`` closes them.
+
+    Parameters
+    ----------
+    words : dict[str, Word]
+        The builtin words of the context, including the hidden words.
+    lit_continuation : int
+        The address that inline literals jump to after pushing their value.
+    enabled : bool, optional
+        Compile definitions to kernels? When this is False definitions are
+        left as they were compiled.
+
+    Notes
+    -----
+    A definition is compiled when its thread only holds int literals, the
+    arithmetic, comparison, bitwise, stack and memory builtins, and calls to
+    other compiled definitions, whose kernels are inlined.
+
+    The kernel runs on an array of signed 64 bit cells. Arithmetic wraps
+    around instead of growing, ``true`` and the comparisons produce ``1``
+    instead of ``True``, and values stored with ``!`` and ``b!`` are truncated
+    instead of raising an error. Values are only boxed when they are copied
+    onto or off of the data stack, so a value which does not fit in a cell is
+    wrapped when it is passed to a kernel, and passing anything but an int is
+    an error.
+
+    The code of a compiled definition is replaced by a ``LOAD_CONST`` of the
+    kernel followed by a ``YIELD_VALUE``, which the runner executes in place of
+    the thread, and the memory used by the thread is freed.
+    """
+    def __init__(self, words, lit_continuation, *, enabled=False):
+        self.words = words
+        self.lit_continuation = lit_continuation
+        self.enabled = enabled
+
+        # built on first use because the builtins are compiled in batches
+        self._builtin_names = None
+
+    def _prepare(self):
+        if self._builtin_names is None:
+            self._builtin_names = {w.addr: n for n, w in self.words.items()}
+
+    def kernel_of(self, memory, consts, word):
+        """Get the kernel of a compiled definition.
+
+        Parameters
+        ----------
+        memory : bytes
+            The memory of the context.
+        consts : tuple
+            The ``co_consts`` of the context.
+        word : Word
+            The word to get the kernel of.
+
+        Returns
+        -------
+        kernel : Kernel or None
+            The kernel, or None if ``word`` was not compiled.
+        """
+        addr = word.addr
+        if memory[addr] != _LOAD_CONST or memory[addr + 3] != _YIELD_VALUE:
+            return None
+        kernel = consts[int.from_bytes(memory[addr + 1:addr + 3], 'little')]
+        return kernel if isinstance(kernel, Kernel) else None
+
+    def _program(self, memory, consts, items):
+        exit = self.words['exit']
+        if items[-1:] != [('call', exit)]:
+            return None
+
+        program = []
+        # the runner returns after running the kernel
+        for kind, value in items[:-1]:
+            if kind == 'lit':
+                lit = consts[value]
+                if not isinstance(lit, int):
+                    return None
+                program.append(('lit', _wrap(lit)))
+                continue
+
+            name = self._builtin_names.get(value.addr)
+            if name in _flags:
+                program.append(('lit', _flags[name]))
+            elif name in kernel_ops:
+                program.append((name, 0))
+            else:
+                kernel = self.kernel_of(memory, consts, value)
+                if kernel is None:
+                    return None
+                program.extend(kernel.program)
+
+        return program
+
+    def compile(self, frame, latest, here):
+        """Implementation for the int cell pass of the ; forth word.
+
+        Parameters
+        ----------
+        frame : frame
+            The phorth frame.
+        latest : Word
+            The word whose definition was just closed.
+        here : int
+            The first free memory address, which is the end of the thread.
+
+        Returns
+        -------
+        here : int or None
+            The new first free memory address, or None if the definition was
+            not compiled.
+        """
+        if not (self.enabled and isinstance(latest, Word)):
+            return None
+
+        self._prepare()
+        code = frame.f_code
+        memory = code.co_code
+        consts = code.co_consts
+        addr = latest.addr
+        header = docol_header(self.words['__docol'].addr)
+        if memory[addr:addr + len(header)] != header:
+            # memo: definitions and words created with create
+            return None
+
+        words = {
+            w.addr: w for w in frame.f_globals.values() if isinstance(w, Word)
+        }
+        words.update((w.addr, w) for w in self.words.values())
+        items = decode_thread(
+            memory,
+            words,
+            self.lit_continuation,
+            addr + len(header),
+            here,
+        )
+        if items is None:
+            return None
+
+        program = self._program(memory, consts, items)
+        if program is None:
+            return None
+
+        ix = append_literal(frame, Kernel(latest.name, program))
+        new = bytes((_LOAD_CONST,)) + ix.to_bytes(2, 'little') + bytes((
+            _YIELD_VALUE,
+        ))
+        end = addr + len(new)
+        write_memory(frame, addr, new + bytes((_NOP,)) * (here - end))
+        return end
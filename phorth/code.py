@@ -21,19 +21,37 @@ from .primitives import (
     bwrite_impl,
     create_impl,
     comma_impl,
+    context_stats,
     docol_impl,
     find_impl,
+    forget_impl,
     handle_exception,
     license_impl,
-    lit_impl,
+    max_literals,
     pop_return_addr,
     print_stack_impl,
     process_lit,
     push_return_addr,
+    push_return_impl,
     py_call_impl,
+    py_call_top_impl,
     read_impl,
     write_impl,
 )
+from ._runner import lit_next
+from .cells import IntCells
+from .effects import StackEffects
+from .memo import memo_of, new_memo
+from .peephole import (
+    Peephole,
+    call_word_name,
+    max_call_args,
+    superinstruction_name,
+    superinstructions,
+)
+from .pool import pmap_impl
+from .profiler import sample_impl
+from .subroutine import SubroutineThreading
 
 
 class UnknownWord(Exception):
@@ -46,6 +64,28 @@ class NotAWord(Exception):
     """
 
 
+class Suspend:
+    """A value yielded by a phorth context to suspend itself and return
+    control to the caller of ``jump_handler``.
+
+    Parameters
+    ----------
+    name : str
+        The name of the reason for suspending.
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return '<Suspend: %s>' % self.name
+
+
+# the context needs more input
+idle = Suspend('idle')
+# a word called from Session.map returned
+map_done = Suspend('map_done')
+
+
 _CMP = instructions.COMPARE_OP
 _single_instr_words = {
     '^': instructions.BINARY_XOR,
@@ -65,7 +105,6 @@ _single_instr_words = {
     '2dup': instructions.DUP_TOP_TWO,
     'rot': instructions.ROT_THREE,
     'nop': instructions.NOP,
-    '.': instructions.PRINT_EXPR,
     '=': partial(_CMP, _CMP.comparator.EQ),
     '>': partial(_CMP, _CMP.comparator.GT),
     '>=': partial(_CMP, _CMP.comparator.GE),
@@ -78,13 +117,28 @@ _single_instr_words = {
     'none': partial(instructions.LOAD_CONST, None),
     'here': partial(instructions.LOAD_FAST, 'here'),
     'latest': partial(instructions.LOAD_FAST, 'latest'),
-    '_cstack': partial(instructions.LOAD_FAST, 'cstack'),
 }
 if hasattr(instructions, 'BINARY_MATRIX_MULTIPLY'):
     _single_instr_words['matmul'] = instructions.BINARY_MATRIX_MULTIPLY
 
 
-def build_phorth_ctx(stack_size, memory, word_impl):
+# the amount of memory and stack that a new context starts with
+initial_free_memory = 1024
+initial_stack_size = 256
+
+# offsets into the code of a word defined with memo:
+memo_exit_offset = 6
+memo_docol_offset = 12
+
+
+def build_phorth_ctx(stack_size,
+                     memory,
+                     word_impl,
+                     *,
+                     optimize=True,
+                     int_cells=False,
+                     subroutine_threaded=False,
+                     autoload_index=None):
     """Create a phorth context with the given stack size and memory.
 
     This context will have only the primitive words defined but is ready for
@@ -96,10 +150,23 @@ def build_phorth_ctx(stack_size, memory, word_impl):
         A function which returns the next word to read. When there are no more
         words, this function should raise :class:`phorth.Done``.
     stack_size : int
-        The size of the stack to build in the phorth frame.
+        The maximum number of values on the data stack of the phorth frame.
     memory : int
-        The size of the memory space for the phorth context. This translates
-        to the size of the `co_code`.
+        The maximum size of the memory space for the phorth context. This
+        translates to the size of the `co_code`.
+    optimize : bool, optional
+        Run the peephole optimizer on each colon definition when ``;`` closes
+        it.
+    int_cells : bool, optional
+        Compile colon definitions which only work with ints into native
+        kernels when ``;`` closes them. See :class:`phorth.cells.IntCells`.
+    subroutine_threaded : bool, optional
+        Compile colon definitions to subroutine threaded code when ``;``
+        closes them. See :class:`phorth.subroutine.SubroutineThreading`.
+    autoload_index : AutoloadIndex, optional
+        The library words autoloaded by ``word_impl``. ``py::pmap`` hands it
+        to its workers so they can define library words which this context
+        has not used yet.
 
     Returns
     -------
@@ -108,6 +175,16 @@ def build_phorth_ctx(stack_size, memory, word_impl):
     ctx : Context
         The phorth context object, this is a generator that must be consumed
         by `run_phorth` because the bytecode is non-standard.
+
+    Notes
+    -----
+    When ``word_impl`` returns None the context suspends itself by yielding
+    :data:`idle`. The context may be resumed once more input is available.
+
+    The context starts with a small stack and only a little free memory past
+    ``here``. The runner grows both between jumps, up to ``stack_size`` and
+    ``memory``. Growing the stack past ``stack_size`` raises
+    :class:`phorth.StackOverflow` in the context.
     """
     word_instrs = {}
     order = []
@@ -187,9 +264,50 @@ def build_phorth_ctx(stack_size, memory, word_impl):
         yield instructions.DUP_TOP()
         yield instructions.PRINT_EXPR()
 
+    def flush_output():
+        """Flush the context's output so that it comes before anything that
+        is printed directly to stdout.
+        """
+        yield instructions.LOAD_FAST('out')
+        yield instructions.LOAD_ATTR('flush')
+        yield instructions.CALL_FUNCTION(0)
+        yield instructions.POP_TOP()
+
     def _word():
-        yield instructions.LOAD_CONST(word_impl)
+        read = instructions.LOAD_CONST(word_impl)
+        yield read
         yield instructions.CALL_FUNCTION(0)
+        yield instructions.DUP_TOP()
+        yield instructions.LOAD_CONST(None)
+        yield instructions.COMPARE_OP.IS
+
+        done = instructions.NOP()
+        yield instructions.POP_JUMP_IF_FALSE(done)
+
+        # there is no input available; suspend the context until there is
+        # more
+        yield instructions.POP_TOP()
+        yield instructions.LOAD_CONST(idle)
+        yield instructions.YIELD_VALUE()
+        yield instructions.JUMP_ABSOLUTE(read)
+        yield done
+
+    def _read_comment():
+        """Read the words of a comment up to ``)`` into a list on the stack,
+        suspending the context while there is no input.
+        """
+        yield instructions.BUILD_LIST(0)
+        read = list(_word())
+        yield from read
+        yield instructions.DUP_TOP()
+        yield instructions.LOAD_CONST(')')
+        yield instructions.COMPARE_OP.EQ
+
+        done = instructions.POP_TOP()
+        yield instructions.POP_JUMP_IF_TRUE(done)
+        yield instructions.LIST_APPEND(1)
+        yield instructions.JUMP_ABSOLUTE(read[0])
+        yield done
 
     @builtin()
     def word():
@@ -207,6 +325,10 @@ def build_phorth_ctx(stack_size, memory, word_impl):
         yield instructions.ROT_TWO()
         yield instructions.POP_TOP()
 
+    def _nrot():
+        yield instructions.ROT_THREE()
+        yield instructions.ROT_THREE()
+
     @builtin(name='>cfa')
     def pushcfa():
         yield instructions.DUP_TOP()
@@ -274,6 +396,70 @@ def build_phorth_ctx(stack_size, memory, word_impl):
         yield instructions.CALL_FUNCTION(1)
         yield instructions.STORE_FAST('here')
 
+    def inline_write_next_cell():
+        """Write a cell which points at the code right after the cell.
+
+        This is used to jump into code that is compiled inline in a thread.
+        """
+        yield instructions.LOAD_CONST(comma_impl)
+        yield instructions.LOAD_FAST('here')
+        yield instructions.LOAD_CONST(1)
+        yield instructions.BINARY_ADD()
+        yield instructions.CALL_FUNCTION(1)
+        yield instructions.STORE_FAST('here')
+
+    def inline_write_lit_from_stack(continuation):
+        """Write ``LOAD_CONST <lit>; JUMP_ABSOLUTE <continuation>`` where the
+        literal's index into ``co_consts`` is on the top of the stack.
+        """
+        yield from inline_write_byte(instructions.LOAD_CONST.opcode)
+        yield from inline_write_short_from_stack()
+        yield from inline_write_byte(instructions.JUMP_ABSOLUTE.opcode)
+        yield from inline_write_short(continuation)
+
+    def write_docol_header():
+        """Write the code which starts a colon definition's thread.
+        """
+        yield from write_byte(instructions.LOAD_CONST.opcode)
+        yield from write_short(0)  # push_return_addr
+        yield from write_byte(instructions.CALL_FUNCTION.opcode)
+        yield from write_short(0)
+        yield from write_byte(instructions.POP_TOP.opcode)
+        yield from write_byte(instructions.JUMP_ABSOLUTE.opcode)
+        yield from write_short(vocab['__docol'].addr)
+
+    def find_next_word(unknown_word_instr):
+        """Read the next word and look it up in the dictionary.
+
+        The caller must yield ``unknown_word_instr`` followed by
+        ``unknown_word()`` after its body.
+        """
+        yield instructions.LOAD_CONST(push_return_addr)
+        yield instructions.CALL_FUNCTION()
+        yield instructions.POP_TOP()
+        yield instructions.JUMP_ABSOLUTE(word_instrs['word'][0])
+        # We dup the word once giving us 2 copies on the stack for:
+        #   find
+        #   unknown word error
+        yield instructions.DUP_TOP()
+        yield instructions.LOAD_CONST(push_return_addr)
+        yield instructions.CALL_FUNCTION(0)
+        yield instructions.POP_TOP()
+        yield instructions.JUMP_ABSOLUTE(word_instrs['find'][0])
+        yield instructions.DUP_TOP()
+        yield instructions.LOAD_CONST(None)
+        yield instructions.COMPARE_OP.IS
+        yield instructions.POP_JUMP_IF_TRUE(unknown_word_instr)
+
+        # clear the word string from the stack
+        yield from _nip()
+
+    def unknown_word():
+        yield instructions.LOAD_CONST(UnknownWord)
+        yield instructions.ROT_TWO()
+        yield instructions.CALL_FUNCTION(1)
+        yield instructions.RAISE_VARARGS(1)
+
     handle_exception_instr = instructions.POP_TOP()
     setup_except_instr = instructions.SETUP_EXCEPT(handle_exception_instr)
 
@@ -359,12 +545,14 @@ def build_phorth_ctx(stack_size, memory, word_impl):
         yield instructions.LOAD_CONST(append_lit)
         yield instructions.ROT_TWO()
         yield instructions.CALL_FUNCTION(1)
-        yield from inline_write_short(
+        # compile the literal inline: a cell pointing at the code after it
+        # which pushes the literal and then continues the thread
+        yield from inline_write_next_cell()
+        yield from inline_write_lit_from_stack(
             None
             if counting_run else
-            len(list(_sparse_args(__start(counting_run=True)))) - 1,
+            len(list(_sparse_args(__start(counting_run=True)))),
         )
-        yield from inline_write_short_from_stack()
         yield instructions.JUMP_ABSOLUTE(first)
 
         yield unknown_word_instr
@@ -373,31 +561,68 @@ def build_phorth_ctx(stack_size, memory, word_impl):
         yield instructions.CALL_FUNCTION(1)
         yield instructions.RAISE_VARARGS(1)
 
-        # this is the bytecode side of the literal implementation which
-        # appears to be dead code but does get jumped to
+        # this is the bytecode that inline literals jump to after pushing
+        # their value which appears to be dead code but does get jumped to
         if counting_run:
             return
 
-        yield instructions.LOAD_CONST(lit_impl)
-        yield instructions.LOAD_CONST(pop_return_addr)
-        yield instructions.CALL_FUNCTION(0)
-        yield instructions.CALL_FUNCTION(1)
-        yield instructions.UNPACK_SEQUENCE(2)
+        # the runner replaces the cstack entry pushed by the deref jump with
+        # the cell after the literal
+        yield instructions.LOAD_CONST(lit_next[0])
         yield instructions.YIELD_VALUE()
 
     # this segment goes first, it handles the input loop
     # this is not a decorator because it is recurisive to count the addr
-    # of lit
+    # of the literal continuation
     builtin(priority=0)(__start)
 
+    lit_continuation = len(list(_sparse_args(__start(counting_run=True))))
+    peephole = Peephole(
+        vocab,
+        lit_continuation,
+        memo_docol_offset,
+        enabled=optimize,
+    )
+    effects = StackEffects(vocab, peephole)
+    cells = IntCells(vocab, lit_continuation, enabled=int_cells)
+    subroutines = SubroutineThreading(
+        vocab,
+        peephole,
+        # the builtins which are straight line code
+        set(_single_instr_words) |
+        set(map(superinstruction_name, superinstructions)) |
+        set(map(call_word_name, range(max_call_args + 1))) |
+        {'nip', 'over'},
+        enabled=subroutine_threaded,
+    )
+
+    def close_definition(frame, latest, here):
+        """Check, then compile or optimize, the definition that ``;`` closed.
+        """
+        effects.check(frame, latest, here)
+        for compile_ in cells.compile, subroutines.compile:
+            new_here = compile_(frame, latest, here)
+            if new_here is not None:
+                return new_here
+        return peephole.optimize(frame, latest, here)
+
     @builtin()
     def __docol():
         yield instructions.LOAD_CONST(docol_impl)
         yield instructions.CALL_FUNCTION(0)
         yield instructions.YIELD_VALUE()
 
+    @builtin()
+    def __map_return():
+        # the return address used when a word is called from Session.map
+        suspend = instructions.LOAD_CONST(map_done)
+        yield suspend
+        yield instructions.YIELD_VALUE()
+        yield instructions.JUMP_ABSOLUTE(suspend)
+
     @builtin()
     def _dis():
+        yield from flush_output()
         yield instructions.LOAD_CONST(dis)
         yield instructions.LOAD_CONST(sys._getframe)
         yield instructions.CALL_FUNCTION(0)
@@ -406,8 +631,17 @@ def build_phorth_ctx(stack_size, memory, word_impl):
         yield instructions.POP_TOP()
         yield next_instruction()
 
+    @builtin()
+    def _sample():
+        yield from flush_output()
+        yield instructions.LOAD_CONST(sample_impl)
+        yield instructions.CALL_FUNCTION(0)
+        yield instructions.POP_TOP()
+        yield next_instruction()
+
     @builtin()
     def words():
+        yield from flush_output()
         yield instructions.LOAD_CONST(compose(
             pprint,
             partial(sorted, key=op.attrgetter('name')),
@@ -532,6 +766,13 @@ def build_phorth_ctx(stack_size, memory, word_impl):
         yield instructions.POP_JUMP_IF_TRUE(word_instrs['branch'][0])
         yield instructions.YIELD_VALUE()
 
+    @builtin()
+    def _cstack():
+        # a copy, the cstack itself is a native array on the context
+        yield instructions.LOAD_FAST('context')
+        yield instructions.LOAD_ATTR('cstack')
+        yield next_instruction()
+
     @builtin(name='.s')
     def print_stack():
         yield from sync_frame()  # syncing because we want the stacksize
@@ -540,6 +781,26 @@ def build_phorth_ctx(stack_size, memory, word_impl):
         yield instructions.POP_TOP()
         yield next_instruction()
 
+    for name, method in (('.', 'dot'), ('emit', 'emit'), ('type', 'type')):
+        # build the output words which consume the top of the stack
+        @builtin(name=name)
+        def _(method=method):
+            yield instructions.LOAD_FAST('out')
+            yield instructions.LOAD_ATTR(method)
+            yield instructions.ROT_TWO()
+            yield instructions.CALL_FUNCTION(1)
+            yield instructions.POP_TOP()
+            yield next_instruction()
+
+    for name in 'cr', 'flush':
+        @builtin(name=name)
+        def _(method=name):
+            yield instructions.LOAD_FAST('out')
+            yield instructions.LOAD_ATTR(method)
+            yield instructions.CALL_FUNCTION(0)
+            yield instructions.POP_TOP()
+            yield next_instruction()
+
     @builtin('/mod')
     def _divmod():
         yield instructions.LOAD_CONST(divmod)
@@ -564,6 +825,22 @@ def build_phorth_ctx(stack_size, memory, word_impl):
             yield instr()
             yield next_instruction()
 
+    for pair in superinstructions:
+        # build the fused words used by the peephole optimizer
+        @builtin(name=superinstruction_name(pair))
+        def _(pair=pair):
+            for name in pair:
+                yield _single_instr_words[name]()
+            yield next_instruction()
+
+    for extra in 1, 3:
+        # the code that inline literals with a fused instruction of ``extra``
+        # bytes jump to after pushing their value
+        @builtin(name='__lit_next%d' % extra)
+        def _(extra=extra):
+            yield instructions.LOAD_CONST(lit_next[extra])
+            yield instructions.YIELD_VALUE()
+
     _compile_vocab()
 
     @builtin(name=':')
@@ -576,21 +853,33 @@ def build_phorth_ctx(stack_size, memory, word_impl):
         yield instructions.CALL_FUNCTION()
         yield instructions.POP_TOP()
         yield instructions.JUMP_ABSOLUTE(word_instrs['create'][0])
-        yield from write_byte(instructions.LOAD_CONST.opcode)
-        yield from write_short(0)  # push_return_addr
-        yield from write_byte(instructions.CALL_FUNCTION.opcode)
-        yield from write_short(0)
-        yield from write_byte(instructions.POP_TOP.opcode)
-        yield from write_byte(instructions.JUMP_ABSOLUTE.opcode)
-        yield from write_short(vocab['__docol'].addr)
+        yield from write_docol_header()
         yield instructions.LOAD_CONST(push_return_addr)
         yield instructions.CALL_FUNCTION()
         yield instructions.POP_TOP()
         yield instructions.JUMP_ABSOLUTE(word_instrs['['][0])
         yield next_instruction()
 
+    @builtin()
+    def constant():
+        # ( x "name" -- )
+        yield instructions.LOAD_CONST(push_return_addr)
+        yield instructions.CALL_FUNCTION()
+        yield instructions.POP_TOP()
+        yield instructions.JUMP_ABSOLUTE(word_instrs['word'][0])
+        yield instructions.LOAD_CONST(push_return_addr)
+        yield instructions.CALL_FUNCTION()
+        yield instructions.POP_TOP()
+        yield instructions.JUMP_ABSOLUTE(word_instrs['create'][0])
+        yield instructions.LOAD_CONST(append_lit)
+        yield instructions.ROT_TWO()
+        yield instructions.CALL_FUNCTION(1)
+        yield from inline_write_lit_from_stack(vocab['__next'].addr)
+        yield next_instruction()
+
     @builtin()
     def _license():
+        yield from flush_output()
         yield instructions.LOAD_CONST(license_impl)
         yield instructions.CALL_FUNCTION(0)
         yield instructions.POP_TOP()
@@ -603,15 +892,242 @@ def build_phorth_ctx(stack_size, memory, word_impl):
         yield instructions.POP_TOP()
         yield next_instruction()
 
+    @builtin()
+    def __forget():
+        yield instructions.LOAD_CONST(forget_impl)
+        yield instructions.ROT_TWO()
+        yield instructions.CALL_FUNCTION(1)
+        yield instructions.POP_TOP()
+        yield instructions.LOAD_CONST(effects.forget)
+        yield instructions.LOAD_FAST('here')
+        yield instructions.CALL_FUNCTION(1)
+        yield instructions.POP_TOP()
+        yield next_instruction()
+
+    @builtin()
+    def forget():
+        # ( "name" -- )
+        unknown_word_instr = instructions.POP_TOP()
+        yield from find_next_word(unknown_word_instr)
+        yield instructions.JUMP_ABSOLUTE(word_instrs['__forget'][0])
+
+        yield unknown_word_instr
+        yield from unknown_word()
+
+    @builtin()
+    def __memo_enter():
+        # ( args.. memo -- results.. ) on a hit, otherwise this jumps into the
+        # word's thread with the arguments on the stack
+        yield from sync_frame()  # syncing because we want to read the stack
+        yield instructions.LOAD_ATTR('enter')
+        yield instructions.LOAD_CONST(sys._getframe)
+        yield instructions.CALL_FUNCTION(0)
+        yield instructions.LOAD_FAST('context')
+        yield instructions.CALL_FUNCTION(2)
+        yield instructions.UNPACK_SEQUENCE(2)
+        yield instructions.DUP_TOP()
+        yield instructions.LOAD_CONST(None)
+        yield instructions.COMPARE_OP.IS
+
+        miss_instr = instructions.POP_TOP()
+        yield instructions.POP_JUMP_IF_TRUE(miss_instr)
+
+        # use nargs as a counter; drop the arguments from under the results
+        drop_loop = instructions.DUP_TOP()
+        yield drop_loop
+        yield instructions.LOAD_CONST(0)
+        yield instructions.COMPARE_OP.EQ
+
+        push_results_instr = instructions.POP_TOP()
+        yield instructions.POP_JUMP_IF_TRUE(push_results_instr)
+
+        yield instructions.LOAD_CONST(1)
+        yield instructions.BINARY_SUBTRACT()
+        yield from _nrot()
+        yield instructions.POP_TOP()
+        yield instructions.JUMP_ABSOLUTE(drop_loop)
+
+        # push each result, leaving the iterator on the top of the stack;
+        # new_memo limits the results to the headroom reserved by the sync
+        yield push_results_instr
+        yield instructions.GET_ITER()
+        done = next_instruction()
+        push_loop = instructions.FOR_ITER(done)
+        yield push_loop
+        yield instructions.ROT_TWO()
+        yield instructions.JUMP_ABSOLUTE(push_loop)
+        yield done
+
+        # on a miss, return to the memo exit stub when the thread exits and
+        # jump to the docol header
+        yield miss_instr
+        yield instructions.DUP_TOP()
+        yield instructions.LOAD_CONST(memo_exit_offset - 1)
+        yield instructions.BINARY_ADD()
+        yield instructions.LOAD_CONST(push_return_impl)
+        yield instructions.ROT_TWO()
+        yield instructions.CALL_FUNCTION(1)
+        yield instructions.POP_TOP()
+        yield instructions.LOAD_CONST(memo_docol_offset - 1)
+        yield instructions.BINARY_ADD()
+        yield instructions.YIELD_VALUE()
+
+    @builtin()
+    def __memo_exit():
+        # ( results.. memo -- results.. )
+        yield from sync_frame()  # syncing because we want to read the stack
+        yield instructions.LOAD_ATTR('exit')
+        yield instructions.LOAD_CONST(sys._getframe)
+        yield instructions.CALL_FUNCTION(0)
+        yield instructions.LOAD_FAST('context')
+        yield instructions.CALL_FUNCTION(2)
+        yield instructions.POP_TOP()
+        yield next_instruction()
+
     _compile_vocab()
 
+    @builtin()
+    def marker():
+        # ( "name" -- )
+        yield instructions.LOAD_CONST(push_return_addr)
+        yield instructions.CALL_FUNCTION()
+        yield instructions.POP_TOP()
+        yield instructions.JUMP_ABSOLUTE(word_instrs['word'][0])
+        yield instructions.LOAD_CONST(push_return_addr)
+        yield instructions.CALL_FUNCTION()
+        yield instructions.POP_TOP()
+        yield instructions.JUMP_ABSOLUTE(word_instrs['create'][0])
+        # the marker pushes itself and forgets itself and every word defined
+        # after it
+        yield instructions.LOAD_CONST(append_lit)
+        yield instructions.LOAD_FAST('latest')
+        yield instructions.CALL_FUNCTION(1)
+        yield from inline_write_lit_from_stack(vocab['__forget'].addr)
+        yield next_instruction()
+
+    @builtin(name='memo:')
+    def memo_colon():
+        # A memoized word is laid out as:
+        #   LOAD_CONST <memo>; JUMP_ABSOLUTE __memo_enter
+        #   LOAD_CONST <memo>; JUMP_ABSOLUTE __memo_exit   (memo_exit_offset)
+        #   <docol header>                                 (memo_docol_offset)
+        #   <thread>
+        yield instructions.LOAD_CONST(push_return_addr)
+        yield instructions.CALL_FUNCTION()
+        yield instructions.POP_TOP()
+        yield instructions.JUMP_ABSOLUTE(word_instrs['word'][0])
+        yield instructions.LOAD_CONST(push_return_addr)
+        yield instructions.CALL_FUNCTION()
+        yield instructions.POP_TOP()
+        yield instructions.JUMP_ABSOLUTE(word_instrs['create'][0])
+        # read the stack effect comment like ( so that the context suspends
+        # when the input runs out in the middle of it
+        yield from _word()
+        yield instructions.LOAD_CONST('(')
+        yield instructions.COMPARE_OP.NE
+
+        no_comment_instr = instructions.LOAD_CONST(ValueError)
+        yield instructions.POP_JUMP_IF_TRUE(no_comment_instr)
+        yield from _read_comment()
+        yield instructions.LOAD_CONST(new_memo)
+        yield instructions.ROT_TWO()
+        yield instructions.LOAD_FAST('here')
+        yield instructions.CALL_FUNCTION(2)
+        yield instructions.LOAD_CONST(append_lit)
+        yield instructions.ROT_TWO()
+        yield instructions.CALL_FUNCTION(1)
+        yield instructions.DUP_TOP()
+        yield from inline_write_lit_from_stack(vocab['__memo_enter'].addr)
+        yield from inline_write_lit_from_stack(vocab['__memo_exit'].addr)
+        yield from write_docol_header()
+        yield instructions.LOAD_CONST(push_return_addr)
+        yield instructions.CALL_FUNCTION()
+        yield instructions.POP_TOP()
+        yield instructions.JUMP_ABSOLUTE(word_instrs['['][0])
+        yield next_instruction()
+
+        yield no_comment_instr
+        yield instructions.LOAD_CONST('memo: requires a stack effect comment')
+        yield instructions.CALL_FUNCTION(1)
+        yield instructions.RAISE_VARARGS(1)
+
+    @builtin(name="memo'")
+    def memo_quote():
+        # ( "name" -- memo )
+        unknown_word_instr = instructions.POP_TOP()
+        yield from find_next_word(unknown_word_instr)
+        yield instructions.LOAD_CONST(memo_of)
+        yield instructions.ROT_TWO()
+        yield instructions.LOAD_CONST(sys._getframe)
+        yield instructions.CALL_FUNCTION(0)
+        yield instructions.ROT_TWO()
+        yield instructions.CALL_FUNCTION(2)
+        yield next_instruction()
+
+        yield unknown_word_instr
+        yield from unknown_word()
+
+    @builtin(name='memo-clear')
+    def memo_clear():
+        # ( memo -- )
+        yield instructions.LOAD_ATTR('clear')
+        yield instructions.CALL_FUNCTION(0)
+        yield instructions.POP_TOP()
+        yield next_instruction()
+
+    @builtin(name='memo-stats')
+    def memo_stats():
+        # ( memo -- hits misses )
+        yield instructions.DUP_TOP()
+        yield instructions.LOAD_ATTR('hits')
+        yield instructions.ROT_TWO()
+        yield instructions.LOAD_ATTR('misses')
+        yield next_instruction()
+
+    @builtin(name='memo-resize')
+    def memo_resize():
+        # ( maxsize memo -- )
+        yield instructions.LOAD_ATTR('resize')
+        yield instructions.ROT_TWO()
+        yield instructions.CALL_FUNCTION(1)
+        yield instructions.POP_TOP()
+        yield next_instruction()
+
     @builtin(name=';', immediate=True)
     def semicolon():
         yield from write_short(vocab['exit'].addr - 1)
-        yield instructions.LOAD_CONST(push_return_addr)
-        yield instructions.CALL_FUNCTION()
+        # leave compile mode first so that a definition which is rejected
+        # does not leave the context compiling
+        yield instructions.LOAD_CONST(True)
+        yield instructions.STORE_FAST('immediate')
+        yield instructions.LOAD_CONST(close_definition)
+        yield instructions.LOAD_CONST(sys._getframe)
+        yield instructions.CALL_FUNCTION(0)
+        yield instructions.LOAD_FAST('latest')
+        yield instructions.LOAD_FAST('here')
+        yield instructions.CALL_FUNCTION(3)
+        yield instructions.STORE_FAST('here')
+        yield next_instruction()
+
+    @builtin()
+    def _peephole():
+        yield instructions.LOAD_CONST(peephole.report)
+        yield instructions.LOAD_FAST('out')
+        yield instructions.CALL_FUNCTION(1)
+        yield instructions.POP_TOP()
+        yield next_instruction()
+
+    @builtin()
+    def _stats():
+        yield from sync_frame()  # syncing because we want the stacksize
+        yield instructions.LOAD_FAST('out')
+        yield instructions.LOAD_ATTR('print_stats')
+        yield instructions.LOAD_CONST(context_stats)
+        yield instructions.LOAD_CONST(sys._getframe)
+        yield instructions.CALL_FUNCTION(0)
+        yield instructions.CALL_FUNCTION(1)
+        yield instructions.CALL_FUNCTION(1)
         yield instructions.POP_TOP()
-        yield instructions.JUMP_ABSOLUTE(word_instrs[']'][0])
         yield next_instruction()
 
     @builtin()
@@ -623,11 +1139,15 @@ def build_phorth_ctx(stack_size, memory, word_impl):
 
     @builtin(name='(', immediate=True)
     def lparen():
-        loop = instructions.LOAD_CONST(')')
-        yield loop
-        yield from _word()
-        yield instructions.COMPARE_OP.EQ
-        yield instructions.POP_JUMP_IF_FALSE(loop)
+        # collect the words of the comment so that a stack effect comment
+        # at the start of a colon definition can be recorded
+        yield from _read_comment()
+        yield instructions.LOAD_CONST(effects.comment)
+        yield instructions.ROT_TWO()
+        yield instructions.LOAD_CONST(sys._getframe)
+        yield instructions.CALL_FUNCTION(0)
+        yield instructions.CALL_FUNCTION(2)
+        yield instructions.POP_TOP()
         yield next_instruction()
 
     @builtin(name='py::import')
@@ -644,10 +1164,6 @@ def build_phorth_ctx(stack_size, memory, word_impl):
         yield instructions.CALL_FUNCTION(2)
         yield next_instruction()
 
-    def _nrot():
-        yield instructions.ROT_THREE()
-        yield instructions.ROT_THREE()
-
     @builtin(name='py::call')
     def py_call():
         start = instructions.BUILD_LIST(0)
@@ -696,36 +1212,87 @@ def build_phorth_ctx(stack_size, memory, word_impl):
         yield instructions.CALL_FUNCTION_VAR(0)
         yield next_instruction()
 
+    for nargs in range(max_call_args + 1):
+        # ``n py::call`` with a literal ``n`` is rewritten by the peephole
+        # optimizer to call one of these, which do not check ``nargs`` or
+        # build the argument list
+        @builtin(name=call_word_name(nargs))
+        def _(nargs=nargs):
+            # ( args.. f -- result )
+            if nargs == 0:
+                yield instructions.CALL_FUNCTION(0)
+            elif nargs <= 2:
+                # move the function under its arguments
+                yield (instructions.ROT_TWO if nargs == 1 else
+                       instructions.ROT_THREE)()
+                yield instructions.CALL_FUNCTION(nargs)
+            else:
+                yield instructions.BUILD_TUPLE(nargs + 1)
+                yield instructions.LOAD_CONST(py_call_top_impl)
+                yield instructions.ROT_TWO()
+                yield instructions.CALL_FUNCTION_VAR(0)
+            yield next_instruction()
+
+    @builtin(name='py::pmap')
+    def py_pmap():
+        # ( word iterable chunksize -- results )
+        yield instructions.BUILD_TUPLE(3)
+        yield instructions.LOAD_CONST(
+            partial(pmap_impl, autoload_index=autoload_index),
+        )
+        yield instructions.ROT_TWO()
+        yield instructions.CALL_FUNCTION_VAR(0)
+        yield next_instruction()
+
     _compile_vocab()
 
-    def _tail():
-        for _ in range(memory - len(list(_sparse_args(instrs))) - 15):
-            yield instructions.NOP()
+    def _handler():
         yield handle_exception_instr
         yield from _nip()
         yield instructions.LOAD_CONST(handle_exception)
         yield instructions.ROT_TWO()
-        yield instructions.CALL_FUNCTION(1)
+        yield instructions.LOAD_FAST('out')
+        yield instructions.CALL_FUNCTION(2)
         yield instructions.POP_TOP()
         yield instructions.POP_EXCEPT()
         yield instructions.JUMP_ABSOLUTE(setup_except_instr)
 
-    instrs.extend(_tail())
+    # the exception handler comes right after the builtins so that the free
+    # memory past it can grow
+    instrs.extend(_handler())
+    here = len(list(_sparse_args(instrs)))
+    if here > memory:
+        raise ValueError(
+            'the builtins need %d bytes of memory but the maximum is %d' % (
+                here,
+                memory,
+            ),
+        )
+    # the runner grows the memory as needed, start with a small amount free
+    for _ in range(min(memory, here + initial_free_memory) - here):
+        instrs.append(instructions.NOP())
 
     code = Code(
         instrs,
         argnames=argnames,
         flags={'CO_NEWLOCALS': True},
     ).to_pycode()
-    return here, FunctionType(
+    consts = tuple(map(_coerce_false_and_true, code.co_consts))
+    if len(consts) + max_literals > 2 ** 16:
+        raise ValueError(
+            'too many constants to reserve %d literal slots' % max_literals,
+        )
+    ctx = FunctionType(
         CodeType(
             len(argnames),
             0,
             len(argnames),
-            stack_size,
+            # the runner grows the stack as needed
+            min(stack_size, initial_stack_size),
             code.co_flags,
             code.co_code,
-            tuple(map(_coerce_false_and_true, code.co_consts)),
+            # reserve the trailing slots of co_consts for the literal table
+            consts + (None,) * max_literals,
             code.co_names,
             code.co_varnames,
             '<phorth>',
@@ -736,7 +1303,20 @@ def build_phorth_ctx(stack_size, memory, word_impl):
             (),
         ),
         {k: v for k, v in vocab.items() if not k.startswith('__')},
+        '<phorth>',
     )
+    # the limits passed to the ``Context`` of each run
+    ctx.max_memory = memory
+    ctx.max_stack_size = stack_size
+    # the words which are not in the dictionary
+    ctx.peephole = peephole
+    ctx.cells = cells
+    ctx.effects = effects
+    ctx.subroutines = subroutines
+    ctx.hidden_words = {
+        k: v for k, v in vocab.items() if k.startswith('__')
+    }
+    return here, ctx
 
 
 def _coerce_false_and_true(n):
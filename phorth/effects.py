@@ -0,0 +1,299 @@
+from ._primitives import Word, forget_frame
+from .memo import NotMemoized, memo_of, parse_stack_effect
+from .peephole import call_word_name, docol_header, max_call_args
+
+
+class StackEffectError(Exception):
+    """Raised when ``;`` closes a colon definition which takes more values
+    from the stack than its stack effect comment declares.
+    """
+
+
+# the stack effects of the builtins which may be called from a thread, as
+# (inputs, outputs)
+builtin_effects = {
+    'swap': (2, 2),
+    'drop': (1, 0),
+    'dup': (1, 2),
+    '2dup': (2, 4),
+    'rot': (3, 3),
+    'over': (2, 3),
+    'nip': (2, 1),
+    'nop': (0, 0),
+    'true': (0, 1),
+    'false': (0, 1),
+    'none': (0, 1),
+    'here': (0, 1),
+    'latest': (0, 1),
+    'py::getitem': (2, 1),
+    'matmul': (2, 1),
+    '/mod': (2, 1),
+    '@': (1, 1),
+    'b@': (1, 1),
+    '!': (2, 0),
+    'b!': (2, 0),
+    ',': (1, 0),
+    'b,': (1, 0),
+    '.': (1, 0),
+    'emit': (1, 0),
+    'type': (1, 0),
+    'cr': (0, 0),
+    'flush': (0, 0),
+    '.s': (0, 0),
+    'word': (0, 1),
+    'find': (1, 1),
+    '>cfa': (1, 1),
+    "'": (0, 1),
+    'create': (1, 0),
+    'immediate': (0, 0),
+    'exit': (0, 0),
+    'memo-clear': (1, 0),
+    'memo-stats': (1, 2),
+    'memo-resize': (2, 0),
+    'py::import': (1, 1),
+    'py::getattr': (2, 1),
+    'py::pmap': (3, 1),
+}
+builtin_effects.update(dict.fromkeys(
+    (
+        '^', '*', '/', 'mod', '+', '-', '<<', '>>', '&', 'xor', '|',
+        '=', '>', '>=', '<>', '<', '<=',
+    ),
+    (2, 1),
+))
+builtin_effects.update(
+    (call_word_name(nargs), (nargs + 1, 1))
+    for nargs in range(max_call_args + 1)
+)
+
+
+def combine(effects):
+    """The stack effect of running some words in sequence.
+
+    Parameters
+    ----------
+    effects : iterable[tuple[int, int]]
+        The stack effect of each word.
+
+    Returns
+    -------
+    effect : tuple[int, int]
+        The number of values taken from the stack below the first word and
+        the number of values left.
+    """
+    depth = 0
+    inputs = 0
+    for pops, pushes in effects:
+        depth -= pops
+        inputs = max(inputs, -depth)
+        depth += pushes
+    return inputs, inputs + depth
+
+
+class StackEffects:
+    """The pass which infers the stack effect of a colon definition when
+    ``;`` closes it.
+
+    Parameters
+    ----------
+    words : dict[str, Word]
+        The builtin words of the context, including the hidden words.
+    peephole : Peephole
+        The peephole optimizer, which decodes the thread.
+
+    Notes
+    -----
+    The effect of a thread is the combined effect of its cells. Literals
+    push one value, builtins have the effects in :data:`builtin_effects` and
+    ``n py::call`` with a literal ``n`` takes ``n + 2`` values and leaves one.
+    Calls to colon definitions use the effect inferred, or declared, when the
+    callee was closed. A thread which holds anything else, like a branch or a
+    word with no known effect, has no inferred effect.
+
+    A definition declares its effect with a stack effect comment right after
+    its name, like ``: square ( n -- n*n ) dup * ;``, or with the comment
+    read by ``memo:``. A definition whose thread would take more values than
+    it declares is forgotten and :class:`StackEffectError` is raised.
+
+    A literal ``nargs`` is also what lets the peephole optimizer rewrite
+    ``n py::call`` as a call to one of the ``__py::call<n>`` words, which do
+    not check ``nargs`` or build an argument list at runtime.
+    """
+    def __init__(self, words, peephole):
+        self.words = words
+        self.peephole = peephole
+
+        # the effects of colon definitions keyed by word, words hash by
+        # identity so a definition which is forgotten and redefined at the
+        # same address gets a new entry; forget drops the old entries
+        self.declared = {}
+        self.inferred = {}
+
+        # built on first use because the builtins are compiled in batches
+        self._builtin_effects = None
+
+    def _prepare(self):
+        if self._builtin_effects is not None:
+            return
+
+        self._builtin_effects = {
+            self.words[name].addr: effect
+            for name, effect in builtin_effects.items()
+            if name in self.words
+        }
+
+    def effect_of(self, word):
+        """The stack effect of a word.
+
+        Parameters
+        ----------
+        word : Word
+            The word.
+
+        Returns
+        -------
+        effect : tuple[int, int] or None
+            The number of values the word takes from and leaves on the stack,
+            or None when it is not known.
+        """
+        self._prepare()
+        if word.addr in self._builtin_effects:
+            return self._builtin_effects[word.addr]
+        try:
+            return self.declared[word]
+        except KeyError:
+            return self.inferred.get(word)
+
+    def comment(self, words, frame):
+        """Implementation for the ( forth word which records stack effect
+        comments.
+
+        Parameters
+        ----------
+        words : list[str]
+            The words of the comment, not including ``)``.
+        frame : frame
+            The phorth frame.
+        """
+        locals_ = frame.f_locals
+        latest = locals_['latest']
+        if locals_['immediate'] or not isinstance(latest, Word):
+            return
+
+        start = latest.addr
+        header = docol_header(self.words['__docol'].addr)
+        if (locals_['here'] != start + len(header) or
+                frame.f_code.co_code[start:start + len(header)] != header):
+            # only a comment right after the name of a colon definition
+            # declares its effect
+            return
+
+        effect = parse_stack_effect(words)
+        if effect is not None:
+            self.declared[latest] = effect
+
+    def infer(self, frame, latest, here):
+        """Infer the stack effect of a colon definition.
+
+        Parameters
+        ----------
+        frame : frame
+            The phorth frame.
+        latest : Word
+            The word whose definition was just closed.
+        here : int
+            The first free memory address, which is the end of the thread.
+
+        Returns
+        -------
+        effect : tuple[int, int] or None
+            The inferred effect, or None if it cannot be inferred.
+        """
+        thread = self.peephole.decode(frame, latest, here)
+        if thread is None:
+            return None
+        _, items, _ = thread
+
+        self._prepare()
+        consts = frame.f_code.co_consts
+        py_call = self.words['py::call'].addr
+        effects = []
+        for n, (kind, arg) in enumerate(items):
+            if kind == 'lit':
+                effects.append((0, 1))
+                continue
+
+            if arg.addr == py_call:
+                if not (n and items[n - 1][0] == 'lit'):
+                    return None
+                nargs = consts[items[n - 1][1]]
+                if not (type(nargs) is int and nargs >= 0):
+                    return None
+                # the literal nargs was counted as a push
+                effects.append((nargs + 2, 1))
+                continue
+
+            effect = self.effect_of(arg)
+            if effect is None:
+                return None
+            effects.append(effect)
+
+        return combine(effects)
+
+    def forget(self, here):
+        """Implementation for the stack effect pass of forget and marker,
+        which drops the effects of the forgotten words.
+
+        Parameters
+        ----------
+        here : int
+            The first free memory address after the words were forgotten.
+            Every word at or past it was forgotten.
+        """
+        for effects in self.declared, self.inferred:
+            for word in [word for word in effects if word.addr >= here]:
+                del effects[word]
+
+    def check(self, frame, latest, here):
+        """Implementation for the stack effect pass of the ; forth word.
+
+        Parameters
+        ----------
+        frame : frame
+            The phorth frame.
+        latest : Word
+            The word whose definition was just closed.
+        here : int
+            The first free memory address, which is the end of the thread.
+
+        Raises
+        ------
+        StackEffectError
+            Raised when the definition takes more values than it declares.
+            The definition is forgotten first.
+        """
+        if not isinstance(latest, Word):
+            return
+
+        declared = self.declared.get(latest)
+        if declared is None:
+            try:
+                memo = memo_of(frame, latest)
+            except NotMemoized:
+                pass
+            else:
+                declared = self.declared[latest] = memo.nargs, memo.nresults
+
+        inferred = self.infer(frame, latest, here)
+        if inferred is None:
+            return
+        self.inferred[latest] = inferred
+
+        if declared is not None and inferred[0] > declared[0]:
+            del self.declared[latest]
+            del self.inferred[latest]
+            forget_frame(frame, latest)
+            raise StackEffectError(
+                '%s takes %d values from the stack but its stack effect'
+                ' declares %d' % (latest.name, inferred[0], declared[0]),
+            )
@@ -5,9 +5,23 @@ namespace phorth {
 constexpr std::size_t IMMEDIATE_MODE = 0;
 constexpr std::size_t HERE = 1;
 constexpr std::size_t LATEST = 2;
-constexpr std::size_t CSTACK = 3;
-constexpr std::size_t STACK_SIZE = 4;
-constexpr std::size_t LITERALS = 5;
-constexpr std::size_t TMP = 6;
+constexpr std::size_t LITERALS = 3;
+constexpr std::size_t TMP = 4;
+constexpr std::size_t OUT = 5;
+constexpr std::size_t CONTEXT = 6;
 constexpr std::size_t EXPECTED_NLOCALS = 7;
+
+// The number of slots reserved at the end of ``co_consts`` for literals.
+constexpr std::size_t MAX_LITERALS = 4096;
+
+// The size of an inline literal segment: ``LOAD_CONST; JUMP_ABSOLUTE``.
+constexpr long INLINE_LITERAL_SIZE = 6;
+
+// The number of bytes of memory past ``here`` that are allocated before
+// resuming a context. No single primitive may write more than this.
+constexpr Py_ssize_t MEMORY_HEADROOM = 1024;
+
+// The number of free slots on the data stack that are allocated before
+// resuming a context. No single primitive may push more than this.
+constexpr Py_ssize_t STACK_HEADROOM = 256;
 }  // namespace phorth
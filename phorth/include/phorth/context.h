@@ -0,0 +1,83 @@
+#pragma once
+#include <new>
+#include <optional>
+#include <vector>
+
+#include <Python.h>
+#include <frameobject.h>
+
+#include "phorth/constants.h"
+
+namespace phorth {
+/**
+   The state of a phorth context which is only used from C, stored in the
+   `CONTEXT` frame local.
+
+   The bytecode reads `here`, `latest` and `immediate` with `LOAD_FAST`, so
+   those stay boxed frame locals. Everything else lives here as native fields
+   so that the primitives and the runner do not need to box and unbox it.
+
+   The type is defined in `_primitives` and exported as `phorth.Context`;
+   `_runner` looks it up when it is imported.
+*/
+struct context {
+    PyObject ob;
+    // the return addresses, negative entries are deref jumps
+    std::vector<long>* cstack;
+    // the depth of the data stack when the context last yielded
+    Py_ssize_t stack_size;
+    // the limits that the runner grows the memory and data stack up to
+    Py_ssize_t max_memory;
+    Py_ssize_t max_stack_size;
+
+    // the number of jumps to an address yielded by the context
+    Py_ssize_t dispatches;
+    // the number of those jumps which went through a cell
+    Py_ssize_t deref_jumps;
+    // the largest data stack depth seen between jumps
+    Py_ssize_t max_stack_depth;
+    // the largest cstack depth seen between jumps
+    Py_ssize_t max_cstack_depth;
+    // the number of exceptions reported by the context's handler
+    Py_ssize_t exceptions;
+};
+
+/**
+   Get the context of a phorth frame. The frame must have been checked.
+*/
+inline context* frame_context(PyFrameObject* f) {
+    return reinterpret_cast<context*>(f->f_localsplus[CONTEXT]);
+}
+
+/**
+   Pop an address off of the cstack.
+
+   @return The address that was popped, or nullopt with an exception raised if
+           the cstack is empty.
+*/
+inline std::optional<long> pop_cstack(context* ctx) {
+    if (ctx->cstack->empty()) {
+        PyErr_SetString(PyExc_IndexError, "pop from empty cstack");
+        return std::nullopt;
+    }
+    long addr = ctx->cstack->back();
+    ctx->cstack->pop_back();
+    return addr;
+}
+
+/**
+   Push an address onto the cstack.
+
+   @return True on success, false with an exception raised otherwise.
+*/
+inline bool push_cstack(context* ctx, long addr) {
+    try {
+        ctx->cstack->push_back(addr);
+    }
+    catch (const std::bad_alloc&) {
+        PyErr_NoMemory();
+        return false;
+    }
+    return true;
+}
+}  // namespace phorth
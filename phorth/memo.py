@@ -0,0 +1,244 @@
+from collections import OrderedDict
+from dis import opmap
+
+from ._primitives import stack_headroom, stack_peek
+
+
+class NotMemoized(Exception):
+    """Raised when memo' is used on a word that was not defined with memo:.
+    """
+
+
+class Memo:
+    """The result cache for a word defined with ``memo:``.
+
+    Parameters
+    ----------
+    addr : int
+        The address of the memoized word.
+    nargs : int
+        The number of values the word consumes.
+    nresults : int
+        The number of values the word produces.
+    maxsize : int or None, optional
+        The maximum number of results to cache. When the cache is full the
+        least recently used result is evicted. ``None`` means the cache is
+        unbounded.
+
+    Notes
+    -----
+    The cache is keyed on the top ``nargs`` values of the stack when the word
+    is entered. On a hit the arguments are replaced by the cached results
+    without running the word's thread. On a miss the key is saved until the
+    thread exits and the top ``nresults`` values are stored as the result.
+
+    Each pending key is saved with the depth of the cstack when the word was
+    entered. A call which raises never reaches the exit stub, so its key is
+    dropped the next time the word is entered or exits at the same or a
+    shallower depth.
+    """
+    def __init__(self, addr, nargs, nresults, maxsize=128):
+        self.addr = addr
+        self.nargs = nargs
+        self.nresults = nresults
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        # (cstack depth, key) of the calls which are still running, this is a
+        # stack because memoized words may be recursive
+        self._pending = []
+
+    def __repr__(self):
+        return (
+            '<Memo: addr=%d, nargs=%d, nresults=%d, maxsize=%s, size=%d,'
+            ' hits=%d, misses=%d>' % (
+                self.addr,
+                self.nargs,
+                self.nresults,
+                self.maxsize,
+                len(self.cache),
+                self.hits,
+                self.misses,
+            )
+        )
+
+    def _drop_stale(self, depth):
+        # a running call's exit stub is on the cstack, so a pending call
+        # entered at this depth or deeper raised before it could exit
+        pending = self._pending
+        while pending and pending[-1][0] >= depth:
+            pending.pop()
+
+    def enter(self, frame, context):
+        """Look up the arguments on the stack of ``frame``.
+
+        Parameters
+        ----------
+        frame : frame
+            The synced phorth frame with the memo on the top of the stack.
+        context : Context
+            The context of ``frame``.
+
+        Returns
+        -------
+        nargs : int or None
+            The number of arguments to drop, or None on a miss.
+        results_or_addr : tuple or int
+            The cached results, or the address of the word on a miss.
+        """
+        key = stack_peek(frame, self.nargs, 1)
+        try:
+            results = self.cache[key]
+        except KeyError:
+            self.misses += 1
+            depth = context.cstack_depth
+            self._drop_stale(depth)
+            self._pending.append((depth, key))
+            return None, self.addr
+
+        self.cache.move_to_end(key)
+        self.hits += 1
+        return self.nargs, results
+
+    def exit(self, frame, context):
+        """Store the results on the stack of ``frame`` for the innermost
+        pending call.
+
+        Parameters
+        ----------
+        frame : frame
+            The synced phorth frame with the memo on the top of the stack.
+        context : Context
+            The context of ``frame``.
+        """
+        self._drop_stale(context.cstack_depth + 1)
+        _, key = self._pending.pop()
+        self.cache[key] = stack_peek(frame, self.nresults, 1)
+        self._evict()
+
+    def _evict(self):
+        if self.maxsize is None:
+            return
+
+        cache = self.cache
+        while len(cache) > self.maxsize:
+            cache.popitem(last=False)
+
+    def resize(self, maxsize):
+        """Change the maximum size of the cache, evicting the least recently
+        used results if needed.
+
+        Parameters
+        ----------
+        maxsize : int or None
+            The new maximum size.
+        """
+        self.maxsize = maxsize
+        self._evict()
+
+    def clear(self):
+        """Clear the cache and reset the hit and miss counters.
+        """
+        self.cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+def parse_stack_effect(words):
+    """Parse the words of a stack effect comment like ``( n1 n2 -- m1 )``.
+
+    Parameters
+    ----------
+    words : iterable[str]
+        The words between ``(`` and ``)``.
+
+    Returns
+    -------
+    effect : tuple[int, int] or None
+        The number of names before and after ``--``, or None if the comment
+        is not a stack effect.
+    """
+    inputs = 0
+    outputs = None
+    for word in words:
+        if word == '--' and outputs is None:
+            outputs = 0
+        elif outputs is None:
+            inputs += 1
+        else:
+            outputs += 1
+
+    if outputs is None:
+        return None
+    return inputs, outputs
+
+
+def new_memo(words, addr):
+    """Implementation for the memo: forth word which creates the cache of the
+    new word from its stack effect comment.
+
+    Parameters
+    ----------
+    words : list[str]
+        The words of the stack effect comment, not including ``(`` and
+        ``)``.
+    addr : int
+        The address of the new word.
+
+    Returns
+    -------
+    memo : Memo
+        The cache for the new word.
+
+    Notes
+    -----
+    A hit pushes the cached results in a loop without returning to the
+    runner, so a word may leave at most ``stack_headroom`` values. The
+    arguments are already on the stack and are not limited.
+    """
+    effect = parse_stack_effect(words)
+    if effect is None:
+        raise ValueError("stack effect comment is missing '--'")
+
+    nargs, nresults = effect
+    if nresults > stack_headroom:
+        raise ValueError(
+            'memo: words may leave at most %d values, got %d' % (
+                stack_headroom,
+                nresults,
+            ),
+        )
+    return Memo(addr, nargs, nresults)
+
+
+def memo_of(frame, word):
+    """Implementation for the memo' forth word.
+
+    Parameters
+    ----------
+    frame : frame
+        The phorth frame.
+    word : Word
+        The word to get the cache of.
+
+    Returns
+    -------
+    memo : Memo
+        The cache for ``word``.
+
+    Raises
+    ------
+    NotMemoized
+        Raised when ``word`` was not defined with ``memo:``.
+    """
+    code = frame.f_code
+    memory = code.co_code
+    addr = word.addr
+    if memory[addr] == opmap['LOAD_CONST']:
+        ix = int.from_bytes(memory[addr + 1:addr + 3], 'little')
+        if ix < len(code.co_consts) and isinstance(code.co_consts[ix], Memo):
+            return code.co_consts[ix]
+
+    raise NotMemoized(word.name)
@@ -0,0 +1,117 @@
+import io
+import sys
+
+
+class Output:
+    """The buffered sink that a phorth context's output words write to.
+
+    Parameters
+    ----------
+    file : file-like or int, optional
+        The text file or file descriptor to write to. Defaults to
+        ``sys.stdout``.
+    buffer_size : int, optional
+        The number of characters to buffer before writing to ``file``.
+
+    Notes
+    -----
+    Output is only written to ``file`` when the buffer is full or when
+    :meth:`flush` is called. The repl flushes before reading each line and
+    before reporting an exception; programs may flush explicitly with the
+    ``flush`` word.
+    """
+    def __init__(self, file=None, *, buffer_size=io.DEFAULT_BUFFER_SIZE):
+        if file is None:
+            file = sys.stdout
+        elif isinstance(file, int):
+            file = open(file, 'w', closefd=False)
+
+        self.file = file
+        self.buffer_size = buffer_size
+        self._parts = []
+        self._size = 0
+        self._at_line_start = True
+
+    def write(self, s):
+        """Write a string to the buffer.
+
+        Parameters
+        ----------
+        s : str
+            The string to write.
+        """
+        if not s:
+            return
+
+        self._parts.append(s)
+        self._size += len(s)
+        self._at_line_start = s[-1] == '\n'
+        if self._size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffer to the underlying file and flush it.
+        """
+        if self._parts:
+            self.file.write(''.join(self._parts))
+            self._parts.clear()
+            self._size = 0
+        self.file.flush()
+
+    def end_line(self):
+        """Terminate the current line if anything has been written to it and
+        flush.
+        """
+        if not self._at_line_start:
+            self.write('\n')
+        self.flush()
+
+    def dot(self, value):
+        """Implementation for the . forth word.
+
+        Like ``sys.displayhook``, which ``.`` used before output was
+        buffered, nothing is written for None.
+        """
+        if value is not None:
+            self.write(repr(value) + ' ')
+
+    def emit(self, c):
+        """Implementation for the emit forth word.
+        """
+        self.write(chr(c))
+
+    def type(self, s):
+        """Implementation for the type forth word.
+        """
+        self.write(str(s))
+
+    def cr(self):
+        """Implementation for the cr forth word.
+        """
+        self.write('\n')
+
+    def print_stack(self, values):
+        """Implementation for the .s forth word.
+
+        Parameters
+        ----------
+        values : tuple
+            The contents of the data stack, bottom first.
+        """
+        self.write('<%d>%s\n' % (
+            len(values),
+            ''.join(' ' + repr(value) for value in values),
+        ))
+
+    def print_stats(self, stats):
+        """Implementation for the _stats forth word.
+
+        Parameters
+        ----------
+        stats : dict[str, int]
+            The resource usage of the context, as returned by
+            ``context_stats``.
+        """
+        width = max(map(len, stats))
+        for name in sorted(stats):
+            self.write('%-*s %d\n' % (width + 1, name + ':', stats[name]))
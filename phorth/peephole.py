@@ -0,0 +1,578 @@
+from dis import HAVE_ARGUMENT, opmap
+import operator as op
+
+from ._primitives import (
+    Word,
+    max_literals,
+    release_literals,
+    set_literal,
+    write_memory,
+)
+
+
+# pairs of single instruction words which are fused into one word
+superinstructions = (
+    ('dup', '*'),
+    ('dup', '+'),
+    ('swap', '-'),
+    ('swap', '/'),
+    ('swap', '<'),
+    ('swap', '>'),
+    ('2dup', '='),
+    ('2dup', '<'),
+    ('2dup', '>'),
+    ('rot', 'rot'),
+)
+
+
+def superinstruction_name(pair):
+    """The name of the hidden word which implements a pair of words.
+    """
+    return '__' + ' '.join(pair)
+
+
+# the largest literal nargs which ``py::call`` is specialized for
+max_call_args = 4
+
+
+def call_word_name(nargs):
+    """The name of the hidden word which calls a function with ``nargs``
+    arguments without checking ``nargs``.
+    """
+    return '__py::call%d' % nargs
+
+
+# the builtins which may be evaluated at compile time when both of their
+# arguments are literals
+_fold = {
+    '+': op.add,
+    '-': op.sub,
+    '*': op.mul,
+    '/': op.truediv,
+    'mod': op.mod,
+    '^': op.xor,
+    'xor': op.xor,
+    '&': op.and_,
+    '|': op.or_,
+    '<<': op.lshift,
+    '>>': op.rshift,
+    '=': op.eq,
+    '<>': op.ne,
+    '<': op.lt,
+    '<=': op.le,
+    '>': op.gt,
+    '>=': op.ge,
+}
+
+# the single instruction builtins which take two arguments and may be fused
+# into a literal which provides the second argument
+_lit_ops = set(_fold) | {'py::getitem'}
+
+# sequences of builtins which do nothing
+_noops = (
+    ('nop',),
+    ('swap', 'swap'),
+    ('dup', 'drop'),
+    ('over', 'drop'),
+    ('rot', 'rot', 'rot'),
+    # ``rot rot`` is fused before the third ``rot`` is seen
+    (superinstruction_name(('rot', 'rot')), 'rot'),
+)
+
+# the builtins which depend on the layout of the thread they are called from
+_unsafe = {'branch', '0branch', '_cstack'}
+
+# the value of a literal slot which the simplified thread no longer uses
+_released = object()
+
+_LOAD_CONST = opmap['LOAD_CONST']
+_CALL_FUNCTION = opmap['CALL_FUNCTION']
+_POP_TOP = opmap['POP_TOP']
+_JUMP_ABSOLUTE = opmap['JUMP_ABSOLUTE']
+_NOP = opmap['NOP']
+
+
+def _read_short(memory, addr):
+    return int.from_bytes(memory[addr:addr + 2], 'little')
+
+
+def _short(n):
+    return n.to_bytes(2, 'little')
+
+
+def docol_header(docol):
+    """The code at the start of a colon definition.
+
+    Parameters
+    ----------
+    docol : int
+        The address of the ``__docol`` word.
+
+    Returns
+    -------
+    header : bytes
+        The code which pushes the return address and jumps to ``__docol``.
+    """
+    return bytes((
+        _LOAD_CONST, 0, 0,  # push_return_addr
+        _CALL_FUNCTION, 0, 0,
+        _POP_TOP,
+        _JUMP_ABSOLUTE,
+    )) + _short(docol)
+
+
+def decode_thread(memory, words, lit_continuation, start, end):
+    """Decode the cells of a thread.
+
+    Parameters
+    ----------
+    memory : bytes
+        The memory of the context.
+    words : dict[int, Word]
+        The words which may be called, keyed by address.
+    lit_continuation : int
+        The address that inline literals jump to after pushing their value.
+    start : int
+        The address of the first cell.
+    end : int
+        The address past the last cell.
+
+    Returns
+    -------
+    items : list[tuple] or None
+        ``('lit', ix)`` for an inline literal stored at ``co_consts[ix]`` and
+        ``('call', word)`` for a call to ``word``. None when the thread holds
+        anything else.
+    """
+    items = []
+    addr = start
+    while addr < end:
+        cell = _read_short(memory, addr)
+        if cell == addr + 1:
+            # an inline literal
+            if (memory[addr + 2] != _LOAD_CONST or
+                    memory[addr + 5] != _JUMP_ABSOLUTE or
+                    _read_short(memory, addr + 6) != lit_continuation):
+                return None
+            items.append(('lit', _read_short(memory, addr + 3)))
+            addr += 8
+            continue
+
+        word = words.get(cell + 1)
+        if word is None:
+            return None
+        items.append(('call', word))
+        addr += 2
+
+    if addr != end:
+        return None
+    return items
+
+
+class Peephole:
+    """The optimizer which rewrites the thread of a colon definition when
+    ``;`` closes it.
+
+    Parameters
+    ----------
+    words : dict[str, Word]
+        The builtin words of the context, including the hidden words.
+    lit_continuation : int
+        The address that inline literals jump to after pushing their value.
+    memo_docol_offset : int
+        The offset of the docol header in a word defined with ``memo:``.
+    enabled : bool, optional
+        Optimize definitions? When this is False definitions are left as
+        they were compiled.
+
+    Notes
+    -----
+    The thread is decoded into calls and inline literals. If the thread holds
+    anything else, like data written with ``,``, or calls a word which depends
+    on the layout of the thread, like ``branch``, it is left alone.
+
+    The optimizer then:
+
+    - evaluates builtin operators whose arguments are both literals
+    - removes sequences of builtins which do nothing, like ``swap swap``
+    - fuses common pairs of builtins into a single word
+    - fuses a literal followed by a builtin operator into the literal's code,
+      so ``1 +`` is a single dispatch
+    - calls a function with a literal number of arguments, like
+      ``2 py::call``, through a word which does not check the number
+
+    The new thread is written over the old one and the memory after it is
+    freed, along with the literal slots that it no longer uses. Each
+    definition which changed is recorded in :attr:`records`.
+    """
+    def __init__(self,
+                 words,
+                 lit_continuation,
+                 memo_docol_offset,
+                 *,
+                 enabled=True):
+        self.words = words
+        self.lit_continuation = lit_continuation
+        self.memo_docol_offset = memo_docol_offset
+        self.enabled = enabled
+
+        # (name, bytes before, bytes after, cells before, cells after)
+        self.records = []
+
+        # built on first use because the builtins are compiled in batches
+        self._builtin_names = None
+        self._fused = None
+        self._calls = None
+        self._lit_next = None
+
+    def _prepare(self):
+        if self._builtin_names is not None:
+            return
+
+        words = self.words
+        self._builtin_names = {w.addr: name for name, w in words.items()}
+        self._fused = {
+            pair: words[superinstruction_name(pair)] for pair in superinstructions
+        }
+        self._fused['swap', 'drop'] = words['nip']
+        self._calls = {
+            nargs: words[call_word_name(nargs)]
+            for nargs in range(max_call_args + 1)
+        }
+        self._lit_next = {
+            0: self.lit_continuation,
+            1: words['__lit_next1'].addr,
+            3: words['__lit_next3'].addr,
+        }
+
+    def _name(self, item):
+        """The name of the builtin called by ``item``, or None.
+        """
+        if item[0] != 'call':
+            return None
+        return self._builtin_names.get(item[1].addr)
+
+    def _thread_start(self, memory, addr):
+        header = docol_header(self.words['__docol'].addr)
+        for offset in 0, self.memo_docol_offset:
+            start = addr + offset
+            if memory[start:start + len(header)] == header:
+                return start + len(header)
+        return None
+
+    def _decode(self, memory, consts, globals_, start, end):
+        words = {w.addr: w for w in globals_.values() if isinstance(w, Word)}
+        words.update((w.addr, w) for w in self.words.values())
+
+        items = decode_thread(
+            memory,
+            words,
+            self.lit_continuation,
+            start,
+            end,
+        )
+        if items is None:
+            return None
+        if any(self._name(item) in _unsafe for item in items):
+            return None
+
+        values = {ix: consts[ix] for kind, ix in items if kind == 'lit'}
+        return items, values
+
+    def _simplify(self, out, values):
+        """Rewrite the end of ``out``.
+
+        Returns
+        -------
+        changed : bool
+            Was ``out`` changed?
+        """
+        tail = out[-3:]
+        kinds = tuple(item[0] for item in tail)
+        names = tuple(map(self._name, tail))
+
+        if kinds[-3:-1] == ('lit', 'lit') and names[-1] in _fold:
+            a = values[tail[0][1]]
+            b = values[tail[1][1]]
+            try:
+                result = _fold[names[-1]](a, b)
+            except Exception:
+                pass
+            else:
+                # reuse the first literal's slot for the result
+                values[tail[0][1]] = result
+                del out[-2:]
+                return True
+
+        if kinds[-3:-1] == ('lit', 'lit') and names[-1] == 'swap':
+            out[-3:] = [tail[1], tail[0]]
+            return True
+
+        if kinds[-2:-1] == ('lit',) and names[-1] == 'drop':
+            del out[-2:]
+            return True
+
+        for pattern in _noops:
+            if names[-len(pattern):] == pattern:
+                del out[-len(pattern):]
+                return True
+
+        fused = self._fused.get(names[-2:])
+        if fused is not None:
+            out[-2:] = [('call', fused)]
+            return True
+
+        if kinds[-2:-1] == ('lit',) and names[-1] == 'py::call':
+            nargs = values[tail[-2][1]]
+            if type(nargs) is int and nargs in self._calls:
+                # the number of arguments is known so the call does not need
+                # to check it or build an argument list
+                out[-2:] = [('call', self._calls[nargs])]
+                return True
+
+        if kinds[-2:-1] == ('lit',) and names[-1] in _lit_ops:
+            out[-2:] = [('litop', tail[-2][1], tail[-1][1])]
+            return True
+
+        return False
+
+    def _encode(self, memory, items, start):
+        code = bytearray()
+        for item in items:
+            kind = item[0]
+            if kind == 'call':
+                code += _short(item[1].addr - 1)
+                continue
+
+            # a cell pointing at the code right after it
+            code += _short(start + len(code) + 1)
+            code.append(_LOAD_CONST)
+            code += _short(item[1])
+            extra = b''
+            if kind == 'litop':
+                addr = item[2].addr
+                extra = memory[addr:addr + (
+                    1 if memory[addr] < HAVE_ARGUMENT else 3
+                )]
+                code += extra
+            code.append(_JUMP_ABSOLUTE)
+            code += _short(self._lit_next[len(extra)])
+
+        return bytes(code)
+
+    def decode(self, frame, latest, here):
+        """Decode the thread of a colon definition.
+
+        Parameters
+        ----------
+        frame : frame
+            The phorth frame.
+        latest : Word
+            The word whose definition was just closed.
+        here : int
+            The first free memory address, which is the end of the thread.
+
+        Returns
+        -------
+        thread : tuple or None
+            ``(start, items, values)``: the address of the first cell, the
+            decoded items, and the values of the literals by index. None if
+            the thread cannot be decoded.
+        """
+        self._prepare()
+        code = frame.f_code
+        memory = code.co_code
+        start = self._thread_start(memory, latest.addr)
+        if start is None:
+            return None
+
+        decoded = self._decode(
+            memory,
+            code.co_consts,
+            frame.f_globals,
+            start,
+            here,
+        )
+        if decoded is None:
+            return None
+        items, values = decoded
+        return start, items, values
+
+    def simplify(self, frame, latest, here):
+        """Decode and simplify the thread of a colon definition without
+        writing it back.
+
+        Parameters
+        ----------
+        frame : frame
+            The phorth frame.
+        latest : Word
+            The word whose definition was just closed.
+        here : int
+            The first free memory address, which is the end of the thread.
+
+        Returns
+        -------
+        thread : tuple or None
+            ``(start, items, out, values)``: the address of the first cell,
+            the decoded items, the simplified items, and the values of the
+            literals by index. When the optimizer is disabled ``out`` is
+            ``items``. None if the thread cannot be decoded.
+        """
+        thread = self.decode(frame, latest, here)
+        if thread is None:
+            return None
+        start, items, values = thread
+        if not self.enabled:
+            return start, items, items, values
+
+        out = []
+        for item in items:
+            out.append(item)
+            while self._simplify(out, values):
+                pass
+
+        base = len(frame.f_code.co_consts) - max_literals
+        out = self._compact(
+            out,
+            values,
+            base + len(frame.f_locals['literals']),
+        )
+        return start, items, out, values
+
+    def _compact(self, out, values, end):
+        """Renumber the literals used by ``out`` so that the slots of the
+        literals which were removed, like the second argument of a folded
+        operator, are at the end of the literal table.
+
+        Parameters
+        ----------
+        out : list[tuple]
+            The simplified items.
+        values : dict[int, any]
+            The values of the literals by index. This is updated in place and
+            the slots to release are set to ``_released``.
+        end : int
+            The index into ``co_consts`` past the last literal.
+
+        Returns
+        -------
+        out : list[tuple]
+            The items with the literals renumbered.
+        """
+        renumber = {}
+        for item in out:
+            if item[0] != 'call':
+                renumber.setdefault(item[1], None)
+        if len(renumber) == len(values):
+            return out
+
+        first = min(values)
+        if sorted(values) != list(range(first, end)):
+            # something else was added to the literal table after the thread
+            # started, only the end of the table can be released
+            return out
+
+        for n, ix in enumerate(renumber, first):
+            renumber[ix] = n
+        old = dict(values)
+        values.clear()
+        values.update((renumber[ix], old[ix]) for ix in renumber)
+        values.update(
+            (ix, _released) for ix in range(first + len(renumber), end)
+        )
+        return [
+            item if item[0] == 'call' else
+            (item[0], renumber[item[1]]) + item[2:]
+            for item in out
+        ]
+
+    def store_literals(self, frame, values):
+        """Write the literals which were changed by :meth:`simplify` back to
+        the literal table.
+
+        Parameters
+        ----------
+        frame : frame
+            The phorth frame.
+        values : dict[int, any]
+            The values of the literals by index. The slots of literals which
+            are no longer used are released.
+        """
+        consts = frame.f_code.co_consts
+        released = []
+        for ix, value in values.items():
+            if value is _released:
+                released.append(ix)
+            elif value is not consts[ix]:
+                set_literal(frame, ix, value)
+        if released:
+            release_literals(frame, min(released))
+
+    def optimize(self, frame, latest, here):
+        """Implementation for the optimization pass of the ; forth word.
+
+        Parameters
+        ----------
+        frame : frame
+            The phorth frame.
+        latest : Word
+            The word whose definition was just closed.
+        here : int
+            The first free memory address, which is the end of the thread.
+
+        Returns
+        -------
+        here : int
+            The new first free memory address.
+        """
+        if not (self.enabled and isinstance(latest, Word)):
+            return here
+
+        thread = self.simplify(frame, latest, here)
+        if thread is None:
+            return here
+        start, items, out, values = thread
+        if out == items:
+            return here
+
+        new = self._encode(frame.f_code.co_code, out, start)
+        end = start + len(new)
+        if end > len(frame.f_code.co_code):
+            # fused comparisons are longer than the code they replace
+            return here
+
+        self.store_literals(frame, values)
+        write_memory(frame, start, new + bytes((_NOP,)) * (here - end))
+
+        self.records.append((
+            latest.name,
+            here - latest.addr,
+            end - latest.addr,
+            len(items),
+            len(out),
+        ))
+        return end
+
+    def report(self, out):
+        """Implementation for the _peephole forth word.
+
+        Parameters
+        ----------
+        out : Output
+            The output to write the report to.
+        """
+        saved = 0
+        for name, before, after, cells_before, cells_after in self.records:
+            out.write('%s: %d -> %d bytes, %d -> %d cells\n' % (
+                name,
+                before,
+                after,
+                cells_before,
+                cells_after,
+            ))
+            saved += before - after
+        out.write('%d definitions optimized, %d bytes saved\n' % (
+            len(self.records),
+            saved,
+        ))
@@ -0,0 +1,198 @@
+import multiprocessing
+import os
+import sys
+from types import CodeType, FunctionType
+
+from ._primitives import Word, max_literals
+
+
+class ContextImage:
+    """A copy of the memory, literals and dictionary of a running context
+    which can rebuild the context in another process.
+
+    Parameters
+    ----------
+    frame : frame
+        The phorth frame to copy.
+    autoload_index : AutoloadIndex, optional
+        The library words autoloaded by the context. The restored context
+        defines any of them which the copied context had not used yet.
+
+    Notes
+    -----
+    The builtins are laid out the same way by every call to
+    ``build_phorth_ctx`` so only the parts of the context which change at
+    runtime are copied: the memory, the literal slots at the end of
+    ``co_consts`` and the dictionary. The other constants, like the function
+    which reads the next word, belong to the context that is being restored
+    into.
+    """
+    def __init__(self, frame, autoload_index=None):
+        code = frame.f_code
+        locals_ = frame.f_locals
+        context = locals_['context']
+
+        self.memory = bytes(code.co_code)
+        self.literal_slots = code.co_consts[-max_literals:]
+        self.nconsts = len(code.co_consts)
+        self.globals = dict(frame.f_globals)
+        self.here = locals_['here']
+        self.latest = locals_['latest']
+        self.literals = list(locals_['literals'])
+        self.max_memory = context.max_memory
+        self.max_stack_size = context.max_stack_size
+        self.autoload_index = autoload_index
+
+    def restore(self, ctx):
+        """Copy the image into a new context.
+
+        Parameters
+        ----------
+        ctx : function
+            A context returned by ``build_phorth_ctx`` which has not been
+            started.
+
+        Returns
+        -------
+        ctx : function
+            A context with the memory, literals and dictionary of the image.
+            The attributes of ``ctx`` are copied.
+        """
+        co = ctx.__code__
+        if len(co.co_consts) != self.nconsts:
+            raise ValueError(
+                'cannot restore a context with %d constants into a context'
+                ' with %d constants' % (self.nconsts, len(co.co_consts)),
+            )
+
+        new = FunctionType(
+            CodeType(
+                co.co_argcount,
+                co.co_kwonlyargcount,
+                co.co_nlocals,
+                co.co_stacksize,
+                co.co_flags,
+                self.memory,
+                co.co_consts[:-max_literals] + self.literal_slots,
+                co.co_names,
+                co.co_varnames,
+                co.co_filename,
+                co.co_name,
+                co.co_firstlineno,
+                co.co_lnotab,
+                co.co_freevars,
+                co.co_cellvars,
+            ),
+            dict(self.globals),
+            ctx.__name__,
+        )
+        new.__dict__.update(ctx.__dict__)
+        return new
+
+
+# the state of a pool worker, set by ``_init_worker``
+_worker_session = None
+_worker_word = None
+
+
+def _init_worker(image, word):
+    global _worker_session
+    global _worker_word
+
+    from .runner import Session
+
+    _worker_session = Session.from_image(image)
+    _worker_word = word
+
+
+def _run_chunk(chunk):
+    return list(_worker_session.map(_worker_word, chunk))
+
+
+def _chunks(items, chunksize):
+    return [
+        items[start:start + chunksize]
+        for start in range(0, len(items), chunksize)
+    ]
+
+
+def pmap_impl(word,
+              iterable,
+              chunksize,
+              *,
+              processes=None,
+              autoload_index=None,
+              _getframe=sys._getframe):
+    """Implementation for the py::pmap forth word.
+
+    ( word iterable chunksize -- results )
+
+    Parameters
+    ----------
+    word : Word or str
+        The word to run on each item, which must have the stack effect
+        ``( item -- result )``.
+    iterable : iterable
+        The items.
+    chunksize : int or None
+        The number of items sent to a worker at a time. None picks a size
+        which gives each worker about four chunks.
+    processes : int, optional
+        The number of workers. Defaults to the number of cpus.
+    autoload_index : AutoloadIndex, optional
+        The library words autoloaded by the context, bound by
+        ``build_phorth_ctx``.
+
+    Returns
+    -------
+    results : list
+        The result for each item, in order.
+
+    Notes
+    -----
+    The workers are forked from the current process. Each worker rebuilds
+    the context from a :class:`ContextImage` once when it starts, so the
+    memory and dictionary are not sent with each chunk. The items and results
+    are pickled. Library words which the context has not used yet are
+    autoloaded by each worker which needs them.
+
+    Definitions made by the workers, and their changes to memory, are not
+    seen by the context which called ``py::pmap``.
+    """
+    if not isinstance(word, (Word, str)):
+        raise TypeError('expected a word or a word name, got %r' % (word,))
+
+    items = list(iterable)
+    if not items:
+        return []
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = min(processes, len(items))
+    if chunksize is None:
+        chunksize = -(-len(items) // (processes * 4))
+    elif chunksize <= 0:
+        raise ValueError('chunksize must be positive, got %r' % chunksize)
+
+    frame = _getframe(1)
+    image = ContextImage(frame, autoload_index)
+    # the workers inherit anything that is still buffered
+    frame.f_locals['out'].flush()
+
+    pool = multiprocessing.get_context('fork').Pool(
+        processes,
+        initializer=_init_worker,
+        # forked workers inherit the arguments, they are not pickled
+        initargs=(image, word),
+    )
+    try:
+        chunks = pool.map(_run_chunk, _chunks(items, chunksize), chunksize=1)
+    except BaseException:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+
+    return [result for chunk in chunks for result in chunk]
@@ -7,6 +7,7 @@ from toolz import concatv
 import toolz.curried.operator as op
 
 from ._primitives import (  # noqa
+    Context,
     Word,
     append_lit,
     argnames,
@@ -17,12 +18,15 @@ from ._primitives import (  # noqa
     create_impl,
     clear_cstack,
     comma_impl,
+    context_stats,
     docol_impl,
     find_impl,
-    lit_impl,
+    forget_impl,
+    max_literals,
     pop_return_addr,
     print_stack_impl,
     push_return_addr,
+    push_return_impl,
     read_impl,
     write_impl,
 )
@@ -55,6 +59,7 @@ def process_lit(word,
 
 
 def handle_exception(exc,
+                     out,
                      *,
                      _Done=Done,
                      _type=type,
@@ -68,6 +73,9 @@ def handle_exception(exc,
     ----------
     exc : Exception
         The exception that was raised.
+    out : Output
+        The context's output, this is flushed before the exception is
+        reported.
 
     Notes
     -----
@@ -75,10 +83,17 @@ def handle_exception(exc,
     of the repl with a clean stack. If ``exc`` is an instance of ``Done``, this
     will reraise the exception and kill the phorth session.
     """
+    out.flush()
     if _isinstance(exc, _Done):
         # reraise the sentinel `Done` type
         raise Done()
 
+    # record the error like the interactive interpreter so that embedders
+    # can find it after the context has been reset
+    sys.last_type = _type(exc)
+    sys.last_value = exc
+    sys.last_traceback = exc.__traceback__
+
     f = _getframe(1)
     cstack = _clear_cstack(f)
     print(
@@ -114,6 +129,23 @@ def py_call_impl(f, *reversed_args):
     return f(*reversed(reversed_args))
 
 
+def py_call_top_impl(*args):
+    """Implementation for the __py::call<n> words which call a function with
+    more arguments than can be rotated under it.
+
+    Parameters
+    ----------
+    *args
+        The arguments followed by the function, in stack order.
+
+    Returns
+    -------
+    called : any
+        The result of calling the last argument with the others.
+    """
+    return args[-1](*args[:-1])
+
+
 def license_impl():
     """Print the license.
     """
@@ -0,0 +1,163 @@
+from bisect import bisect_right
+from collections import Counter
+import operator as op
+import sys
+import threading
+
+from ._primitives import Word, sample_frame
+
+
+class SamplingProfiler:
+    """A statistical profiler which samples a running phorth context from a
+    background thread.
+
+    Parameters
+    ----------
+    thread : int
+        The identifier of the thread which runs the phorth context.
+    interval : float, optional
+        The number of seconds to wait between samples.
+
+    Notes
+    -----
+    The runner may replace the frame of a context when it grows the stack, so
+    the context is found by looking for the innermost phorth frame of
+    ``thread`` each time a sample is taken.
+
+    Each sample records the word that contains the instruction pointer and the
+    words that contain each return address on the control stack. Addresses are
+    resolved to the word with the nearest preceding ``addr``. Code that comes
+    before the first word in the dictionary is reported as ``<phorth>``.
+
+    Samples are written in the collapsed stack format accepted by
+    ``flamegraph.pl`` and similar tools.
+    """
+    def __init__(self, thread, interval=0.005):
+        self.thread = thread
+        self.interval = interval
+        self.samples = Counter()
+
+        self._thread = None
+        self._stopped = threading.Event()
+
+        # cache of the dictionary sorted by address, rebuilt when words are
+        # defined or forgotten
+        self._latest = self._nwords = None
+        self._addrs = self._names = ()
+
+    def _index(self, words, latest):
+        if latest is self._latest and len(words) == self._nwords:
+            return
+
+        ws = sorted(
+            (w for w in words.values() if isinstance(w, Word)),
+            key=op.attrgetter('addr'),
+        )
+        self._addrs = [w.addr for w in ws]
+        self._names = [_frame_name(w.name) for w in ws]
+        self._latest = latest
+        self._nwords = len(words)
+
+    def _resolve(self, addr):
+        ix = bisect_right(self._addrs, addr) - 1
+        if ix < 0:
+            return '<phorth>'
+        return self._names[ix]
+
+    def _frame(self):
+        frame = sys._current_frames().get(self.thread)
+        while frame is not None and frame.f_code.co_name != '<phorth>':
+            frame = frame.f_back
+        return frame
+
+    def sample(self):
+        """Take a single sample of the context.
+
+        Nothing is recorded while the context is not running.
+        """
+        frame = self._frame()
+        if frame is None:
+            return
+
+        lasti, cstack, latest = sample_frame(frame)
+        self._index(frame.f_globals, latest)
+
+        # negative entries on the cstack are deref jumps whose absolute value
+        # is the address of the next cell in the calling word
+        self.samples[tuple(
+            self._resolve(abs(addr)) for addr in cstack
+        ) + (self._resolve(lasti),)] += 1
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.sample()
+            except (AssertionError, ValueError):
+                # the frame finished while it was being sampled
+                continue
+
+    def start(self):
+        """Start sampling in a background thread.
+        """
+        if self._thread is not None:
+            raise ValueError('profiler is already running')
+
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            name='phorth-sampler',
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling and wait for the background thread to finish.
+        """
+        if self._thread is None:
+            return
+
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+
+    def write_collapsed(self, file):
+        """Write the samples in the collapsed stack format.
+
+        Parameters
+        ----------
+        file : file-like
+            The file to write to.
+        """
+        for stack, count in sorted(self.samples.items()):
+            file.write('%s %d\n' % (';'.join(stack), count))
+
+
+def _frame_name(name):
+    """Escape a word name for use in a collapsed stack.
+
+    ``;`` separates the frames of a collapsed stack so it may not appear in
+    the name.
+    """
+    return name.replace(';', '%3B')
+
+
+_active = {}
+
+
+def sample_impl():
+    """Implementation for the ``_sample`` word which toggles the sampling
+    profiler for the running context.
+
+    Notes
+    -----
+    The first call starts sampling, the next call stops sampling and writes
+    the collapsed stacks to stdout.
+    """
+    thread = threading.get_ident()
+    profiler = _active.pop(thread, None)
+    if profiler is None:
+        _active[thread] = profiler = SamplingProfiler(thread)
+        profiler.start()
+    else:
+        profiler.stop()
+        profiler.write_collapsed(sys.stdout)
@@ -1,15 +1,71 @@
+from collections import deque
+from contextlib import contextmanager
+import sys
 from sys import settrace, gettrace
+import threading
 
 
-from .code import build_phorth_ctx
-from .words import repl_word_impl, Done
-from ._runner import jump_handler
+from .autoload import AutoloadIndex, Autoloader, stdlib_index
+from .code import UnknownWord, build_phorth_ctx, idle, map_done
+from .output import Output
+from .primitives import Context, Word, context_stats
+from .profiler import SamplingProfiler
+from .words import repl_word_impl, stdlib_words, Done
+from ._runner import (
+    jump_handler,
+    pop_values,
+    push_return,
+    push_values,
+    stack_depth,
+    throw,
+)
 
 
 def _tracer(*args):
     return _tracer
 
 
+@contextmanager
+def _tracing():
+    # set a tracer to enable some features in PyFrame_EvalFrameEx
+    old_trace = gettrace()
+    settrace(_tracer)
+    try:
+        yield
+    finally:
+        settrace(old_trace)  # reset the old tracer.
+
+
+def _start_ctx(here, ctx, out, *, latest=None, literals=None, context=None):
+    """Create the generator which runs a new context.
+    """
+    return ctx(
+        immediate=True,
+        here=here,
+        latest=latest,
+        literals=[] if literals is None else literals,
+        tmp=None,
+        out=out,
+        context=(
+            Context(ctx.max_memory, ctx.max_stack_size)
+            if context is None else
+            context
+        ),
+    )
+
+
+def _library_index(stdlib, libraries):
+    """Index the libraries which are autoloaded, or None if there are none.
+    """
+    if not (stdlib or libraries):
+        return None
+
+    index = stdlib_index() if stdlib else AutoloadIndex()
+    for path in libraries:
+        index.add_file(path)
+    return index
+
+
 version = '0.2.0'
 
 
@@ -26,43 +82,470 @@ def run_phorth(stack_size=30000,
                memory=65535,
                *,
                stdlib=True,
-               show_header=True):
+               autoload=True,
+               libraries=(),
+               show_header=True,
+               profile=None,
+               output=None,
+               optimize=True,
+               int_cells=False,
+               subroutine_threaded=False):
     """Run a phorth session.
 
     Parameters
     ----------
     stack_size : int, optional
-        The size of the stack to build in the phorth frame.
+        The maximum number of values on the stack of the phorth frame.
     memory : int, optional
-        The size of the memory space for the phorth context. This translates
-        to the size of the `co_code` of the context.
+        The maximum size of the memory space for the phorth context. This
+        translates to the size of the `co_code` of the context.
     stdlib : bool, optional
         Include ``stdlib.fs`` in the default vocabulary?
+    autoload : bool, optional
+        Compile each stdlib word the first time it is referenced instead of
+        compiling the whole stdlib when the session starts?
+    libraries : iterable[str], optional
+        Paths to phorth source files whose definitions are compiled the first
+        time they are referenced.
     show_header : bool, optional
         Print the license information at the start of the repl session.
+    profile : str or file-like, optional
+        Run the session under the sampling profiler and write the collapsed
+        stacks here when the session ends.
+    output : file-like or int, optional
+        The file or file descriptor that the output words write to. Defaults
+        to ``sys.stdout``.
+    optimize : bool, optional
+        Run the peephole optimizer on each colon definition?
+    int_cells : bool, optional
+        Compile colon definitions which only work with ints to run on native
+        64 bit cells?
+    subroutine_threaded : bool, optional
+        Compile colon definitions to subroutine threaded code?
+
+    Notes
+    -----
+    Each literal compiled into a definition, and each ``constant``, takes one
+    of the 4096 literal slots of the context. Defining more raises
+    ``OverflowError``; ``forget`` and ``marker`` free the slots of the words
+    they remove.
     """
+    out = Output(output)
+    index = _library_index(stdlib and autoload, libraries)
+    word_impl = repl_word_impl(stdlib=stdlib and not autoload, output=out)
+    if index is not None:
+        word_impl = Autoloader(index, word_impl)
     here, ctx = build_phorth_ctx(
         stack_size,
         memory,
-        word_impl=repl_word_impl(stdlib=stdlib),
+        word_impl=word_impl,
+        optimize=optimize,
+        int_cells=int_cells,
+        subroutine_threaded=subroutine_threaded,
+        autoload_index=index,
     )
-    # set a tracer to enable some features in PyFrame_EvalFrameEx
-    old_trace = gettrace()
-    settrace(_tracer)
+    if index is not None:
+        word_impl.dictionary = ctx.__globals__
 
     if show_header:
         print(_header)
+    gen = _start_ctx(here, ctx, out)
+    if profile is not None:
+        profiler = SamplingProfiler(threading.get_ident())
+        profiler.start()
+
     try:
-        jump_handler(ctx(
-            immediate=True,
-            here=here,
-            latest=None,
-            cstack=[],
-            stack_size=0,
-            literals=[],
-            tmp=None,
-        ))
+        with _tracing():
+            jump_handler(gen)
     except Done:
         return None
     finally:
-        settrace(old_trace)  # reset the old tracer.
+        out.flush()
+        if profile is not None:
+            profiler.stop()
+            if isinstance(profile, str):
+                with open(profile, 'w') as f:
+                    profiler.write_collapsed(f)
+            else:
+                profiler.write_collapsed(profile)
+
+
+class Session:
+    """A phorth context which is driven from Python.
+
+    Parameters
+    ----------
+    stack_size : int, optional
+        The maximum number of values on the stack of the phorth frame.
+    memory : int, optional
+        The maximum size of the memory space for the phorth context.
+    stdlib : bool, optional
+        Include ``stdlib.fs`` in the default vocabulary?
+    autoload : bool, optional
+        Compile each stdlib word the first time it is referenced instead of
+        compiling the whole stdlib when the session starts?
+    libraries : iterable[str], optional
+        Paths to phorth source files whose definitions are compiled the first
+        time they are referenced.
+    output : file-like or int, optional
+        The file or file descriptor that the output words write to. Defaults
+        to ``sys.stdout``.
+    optimize : bool, optional
+        Run the peephole optimizer on each colon definition?
+    int_cells : bool, optional
+        Compile colon definitions which only work with ints to run on native
+        64 bit cells?
+    subroutine_threaded : bool, optional
+        Compile colon definitions to subroutine threaded code?
+
+    Notes
+    -----
+    The stack and memory start small and grow as needed, so idle sessions are
+    cheap to keep around. The literal table does not grow: a context holds at
+    most 4096 literals, counting each literal compiled into a definition and
+    each ``constant``. Defining more raises ``OverflowError``; ``forget`` and
+    ``marker`` free the slots of the words they remove.
+
+    Between calls the context is suspended waiting for input. Errors raised
+    while evaluating source are reported and the context is reset, just like
+    the repl, and the rest of the source is discarded.
+
+    While a :meth:`map` generator is suspended between results the context is
+    parked inside the mapped word, so :meth:`eval`, :meth:`pop_stack` and
+    another :meth:`map` raise until the generator is exhausted or closed.
+
+    Attributes
+    ----------
+    last_error : Exception or None
+        The last error reported by this session's context.
+    """
+    def __init__(self,
+                 stack_size=30000,
+                 memory=65535,
+                 *,
+                 stdlib=True,
+                 autoload=True,
+                 libraries=(),
+                 output=None,
+                 optimize=True,
+                 int_cells=False,
+                 subroutine_threaded=False):
+        self._input = deque()
+        self.out = Output(output)
+        self._mapping = False
+        self.last_error = None
+        index = _library_index(stdlib and autoload, libraries)
+        self._autoload = (
+            None if index is None else Autoloader(index, self._next_word)
+        )
+        self._read = (
+            self._next_word if self._autoload is None else self._autoload
+        )
+        here, ctx = build_phorth_ctx(
+            stack_size,
+            memory,
+            word_impl=self._read_word,
+            optimize=optimize,
+            int_cells=int_cells,
+            subroutine_threaded=subroutine_threaded,
+            autoload_index=index,
+        )
+        self._start(here, ctx)
+        if self._autoload is not None:
+            self._autoload.dictionary = self._words
+
+        if stdlib and not autoload:
+            self._input.extend(stdlib_words())
+        self._run()
+        # where the outer interpreter waits for input
+        self._idle_lasti = self._gen.gi_frame.f_lasti
+
+    def _start(self, here, ctx, **kwargs):
+        self._context = Context(ctx.max_memory, ctx.max_stack_size)
+        # the number of errors reported by the context as of the last read
+        self._errors = 0
+        self._gen = _start_ctx(
+            here,
+            ctx,
+            self.out,
+            context=self._context,
+            **kwargs
+        )
+        self._words = ctx.__globals__
+        self._map_return = ctx.hidden_words['__map_return'].addr
+
+    @classmethod
+    def from_image(cls, image, *, output=None):
+        """Create a session from a copy of another context.
+
+        Parameters
+        ----------
+        image : phorth.pool.ContextImage
+            The copy of the context.
+        output : file-like or int, optional
+            The file or file descriptor that the output words write to.
+            Defaults to ``sys.stdout``.
+
+        Returns
+        -------
+        session : Session
+            A session with the memory, literals and dictionary of the image.
+        """
+        self = cls.__new__(cls)
+        self._input = deque()
+        self.out = Output(output)
+        self._mapping = False
+        self.last_error = None
+        index = image.autoload_index
+        # the image already has the preamble
+        self._autoload = (
+            None if index is None else
+            Autoloader(index, self._next_word, preamble=False)
+        )
+        self._read = (
+            self._next_word if self._autoload is None else self._autoload
+        )
+        _, ctx = build_phorth_ctx(
+            image.max_stack_size,
+            image.max_memory,
+            word_impl=self._read_word,
+            autoload_index=index,
+        )
+        self._start(
+            image.here,
+            image.restore(ctx),
+            latest=image.latest,
+            literals=list(image.literals),
+        )
+        if self._autoload is not None:
+            self._autoload.dictionary = self._words
+        self._run()
+        self._idle_lasti = self._gen.gi_frame.f_lasti
+        return self
+
+    def _check_idle(self):
+        if self._mapping:
+            raise RuntimeError(
+                'the session is running a map; exhaust or close it first',
+            )
+
+    def _read_word(self):
+        errors = self._context.exceptions
+        if errors != self._errors:
+            # the context reported an error, stop reading like ``abort``; the
+            # handler set ``sys.last_value`` right before it reset the context
+            self._errors = errors
+            self.last_error = sys.last_value
+            self.clear_input()
+            return None
+        return self._read()
+
+    def clear_input(self):
+        """Discard the words which have been queued but not read yet,
+        including any library definitions waiting to be autoloaded.
+        """
+        self._input.clear()
+        if self._autoload is not None:
+            self._autoload.clear()
+
+    def _next_word(self):
+        try:
+            return self._input.popleft()
+        except IndexError:
+            # suspend the context
+            return None
+
+    def _run(self, *args):
+        with _tracing():
+            return jump_handler(self._gen, *args)
+
+    @property
+    def words(self):
+        """The dictionary of the context.
+        """
+        return self._words
+
+    @property
+    def errors(self):
+        """The number of errors reported by the context.
+        """
+        return self._context.exceptions
+
+    @property
+    def compiling(self):
+        """Is the context in compile mode, for example because a definition
+        was not closed?
+        """
+        if self._autoload is not None and self._autoload.pending:
+            # the start of a definition is held until it is closed
+            return True
+        return not self._gen.gi_frame.f_locals['immediate']
+
+    @property
+    def in_word(self):
+        """Is the context suspended inside a word which is waiting for more
+        input, like ``'`` or ``constant`` waiting for the name that follows
+        it?
+        """
+        return self._gen.gi_frame.f_lasti != self._idle_lasti
+
+    def stats(self):
+        """The resource usage of the context.
+
+        Returns
+        -------
+        stats : dict[str, int]
+            The counters maintained by the runner and primitives:
+            ``dispatches``, ``deref_jumps``, ``exceptions``,
+            ``max_stack_depth`` and ``max_cstack_depth``; along with the
+            current ``stack_depth``, ``cstack_depth``, ``here``, ``literals``
+            and ``words`` and the allocated and maximum sizes of the stack,
+            memory and literal table.
+
+        Notes
+        -----
+        The high-water marks are sampled between jumps so a primitive which
+        pushes and pops within a single instruction sequence is not counted.
+        """
+        return context_stats(self._gen.gi_frame)
+
+    def pop_stack(self):
+        """Pop every value from the data stack.
+
+        Returns
+        -------
+        values : tuple
+            The values that were on the stack, bottom first.
+        """
+        self._check_idle()
+        return pop_values(self._gen, stack_depth(self._gen))
+
+    def eval(self, source):
+        """Evaluate phorth source code.
+
+        Parameters
+        ----------
+        source : str
+            The source to evaluate.
+
+        Notes
+        -----
+        When an error is reported the rest of ``source`` is discarded.
+        """
+        self._check_idle()
+        self._input.extend(word.lower() for word in source.split())
+        self._run()
+        self.out.flush()
+
+    def map(self, word, iterable, *, nargs=1, nresults=1):
+        """Lazily apply a word to each element of an iterable.
+
+        Parameters
+        ----------
+        word : str or Word
+            The word to apply, or its name.
+        iterable : iterable
+            The arguments. When ``nargs`` is 1 each element is pushed as is,
+            otherwise each element must be a sequence of ``nargs`` values.
+        nargs : int, optional
+            The number of values the word consumes.
+        nresults : int or None, optional
+            The number of values the word produces. None means the word may
+            leave any number of values.
+
+        Yields
+        ------
+        result : any
+            The value left by the word when ``nresults`` is 1, otherwise a
+            tuple of the values left by the word.
+
+        Raises
+        ------
+        RuntimeError
+            Raised when the word reads input, like ``'`` or ``constant``. The
+            context is reset like it is after any other error.
+
+        Notes
+        -----
+        The word is called directly by address in the suspended context; the
+        outer interpreter is not used.
+        """
+        self._check_idle()
+        if isinstance(word, Word):
+            addr = word.addr
+        else:
+            name = word.lower()
+            if (name not in self._words and
+                    self._autoload is not None and
+                    self._autoload.require((name,))):
+                self._run()
+            try:
+                addr = self._words[name].addr
+            except KeyError:
+                raise UnknownWord(word)
+
+        gen = self._gen
+        idle_lasti = gen.gi_frame.f_lasti
+        errors = self._context.exceptions
+        suspended = False
+        self._mapping = True
+        try:
+            for item in iterable:
+                args = (item,) if nargs == 1 else tuple(item)
+                if len(args) != nargs:
+                    raise ValueError(
+                        'expected %d arguments, got %d' % (nargs, len(args)),
+                    )
+
+                base = stack_depth(gen)
+                push_values(gen, args)
+                push_return(gen, self._map_return - 1)
+                suspended = True
+                if self._run(addr - 1) is not map_done:
+                    suspended = False
+                    if self._context.exceptions != errors:
+                        # the context reported the error and is waiting for
+                        # input again
+                        raise self.last_error
+
+                    # the word is waiting for input inside of itself, reset
+                    # the context like any other error
+                    error = RuntimeError(
+                        '%r read input while mapping' % (word,),
+                    )
+                    with _tracing():
+                        result = throw(gen, error)
+                    assert result is idle, result
+                    raise error
+
+                produced = stack_depth(gen) - base
+                if nresults is None:
+                    if produced < 0:
+                        raise ValueError(
+                            '%r consumed %d values, expected %d' % (
+                                word,
+                                nargs - produced,
+                                nargs,
+                            ),
+                        )
+                    yield pop_values(gen, produced)
+                    continue
+                if produced != nresults:
+                    pop_values(gen, max(produced, 0))
+                    raise ValueError(
+                        '%r left %d values, expected %d' % (
+                            word,
+                            produced,
+                            nresults,
+                        ),
+                    )
+
+                results = pop_values(gen, nresults)
+                yield results[0] if nresults == 1 else results
+        finally:
+            self._mapping = False
+            if suspended:
+                # go back to waiting for input
+                result = self._run(idle_lasti)
+                assert result is idle, result
+            self.out.flush()
@@ -0,0 +1,634 @@
+from collections import deque
+from contextlib import redirect_stdout
+import io
+import json
+import os
+import selectors
+import signal
+import socket
+import sys
+import time
+import traceback
+
+import click
+
+from .runner import Session
+
+
+class RequestTimeout(Exception):
+    """Raised in a worker when a request runs for longer than the server's
+    timeout.
+    """
+
+
+def _raise_timeout(signum, frame):
+    raise RequestTimeout('the request timed out')
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt()
+
+
+class LatencyMetrics:
+    """Request counters and a window of recent request latencies.
+
+    Parameters
+    ----------
+    window : int, optional
+        The number of recent latencies to compute the percentiles over.
+    """
+    def __init__(self, window=10000):
+        self.requests = 0
+        self.errors = 0
+        self._latencies = deque(maxlen=window)
+
+    def record(self, latency, error):
+        """Record a finished request.
+
+        Parameters
+        ----------
+        latency : float
+            The number of seconds from receiving the request to sending the
+            response.
+        error : bool
+            Did the request fail?
+        """
+        self.requests += 1
+        self.errors += error
+        self._latencies.append(latency)
+
+    def snapshot(self):
+        """Summarize the metrics.
+
+        Returns
+        -------
+        metrics : dict
+            The request and error counts and the mean, median, 90th and 99th
+            percentile and maximum latency in seconds over the window.
+        """
+        latencies = sorted(self._latencies)
+        if latencies:
+            def percentile(q):
+                return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+            latency = {
+                'mean': sum(latencies) / len(latencies),
+                'p50': percentile(0.5),
+                'p90': percentile(0.9),
+                'p99': percentile(0.99),
+                'max': latencies[-1],
+            }
+        else:
+            latency = None
+
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'latency': latency,
+        }
+
+
+class _Channel:
+    """A stream of newline delimited JSON messages which is read without
+    blocking by the server.
+    """
+    def __init__(self, fd, read, write, close=None):
+        self._fd = fd
+        self._read = read
+        self._write = write
+        self._close = close
+        self._buffer = b''
+        self.closed = False
+        # the end of the stream was read
+        self.eof = False
+        # the number of requests from this stream without a response
+        self.outstanding = 0
+
+    @classmethod
+    def from_socket(cls, sock):
+        return cls(sock.fileno(), sock.recv, sock.sendall, sock.close)
+
+    def fileno(self):
+        return self._fd
+
+    def read_lines(self):
+        """Read the available data.
+
+        Returns
+        -------
+        lines : list[bytes] or None
+            The complete lines that were read, or None at the end of the
+            stream.
+        """
+        try:
+            data = self._read(65536)
+        except OSError:
+            data = b''
+        if not data:
+            return None
+
+        self._buffer += data
+        *lines, self._buffer = self._buffer.split(b'\n')
+        return [line for line in lines if line.strip()]
+
+    def send(self, message):
+        if self.closed:
+            return
+        try:
+            self._write(json.dumps(message).encode('utf-8') + b'\n')
+        except OSError:
+            # the other end went away; the stream is closed once the server
+            # reads the end of it
+            self.closed = True
+
+    def close(self):
+        if self._close is not None:
+            self._close()
+            self._close = None
+        self.closed = True
+
+
+class _Worker:
+    def __init__(self, pid, channel):
+        self.pid = pid
+        self.channel = channel
+        # (client, request, start time) of the request being served
+        self.request = None
+        # the worker exits after its current response
+        self.retiring = False
+
+
+class PreforkServer:
+    """Serve phorth requests from forked copies of a warmed context.
+
+    Parameters
+    ----------
+    workers : int, optional
+        The number of worker processes.
+    max_requests : int, optional
+        The number of requests a worker serves before it is replaced.
+    vocabularies : iterable[str], optional
+        Paths to phorth source files to load into the context before forking.
+    timeout : float, optional
+        The number of seconds a request may run before it fails.
+    stdlib : bool, optional
+        Include ``stdlib.fs`` in the context?
+    stack_size : int, optional
+        The maximum number of values on the stack of the context.
+    memory : int, optional
+        The maximum size of the memory space for the context.
+
+    Notes
+    -----
+    The context is built and the vocabularies are loaded once in the server
+    process. Workers are forked from it so they share the warmed memory copy on
+    write.
+
+    Requests and responses are newline delimited JSON objects. A request looks
+    like ``{"id": 1, "source": "2 3 + dup ."}``. The response has the request's
+    ``id``, the ``stack`` left by the source as a list of reprs, the captured
+    ``output``, the ``error`` or null, and the ``latency`` in seconds. The
+    request ``{"op": "metrics"}`` is answered by the server with
+    ``{"id": ..., "metrics": {...}}``.
+
+    Words defined by a request are forgotten before the next request. A
+    worker is replaced after it has served ``max_requests`` requests or when a
+    request fails. A request fails if it ends in the middle of a definition,
+    or inside a word like ``'`` that reads the name after it.
+    """
+    def __init__(self,
+                 *,
+                 workers=4,
+                 max_requests=1000,
+                 vocabularies=(),
+                 timeout=None,
+                 stdlib=True,
+                 stack_size=30000,
+                 memory=65535):
+        if workers < 1:
+            raise ValueError('workers must be at least 1, got %d' % workers)
+        if max_requests < 1:
+            raise ValueError(
+                'max_requests must be at least 1, got %d' % max_requests,
+            )
+
+        self.nworkers = workers
+        self.max_requests = max_requests
+        self.timeout = timeout
+        self.recycled = 0
+        self.latency = LatencyMetrics()
+
+        self._capture = io.StringIO()
+        self._session = session = Session(
+            stack_size,
+            memory,
+            stdlib=stdlib,
+            output=self._capture,
+        )
+        for path in vocabularies:
+            with open(path) as f:
+                self._warm(f.read(), path)
+        # words defined by requests are forgotten back to here
+        self._warm('marker __request', 'marker')
+        session.pop_stack()
+
+        self._selector = None
+        self._listener = None
+        self._workers = {}
+        self._idle = deque()
+        self._pending = deque()
+        self._clients = set()
+        self._closing = False
+
+    def _warm(self, source, name):
+        session = self._session
+        errors = session.errors
+        with redirect_stdout(self._capture):
+            session.eval(source)
+        if session.errors != errors:
+            raise ValueError('failed to load %s: %s\n%s' % (
+                name,
+                session.last_error,
+                self._capture.getvalue(),
+            ))
+        self._capture.seek(0)
+        self._capture.truncate()
+
+    def metrics(self):
+        """The server's metrics.
+
+        Returns
+        -------
+        metrics : dict
+            The request counts and latencies, the number of workers that have
+            been replaced, and the number of requests waiting for a worker.
+        """
+        metrics = self.latency.snapshot()
+        metrics['workers'] = len(self._workers)
+        metrics['recycled'] = self.recycled
+        metrics['pending'] = len(self._pending)
+        return metrics
+
+    # worker process
+
+    def _evaluate(self, source):
+        session = self._session
+        capture = self._capture
+
+        errors = session.errors
+        error = None
+        if self.timeout is not None:
+            # keep firing until the request returns, in case the context
+            # reports the timeout and keeps running
+            signal.setitimer(signal.ITIMER_REAL, self.timeout, self.timeout)
+        try:
+            # errors are reported by printing to stdout
+            with redirect_stdout(capture):
+                session.eval(source)
+        except Exception as e:
+            error = e
+        finally:
+            if self.timeout is not None:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+
+        if error is None and session.errors != errors:
+            error = session.last_error
+        if error is None and session.compiling:
+            error = 'unterminated definition'
+        if error is None and session.in_word:
+            # the rollback would feed its words to the suspended word
+            error = 'the source ended inside of a word which reads input'
+
+        try:
+            stack = session.pop_stack()
+        except Exception:
+            # the context is no longer running
+            stack = ()
+
+        if error is None:
+            with redirect_stdout(capture):
+                session.eval('__request marker __request')
+
+        output = capture.getvalue()
+        capture.seek(0)
+        capture.truncate()
+        return {
+            'stack': list(map(repr, stack)),
+            'output': output,
+            'error': (
+                None
+                if error is None else
+                error
+                if isinstance(error, str) else
+                '%s: %s' % (type(error).__name__, error)
+            ),
+        }
+
+    def _work(self, sock):
+        # the server shuts the workers down by closing their sockets
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        if self.timeout is not None:
+            signal.signal(signal.SIGALRM, _raise_timeout)
+
+        requests = sock.makefile('rb')
+        for n in range(1, self.max_requests + 1):
+            line = requests.readline()
+            if not line:
+                return
+
+            request = json.loads(line.decode('utf-8'))
+            response = self._evaluate(request['source'])
+            response['id'] = request['id']
+            retiring = response['error'] is not None or n == self.max_requests
+            response['retiring'] = retiring
+            sock.sendall(json.dumps(response).encode('utf-8') + b'\n')
+            if retiring:
+                return
+
+    def _spawn(self):
+        server_sock, worker_sock = socket.socketpair()
+        pid = os.fork()
+        if not pid:
+            code = 0
+            try:
+                # drop the server's side of every stream
+                server_sock.close()
+                self._selector.close()
+                if self._listener is not None:
+                    self._listener.close()
+                for worker in self._workers.values():
+                    worker.channel.close()
+                for client in self._clients:
+                    client.close()
+                self._work(worker_sock)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+
+        worker_sock.close()
+        worker = _Worker(pid, _Channel.from_socket(server_sock))
+        self._workers[pid] = worker
+        self._idle.append(worker)
+        self._selector.register(
+            worker.channel,
+            selectors.EVENT_READ,
+            lambda: self._read_worker(worker),
+        )
+
+    # server process
+
+    def _dispatch(self):
+        while self._pending and self._idle:
+            worker = self._idle.popleft()
+            client, request, start = self._pending.popleft()
+            if client.closed:
+                self._idle.appendleft(worker)
+                client.outstanding -= 1
+                continue
+
+            worker.request = client, request, start
+            worker.channel.send({
+                'id': request.get('id'),
+                'source': request['source'],
+            })
+
+    def _respond(self, worker, response):
+        client, request, start = worker.request
+        worker.request = None
+
+        latency = time.perf_counter() - start
+        self.latency.record(latency, response['error'] is not None)
+        response['latency'] = latency
+        client.send(response)
+
+        client.outstanding -= 1
+        if client.eof and not client.outstanding:
+            self._clients.discard(client)
+            client.close()
+
+    def _read_worker(self, worker):
+        lines = worker.channel.read_lines()
+        if lines is None:
+            self._reap(worker)
+            return
+
+        for line in lines:
+            response = json.loads(line.decode('utf-8'))
+            worker.retiring = response.pop('retiring')
+            self._respond(worker, response)
+
+        if not worker.retiring:
+            self._idle.append(worker)
+        self._dispatch()
+
+    def _reap(self, worker):
+        self._selector.unregister(worker.channel)
+        worker.channel.close()
+        os.waitpid(worker.pid, 0)
+        del self._workers[worker.pid]
+        try:
+            self._idle.remove(worker)
+        except ValueError:
+            pass
+
+        if worker.request is not None:
+            # the worker died while serving a request
+            self._respond(worker, {
+                'id': worker.request[1].get('id'),
+                'stack': [],
+                'output': '',
+                'error': 'worker exited',
+            })
+
+        if not self._closing:
+            self.recycled += 1
+            self._spawn()
+            self._dispatch()
+
+    def _read_client(self, client):
+        lines = client.read_lines()
+        if lines is None:
+            # finish the outstanding requests before closing the stream
+            self._selector.unregister(client)
+            client.eof = True
+            if client.closed or not client.outstanding:
+                self._clients.discard(client)
+                client.close()
+            return
+
+        for line in lines:
+            try:
+                request = json.loads(line.decode('utf-8'))
+            except ValueError as e:
+                client.send({'id': None, 'error': 'invalid request: %s' % e})
+                continue
+
+            if not isinstance(request, dict):
+                client.send({'id': None, 'error': 'request must be an object'})
+            elif request.get('op') == 'metrics':
+                client.send({'id': request.get('id'), 'metrics': self.metrics()})
+            elif not isinstance(request.get('source'), str):
+                client.send({
+                    'id': request.get('id'),
+                    'error': 'request needs a source string',
+                })
+            else:
+                client.outstanding += 1
+                self._pending.append((client, request, time.perf_counter()))
+
+        self._dispatch()
+
+    def _add_client(self, client):
+        self._clients.add(client)
+        self._selector.register(
+            client,
+            selectors.EVENT_READ,
+            lambda: self._read_client(client),
+        )
+
+    def _serve(self, listener=None, client=None):
+        # poll rather than epoll because stdin may be a regular file
+        self._selector = getattr(
+            selectors,
+            'PollSelector',
+            selectors.SelectSelector,
+        )()
+        self._listener = listener
+        self._closing = False
+        # shut the workers down cleanly when the server is terminated
+        old_sigterm = signal.signal(signal.SIGTERM, _interrupt)
+        try:
+            for _ in range(self.nworkers):
+                self._spawn()
+
+            if listener is not None:
+                def accept():
+                    sock, _ = listener.accept()
+                    self._add_client(_Channel.from_socket(sock))
+
+                self._selector.register(listener, selectors.EVENT_READ, accept)
+            if client is not None:
+                self._add_client(client)
+
+            while listener is not None or self._clients:
+                for key, _ in self._selector.select():
+                    key.data()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+            self._shutdown()
+            signal.signal(signal.SIGTERM, old_sigterm)
+
+    def _shutdown(self):
+        self._closing = True
+        for worker in list(self._workers.values()):
+            self._selector.unregister(worker.channel)
+            worker.channel.close()
+            os.waitpid(worker.pid, 0)
+        self._workers.clear()
+        self._idle.clear()
+        self._pending.clear()
+        for client in self._clients:
+            client.close()
+        self._clients.clear()
+        self._selector.close()
+        self._listener = None
+
+    def serve_unix(self, path):
+        """Serve requests from clients of a Unix socket until interrupted.
+
+        Parameters
+        ----------
+        path : str
+            The path to bind the socket to.
+        """
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            listener.bind(path)
+            listener.listen()
+            self._serve(listener=listener)
+        finally:
+            listener.close()
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def serve_stdio(self, stdin=None, stdout=None):
+        """Serve requests read from ``stdin`` until it is closed.
+
+        Parameters
+        ----------
+        stdin : binary file-like, optional
+            The file to read requests from. Defaults to ``sys.stdin``.
+        stdout : binary file-like, optional
+            The file to write responses to. Defaults to ``sys.stdout``.
+        """
+        if stdin is None:
+            stdin = sys.stdin.buffer
+        if stdout is None:
+            stdout = sys.stdout.buffer
+
+        fd = stdin.fileno()
+
+        def write(data):
+            stdout.write(data)
+            stdout.flush()
+
+        self._serve(client=_Channel(fd, lambda n: os.read(fd, n), write))
+
+
+@click.command()
+@click.option(
+    '--socket',
+    'path',
+    type=click.Path(dir_okay=False),
+    help='Serve clients of a Unix socket at this path instead of stdin.',
+)
+@click.option(
+    '-w',
+    '--workers',
+    default=4,
+    type=int,
+    help='The number of worker processes.',
+)
+@click.option(
+    '--max-requests',
+    default=1000,
+    type=int,
+    help='The number of requests a worker serves before it is replaced.',
+)
+@click.option(
+    '--timeout',
+    type=float,
+    help='The number of seconds a request may run for.',
+)
+@click.option(
+    '--vocabulary',
+    multiple=True,
+    type=click.Path(exists=True, dir_okay=False),
+    help='A phorth source file to load before forking the workers.',
+)
+@click.option(
+    '--with-stdlib/--without-stdlib',
+    default=True,
+    help='Include stdlib.fs in the default vocabulary?',
+)
+def main(path, workers, max_requests, timeout, vocabulary, with_stdlib):
+    server = PreforkServer(
+        workers=workers,
+        max_requests=max_requests,
+        vocabularies=vocabulary,
+        timeout=timeout,
+        stdlib=with_stdlib,
+    )
+    if path is None:
+        server.serve_stdio()
+    else:
+        server.serve_unix(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,367 @@
+from contextlib import contextmanager
+import io
+import mmap
+import os
+import stat
+
+from .runner import Session
+
+
+# the size of the reads from the input and of the output buffer
+default_buffer_size = 1 << 20
+
+
+def line_records(file, *, buffer_size=default_buffer_size):
+    """Split a binary file into lines.
+
+    Parameters
+    ----------
+    file : file-like
+        The binary file to read.
+    buffer_size : int, optional
+        The number of bytes to read at a time.
+
+    Yields
+    ------
+    record : bytes
+        Each line without its trailing newline. A final line without a
+        newline is still a record.
+    """
+    read = getattr(file, 'read1', file.read)
+    tail = b''
+    while True:
+        chunk = read(buffer_size)
+        if not chunk:
+            break
+
+        lines = (tail + chunk).split(b'\n')
+        tail = lines.pop()
+        yield from lines
+
+    if tail:
+        yield tail
+
+
+def fixed_records(file, record_size, *, buffer_size=default_buffer_size):
+    """Split a binary file into fixed size records.
+
+    Parameters
+    ----------
+    file : file-like
+        The binary file to read.
+    record_size : int
+        The number of bytes in each record.
+    buffer_size : int, optional
+        The number of bytes to read at a time. This is rounded up to a
+        multiple of ``record_size``.
+
+    Yields
+    ------
+    record : bytes
+        Each record. The last record is shorter than ``record_size`` if the
+        size of the file is not a multiple of ``record_size``.
+    """
+    if record_size <= 0:
+        raise ValueError('record_size must be positive, got %d' % record_size)
+
+    buffer_size = -(-buffer_size // record_size) * record_size
+    tail = b''
+    while True:
+        chunk = file.read(buffer_size)
+        if not chunk:
+            break
+
+        data = tail + chunk
+        end = len(data) - len(data) % record_size
+        for start in range(0, end, record_size):
+            yield data[start:start + record_size]
+        tail = data[end:]
+
+    if tail:
+        yield tail
+
+
+def mmap_line_records(memory):
+    """Split a memory map into lines.
+
+    Parameters
+    ----------
+    memory : mmap.mmap
+        The memory map to read.
+
+    Yields
+    ------
+    record : bytes
+        Each line without its trailing newline.
+    """
+    find = memory.find
+    start = 0
+    size = len(memory)
+    while start < size:
+        end = find(b'\n', start)
+        if end < 0:
+            end = size
+        yield memory[start:end]
+        start = end + 1
+
+
+def mmap_fixed_records(memory, record_size):
+    """Split a memory map into fixed size records.
+
+    Parameters
+    ----------
+    memory : mmap.mmap
+        The memory map to read.
+    record_size : int
+        The number of bytes in each record.
+
+    Yields
+    ------
+    record : bytes
+        Each record. The last record may be short, like
+        :func:`fixed_records`.
+    """
+    if record_size <= 0:
+        raise ValueError('record_size must be positive, got %d' % record_size)
+
+    for start in range(0, len(memory), record_size):
+        yield memory[start:start + record_size]
+
+
+@contextmanager
+def mapped(file):
+    """Memory map a file for reading.
+
+    Parameters
+    ----------
+    file : file-like
+        The file to map. This must be a regular file.
+
+    Yields
+    ------
+    memory : mmap.mmap or bytes
+        The contents of the file. Empty files cannot be mapped so they are
+        an empty bytes object.
+    """
+    fd = file.fileno()
+    info = os.fstat(fd)
+    if not stat.S_ISREG(info.st_mode):
+        raise ValueError('only regular files can be memory mapped')
+
+    if not info.st_size:
+        yield b''
+        return
+
+    memory = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+    try:
+        yield memory
+    finally:
+        memory.close()
+
+
+def parse_field(field):
+    """Convert a field to an int or float if it is a number, like awk.
+
+    Parameters
+    ----------
+    field : str or bytes
+        The field to parse.
+
+    Returns
+    -------
+    value : int, float, str or bytes
+        The number, or ``field`` itself if it is not a number.
+    """
+    try:
+        return int(field)
+    except ValueError:
+        pass
+    try:
+        return float(field)
+    except ValueError:
+        return field
+
+
+def _format(value, encoding):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode(encoding, 'surrogateescape')
+    return str(value)
+
+
+def run_filter(session,
+               word,
+               records,
+               *,
+               fields=False,
+               delimiter=None,
+               encoding='utf-8'):
+    """Run a word on each record and write the values it leaves.
+
+    Parameters
+    ----------
+    session : Session
+        The session to run the word in. The values are written to its
+        output.
+    word : str
+        The name of the word to run.
+    records : iterable[bytes]
+        The records.
+    fields : bool, optional
+        Also push the fields of each record?
+    delimiter : str, optional
+        The string that separates the fields. By default fields are separated
+        by runs of whitespace.
+    encoding : str, optional
+        The encoding of the records. Records which are not valid in this
+        encoding are decoded with ``surrogateescape``. None passes the records
+        as bytes.
+
+    Returns
+    -------
+    count : int
+        The number of records.
+
+    Notes
+    -----
+    The word is called with ``( record -- values.. )``, or
+    ``( record fields -- values.. )`` when ``fields`` is True, where
+    ``fields`` is a tuple of the fields of the record. Fields which are
+    numbers are converted to an int or float.
+
+    The values left by the word are written to the output separated by spaces
+    and followed by a newline. When the word leaves nothing, nothing is
+    written, so a word can drop a record by consuming it.
+    """
+    if encoding is not None:
+        records = (
+            record.decode(encoding, 'surrogateescape') for record in records
+        )
+        if delimiter is not None and isinstance(delimiter, bytes):
+            delimiter = delimiter.decode(encoding)
+    elif isinstance(delimiter, str):
+        delimiter = delimiter.encode()
+
+    if fields:
+        records = (
+            (record, tuple(map(parse_field, record.split(delimiter))))
+            for record in records
+        )
+
+    write = session.out.write
+    count = 0
+    for count, values in enumerate(session.map(
+            word,
+            records,
+            nargs=2 if fields else 1,
+            nresults=None,
+    ), 1):
+        if values:
+            write(' '.join(_format(value, encoding or 'utf-8')
+                           for value in values) + '\n')
+
+    return count
+
+
+def filter_main(word,
+                script,
+                input_,
+                *,
+                record_size=None,
+                fields=False,
+                delimiter=None,
+                use_mmap=False,
+                encoding='utf-8',
+                buffer_size=default_buffer_size,
+                **session_kwargs):
+    """Implementation of ``python -m phorth --filter``.
+
+    Parameters
+    ----------
+    word : str
+        The name of the word to run on each record.
+    script : str or None
+        The path to a phorth source file which defines ``word``.
+    input_ : file-like
+        The binary file to read records from.
+    record_size : int, optional
+        Split the input into records of this many bytes instead of lines.
+    fields : bool, optional
+        Also push the fields of each record?
+    delimiter : str, optional
+        The string that separates the fields.
+    use_mmap : bool, optional
+        Memory map the input instead of reading it. The input must be a
+        regular file.
+    encoding : str, optional
+        The encoding of the input and output, or None to pass records as
+        bytes.
+    buffer_size : int, optional
+        The number of bytes to read at a time and the number of characters to
+        buffer before writing the output.
+    **session_kwargs
+        Forwarded to :class:`~phorth.runner.Session`.
+
+    Returns
+    -------
+    count : int
+        The number of records.
+
+    Raises
+    ------
+    ValueError
+        Raised when the script reports an error or does not finish its last
+        definition.
+    """
+    output = io.TextIOWrapper(
+        io.FileIO(1, 'w', closefd=False),
+        encoding=encoding or 'utf-8',
+        errors='surrogateescape',
+        write_through=True,
+    )
+    session = Session(output=output, **session_kwargs)
+    session.out.buffer_size = buffer_size
+    try:
+        if script is not None:
+            errors = session.errors
+            with open(script) as f:
+                session.eval(f.read())
+            if session.errors != errors:
+                raise ValueError('%s: %s: %s' % (
+                    script,
+                    type(session.last_error).__name__,
+                    session.last_error,
+                ))
+            if session.compiling:
+                raise ValueError('%s: unterminated definition' % script)
+            if session.in_word:
+                raise ValueError(
+                    '%s: ended inside of a word which reads input' % script,
+                )
+
+        kwargs = {
+            'fields': fields,
+            'delimiter': delimiter,
+            'encoding': encoding,
+        }
+        if use_mmap:
+            with mapped(input_) as memory:
+                if record_size is None:
+                    records = mmap_line_records(memory)
+                else:
+                    records = mmap_fixed_records(memory, record_size)
+                return run_filter(session, word, records, **kwargs)
+
+        if record_size is None:
+            records = line_records(input_, buffer_size=buffer_size)
+        else:
+            records = fixed_records(
+                input_,
+                record_size,
+                buffer_size=buffer_size,
+            )
+        return run_filter(session, word, records, **kwargs)
+    finally:
+        session.out.flush()
+        output.detach()
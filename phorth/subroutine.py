@@ -0,0 +1,232 @@
+from dis import HAVE_ARGUMENT, opmap
+
+from ._primitives import Word, stack_headroom, write_memory
+from .effects import builtin_effects, combine
+from .peephole import docol_header, superinstruction_name, superinstructions
+
+
+_LOAD_CONST = opmap['LOAD_CONST']
+_CALL_FUNCTION = opmap['CALL_FUNCTION']
+_POP_TOP = opmap['POP_TOP']
+_JUMP_ABSOLUTE = opmap['JUMP_ABSOLUTE']
+_NOP = opmap['NOP']
+_YIELD_VALUE = opmap['YIELD_VALUE']
+
+
+def _short(n):
+    return n.to_bytes(2, 'little')
+
+
+def _instructions(memory, addr):
+    """Iterate over the instructions starting at ``addr``.
+
+    Yields
+    ------
+    addr : int
+        The address of the instruction.
+    opcode : int
+        The opcode of the instruction.
+    arg : int or None
+        The argument of the instruction.
+    """
+    while addr < len(memory):
+        opcode = memory[addr]
+        if opcode < HAVE_ARGUMENT:
+            yield addr, opcode, None
+            addr += 1
+        else:
+            arg = int.from_bytes(memory[addr + 1:addr + 3], 'little')
+            yield addr, opcode, arg
+            addr += 3
+
+
+class SubroutineThreading:
+    """The compiler which rewrites a colon definition as subroutine threaded
+    code when ``;`` closes it.
+
+    Parameters
+    ----------
+    words : dict[str, Word]
+        The builtin words of the context, including the hidden words.
+    peephole : Peephole
+        The peephole optimizer, which decodes and simplifies the thread before
+        it is compiled.
+    inline : iterable[str]
+        The names of the builtins whose code may be copied into the caller.
+        These must be straight line code that ends by jumping to ``__next``.
+    enabled : bool, optional
+        Compile definitions? When this is False definitions are left as they
+        were compiled.
+
+    Notes
+    -----
+    A threaded definition is a list of cells. Each call yields a negative
+    address so that the runner dereferences the cell and pushes the next cell
+    onto the cstack before jumping. A subroutine threaded definition is
+    CPython code instead of cells:
+
+    - literals are a ``LOAD_CONST``
+    - inline builtins, like ``+`` and ``swap``, are copied into the definition
+    - other calls are the same sequence the builtins use: ``push_return_addr``
+      followed by a ``JUMP_ABSOLUTE`` to the word, so the callee returns with
+      a plain jump instead of a deref jump
+    - a call right before ``exit`` is a ``JUMP_ABSOLUTE`` which returns
+      straight to the caller
+    - ``exit`` jumps to ``__next``
+
+    The runner only grows the data stack between jumps, so it keeps
+    ``stack_headroom`` free values every time it resumes the context. Threaded
+    literals and builtins all return through the runner, but literals and
+    inlined builtins in subroutine threaded code do not. When the values that
+    they push since the last call could reach the headroom, a ``yield None``
+    is emitted to sync the frame, which lets the runner grow the stack.
+
+    The code is usually longer than the thread. If it does not fit in the
+    memory which has been allocated the definition is left threaded.
+    """
+    def __init__(self, words, peephole, inline, *, enabled=False):
+        self.words = words
+        self.peephole = peephole
+        self.inline = frozenset(inline)
+        self.enabled = enabled
+
+        # built on first use because the builtins are compiled in batches
+        self._builtin_names = None
+        self._inline_code = None
+        self._inline_pushes = None
+        self._sync = None
+
+    def _prepare(self, code):
+        if self._builtin_names is not None:
+            return
+
+        memory = code.co_code
+        words = self.words
+        next_ = words['__next'].addr
+        self._builtin_names = {w.addr: name for name, w in words.items()}
+        self._sync = bytes((_LOAD_CONST,)) + _short(
+            code.co_consts.index(None),
+        ) + bytes((_YIELD_VALUE,))
+
+        effects = dict(builtin_effects)
+        for pair in superinstructions:
+            effects[superinstruction_name(pair)] = combine(
+                effects[name] for name in pair
+            )
+        # the net number of values each inline builtin pushes
+        self._inline_pushes = {
+            name: effects[name][1] - effects[name][0] for name in self.inline
+        }
+        self._inline_code = {}
+        for name in self.inline:
+            start = words[name].addr
+            for addr, opcode, arg in _instructions(memory, start):
+                if opcode == _JUMP_ABSOLUTE and arg == next_:
+                    self._inline_code[name] = memory[start:addr]
+                    break
+
+    def _call(self, word):
+        return bytes((
+            _LOAD_CONST, 0, 0,  # push_return_addr
+            _CALL_FUNCTION, 0, 0,
+            _POP_TOP,
+            _JUMP_ABSOLUTE,
+        )) + _short(word.addr)
+
+    def _encode(self, items):
+        next_ = self.words['__next'].addr
+        exit = ('call', self.words['exit'])
+        code = bytearray()
+        tail_call = False
+        # the values pushed since the runner last reserved the headroom,
+        # plus one for the temporaries of a builtin
+        depth = 1
+
+        def reserve(pushes):
+            nonlocal depth
+            if depth + max(pushes, 0) >= stack_headroom:
+                code.extend(self._sync)
+                depth = 1
+            depth += pushes
+
+        for n, item in enumerate(items):
+            if tail_call:
+                # the exit after a tail call is unreachable
+                tail_call = False
+                continue
+
+            kind = item[0]
+            if kind in ('lit', 'litop'):
+                reserve(1 if kind == 'lit' else 0)
+                code.append(_LOAD_CONST)
+                code += _short(item[1])
+                if kind == 'litop':
+                    name = self._builtin_names[item[2].addr]
+                    code += self._inline_code[name]
+                continue
+
+            word = item[1]
+            name = self._builtin_names.get(word.addr)
+            if name == 'exit':
+                code.append(_JUMP_ABSOLUTE)
+                code += _short(next_)
+            elif name in self._inline_code:
+                reserve(self._inline_pushes[name])
+                code += self._inline_code[name]
+            elif items[n + 1:n + 2] == [exit]:
+                # a tail call, the callee returns to our caller
+                code.append(_JUMP_ABSOLUTE)
+                code += _short(word.addr)
+                tail_call = True
+            else:
+                code += self._call(word)
+                # the callee returns through the runner
+                depth = 1
+
+        return bytes(code)
+
+    def compile(self, frame, latest, here):
+        """Implementation for the subroutine threading pass of the ; forth
+        word.
+
+        Parameters
+        ----------
+        frame : frame
+            The phorth frame.
+        latest : Word
+            The word whose definition was just closed.
+        here : int
+            The first free memory address, which is the end of the thread.
+
+        Returns
+        -------
+        here : int or None
+            The new first free memory address, or None if the definition was
+            not compiled.
+        """
+        if not (self.enabled and isinstance(latest, Word)):
+            return None
+
+        memory = frame.f_code.co_code
+        self._prepare(frame.f_code)
+        addr = latest.addr
+        thread = self.peephole.simplify(frame, latest, here)
+        if thread is None:
+            return None
+        start, _, out, values = thread
+        if start != addr + len(docol_header(self.words['__docol'].addr)):
+            # memo: definitions keep their threaded code
+            return None
+        if any(item[0] == 'litop' and
+               self._builtin_names[item[2].addr] not in self._inline_code
+               for item in out):
+            return None
+
+        new = self._encode(out)
+        end = addr + len(new)
+        if end > len(memory):
+            return None
+
+        self.peephole.store_literals(frame, values)
+        write_memory(frame, addr, new + bytes((_NOP,)) * max(here - end, 0))
+        return end
@@ -0,0 +1,104 @@
+import pytest
+
+from phorth.autoload import AutoloadIndex
+
+
+source = """\
+: sq  ( n -- n*n ) dup * ;
+: cube  ( n -- n^3 ) dup sq * ;
+1 2 +
+: SIXTH cube sq ;
+"""
+
+
+def index_of(source):
+    index = AutoloadIndex()
+    index.add_source(source, 'lib.fs')
+    return index
+
+
+def tokens(name, source=source):
+    return index_of(source).definitions[name].tokens
+
+
+def test_add_source():
+    index = index_of(source)
+    assert sorted(index.definitions) == ['cube', 'sixth', 'sq']
+    assert index.preamble == ['1', '2', '+']
+
+    sq = index.definitions['sq']
+    assert sq.tokens == [
+        ':', 'sq', '(', 'n', '--', 'n*n', ')', 'dup', '*', ';',
+    ]
+    assert sq.origin == 'lib.fs'
+    assert sq.lines == (1, 1)
+    assert sq.dependencies == frozenset()
+
+    assert index.definitions['cube'].dependencies == {'sq'}
+    assert index.definitions['sixth'].dependencies == {'cube', 'sq'}
+
+
+def test_comments_are_not_dependencies():
+    index = index_of(': a 1 ;\n: b ( a -- a ) 2 ;\n')
+    assert index.definitions['b'].dependencies == frozenset()
+
+
+def test_recursive_definition_is_not_a_dependency():
+    index = index_of(': down dup 0branch 1 down ;')
+    assert index.definitions['down'].dependencies == frozenset()
+
+
+def test_last_definition_wins():
+    index = index_of(': f 1 ;\n: f 2 ;\n')
+    assert index.definitions['f'].tokens == [':', 'f', '2', ';']
+    assert index.definitions['f'].lines == (2, 2)
+
+
+def test_multiline_definition():
+    index = index_of('\n: f\n  1\n  2 ;\n')
+    assert index.definitions['f'].lines == (2, 4)
+
+
+def test_memo_definition():
+    index = index_of('memo: f ( a -- b ) 1 + ;')
+    assert index.definitions['f'].tokens[0] == 'memo:'
+
+
+def test_unterminated_definition():
+    with pytest.raises(ValueError):
+        index_of(': f 1 2')
+
+
+def test_tokens_for():
+    index = index_of(source)
+    assert index.tokens_for(['sixth'], set()) == (
+        tokens('sq') + tokens('cube') + tokens('sixth')
+    )
+
+
+def test_tokens_for_defined():
+    index = index_of(source)
+    assert index.tokens_for(['sixth'], {'sq'}) == (
+        tokens('cube') + tokens('sixth')
+    )
+    assert index.tokens_for(['sq'], {'sq'}) == []
+
+
+def test_tokens_for_unknown_names():
+    index = index_of(source)
+    assert index.tokens_for(['dup', 'nope'], set()) == []
+
+
+def test_tokens_for_each_definition_once():
+    index = index_of(source)
+    assert index.tokens_for(['sq', 'cube', 'sq'], set()) == (
+        tokens('sq') + tokens('cube')
+    )
+
+
+def test_tokens_for_mutual_recursion():
+    source = ': a b ;\n: b a ;\n'
+    index = index_of(source)
+    assert index.tokens_for(['a'], set()) == (
+        tokens('b', source) + tokens('a', source)
+    )
@@ -0,0 +1,54 @@
+import pytest
+
+from phorth._primitives import stack_headroom
+from phorth.effects import combine
+from phorth.memo import new_memo, parse_stack_effect
+
+
+@pytest.mark.parametrize('effects,expected', [
+    ([], (0, 0)),
+    ([(2, 1)], (2, 1)),
+    ([(0, 1), (0, 1), (2, 1)], (0, 1)),
+    ([(1, 2), (3, 1)], (2, 1)),
+    ([(1, 0), (1, 0)], (2, 0)),
+    ([(0, 3), (1, 0)], (0, 2)),
+    # dup *
+    ([(1, 2), (2, 1)], (1, 1)),
+])
+def test_combine(effects, expected):
+    assert combine(effects) == expected
+
+
+def test_combine_iterator():
+    assert combine(iter([(1, 2), (2, 1)])) == (1, 1)
+
+
+@pytest.mark.parametrize('words,expected', [
+    (['--'], (0, 0)),
+    (['a', 'b', '--', 'c'], (2, 1)),
+    (['--', 'a', 'b'], (0, 2)),
+    # only the first -- separates the inputs from the outputs
+    (['a', '--', 'b', '--'], (1, 2)),
+    ([], None),
+    (['a', 'b'], None),
+])
+def test_parse_stack_effect(words, expected):
+    assert parse_stack_effect(words) == expected
+
+
+def test_new_memo():
+    memo = new_memo(['a', 'b', '--', 'c'], 100)
+    assert memo.addr == 100
+    assert memo.nargs == 2
+    assert memo.nresults == 1
+
+
+def test_new_memo_not_a_stack_effect():
+    with pytest.raises(ValueError):
+        new_memo(['a', 'b'], 100)
+
+
+def test_new_memo_too_many_results():
+    new_memo(['--'] + ['r'] * stack_headroom, 100)
+    with pytest.raises(ValueError):
+        new_memo(['--'] + ['r'] * (stack_headroom + 1), 100)
@@ -0,0 +1,416 @@
+from collections import namedtuple
+from dis import opmap
+from types import SimpleNamespace
+
+import pytest
+
+from phorth._primitives import max_literals
+from phorth.peephole import (
+    Peephole,
+    _fold,
+    _released,
+    call_word_name,
+    decode_thread,
+    docol_header,
+    max_call_args,
+    superinstruction_name,
+    superinstructions,
+)
+
+
+# a stand in for the builtin words, the optimizer only looks at the address
+FakeWord = namedtuple('FakeWord', 'name addr')
+
+lit_continuation = 30000
+memo_docol_offset = 16
+
+_names = (
+    ['__docol', '__lit_next1', '__lit_next3', 'nip', 'swap', 'drop', 'dup',
+     '2dup', 'over', 'rot', 'nop', '.', 'py::call', 'py::getitem', 'branch'] +
+    sorted(_fold) +
+    [superinstruction_name(pair) for pair in superinstructions] +
+    [call_word_name(nargs) for nargs in range(max_call_args + 1)]
+)
+# far away from the threads so that no call cell looks like a literal
+words = {
+    name: FakeWord(name, 20000 + 4 * n) for n, name in enumerate(_names)
+}
+
+
+def short(n):
+    return n.to_bytes(2, 'little')
+
+
+def call_cell(word):
+    return short(word.addr - 1)
+
+
+def lit_cell(addr, ix, continuation=lit_continuation):
+    return (
+        short(addr + 1) +
+        bytes((opmap['LOAD_CONST'],)) +
+        short(ix) +
+        bytes((opmap['JUMP_ABSOLUTE'],)) +
+        short(continuation)
+    )
+
+
+def assemble(start, items):
+    """Build the cells of a thread from the items that
+    :func:`decode_thread` returns.
+    """
+    code = bytearray()
+    for kind, value in items:
+        if kind == 'call':
+            code += call_cell(value)
+        else:
+            code += lit_cell(start + len(code), value)
+    return bytes(code)
+
+
+def call(name):
+    return 'call', words[name]
+
+
+class FakeFrame:
+    """Just enough of a phorth frame for :meth:`Peephole.simplify`.
+
+    Parameters
+    ----------
+    memory : bytes
+        The memory of the context.
+    literals : list
+        The values in the literal table.
+    """
+    # the number of constants before the literal table
+    base = 3
+
+    def __init__(self, memory, literals):
+        self.f_code = SimpleNamespace(
+            co_code=bytes(memory),
+            co_consts=(
+                (None,) * self.base +
+                tuple(literals) +
+                (None,) * (max_literals - len(literals))
+            ),
+        )
+        self.f_globals = {}
+        self.f_locals = {'literals': list(literals)}
+
+
+def thread(items, literals, *, extra_literals=(), offset=0):
+    """Compile ``items`` into a colon definition.
+
+    Parameters
+    ----------
+    items : list[tuple]
+        ``('lit', n)`` for ``literals[n]`` and ``('call', word)``.
+    literals : list
+        The values of the literals used by the definition.
+    extra_literals : list, optional
+        Literals which were added to the table after the definition's.
+    offset : int, optional
+        The offset of the docol header from the start of the word.
+
+    Returns
+    -------
+    frame : FakeFrame
+        The frame holding the definition.
+    latest : FakeWord
+        The new word.
+    here : int
+        The address past the end of the thread.
+    items : list[tuple]
+        ``items`` with the literals numbered by their index in ``co_consts``.
+    """
+    items = [
+        (kind, FakeFrame.base + value if kind == 'lit' else value)
+        for kind, value in items
+    ]
+
+    latest = FakeWord('f', 256)
+    memory = bytearray(latest.addr + offset)
+    memory += docol_header(words['__docol'].addr)
+    memory += assemble(len(memory), items)
+    frame = FakeFrame(memory, list(literals) + list(extra_literals))
+    return frame, latest, len(memory), items
+
+
+def optimizer(**kwargs):
+    return Peephole(words, lit_continuation, memo_docol_offset, **kwargs)
+
+
+def test_decode_thread():
+    start = 10
+    items = [('lit', 7), call('dup'), call('*'), ('lit', 8), call('+')]
+    memory = bytes(start) + assemble(start, items)
+
+    decoded = decode_thread(
+        memory,
+        {w.addr: w for w in words.values()},
+        lit_continuation,
+        start,
+        len(memory),
+    )
+    assert decoded == items
+
+
+def test_decode_thread_empty():
+    assert decode_thread(b'', {}, lit_continuation, 0, 0) == []
+
+
+@pytest.mark.parametrize('memory,end', [
+    # a call to something which is not a word
+    (short(12345), 2),
+    # a literal which does not continue at the literal continuation
+    (lit_cell(0, 3, continuation=lit_continuation + 1), 8),
+    # a literal without a LOAD_CONST
+    (short(1) + bytes((opmap['NOP'],)) + short(3) +
+     bytes((opmap['JUMP_ABSOLUTE'],)) + short(lit_continuation), 8),
+    # the end is in the middle of a cell
+    (call_cell(words['dup']) + call_cell(words['dup']), 3),
+])
+def test_decode_thread_unknown(memory, end):
+    decoded = decode_thread(
+        memory,
+        {w.addr: w for w in words.values()},
+        lit_continuation,
+        0,
+        end,
+    )
+    assert decoded is None
+
+
+def test_encode_round_trip():
+    peephole = optimizer()
+    peephole._prepare()
+    start = 40
+    items = [('lit', 5), call('swap'), ('lit', 9), ('lit', 6), call('.')]
+
+    code = peephole._encode(b'', items, start)
+    assert code == assemble(start, items)
+
+    memory = bytes(start) + code
+    decoded = decode_thread(
+        memory,
+        {w.addr: w for w in words.values()},
+        lit_continuation,
+        start,
+        len(memory),
+    )
+    assert decoded == items
+
+
+def simplify(items, values):
+    """Run the rewrite rules over ``items`` the way
+    :meth:`Peephole.simplify` does.
+    """
+    peephole = optimizer()
+    peephole._prepare()
+    out = []
+    for item in items:
+        out.append(item)
+        while peephole._simplify(out, values):
+            pass
+    return out
+
+
+@pytest.mark.parametrize('name,a,b', [
+    ('+', 2, 3),
+    ('-', 2, 3),
+    ('*', 4, 5),
+    ('/', 1, 4),
+    ('mod', 7, 3),
+    ('<<', 1, 4),
+    ('<', 1, 2),
+    ('=', 1, 1),
+])
+def test_fold(name, a, b):
+    values = {0: a, 1: b}
+    out = simplify([('lit', 0), ('lit', 1), call(name)], values)
+    assert out == [('lit', 0)]
+    assert values[0] == _fold[name](a, b)
+    # the second literal is left for _compact to release
+    assert values[1] == b
+
+
+def test_fold_chain():
+    values = {0: 1, 1: 2, 2: 3}
+    out = simplify(
+        [('lit', 0), ('lit', 1), call('+'), ('lit', 2), call('*')],
+        values,
+    )
+    assert out == [('lit', 0)]
+    assert values[0] == 9
+
+
+def test_fold_error_is_not_folded():
+    values = {0: 1, 1: 0}
+    out = simplify([('lit', 0), ('lit', 1), call('/')], values)
+    # the division is left for run time and fused into the second literal
+    assert out == [('lit', 0), ('litop', 1, words['/'])]
+    assert values == {0: 1, 1: 0}
+
+
+def test_fold_does_not_cross_calls():
+    values = {0: 1, 1: 2}
+    out = simplify([('lit', 0), call('dup'), ('lit', 1), call('+')], values)
+    assert out == [('lit', 0), call('dup'), ('litop', 1, words['+'])]
+    assert values == {0: 1, 1: 2}
+
+
+def test_swap_literals():
+    values = {0: 'a', 1: 'b'}
+    out = simplify([('lit', 0), ('lit', 1), call('swap')], values)
+    assert out == [('lit', 1), ('lit', 0)]
+
+
+def test_drop_literal():
+    values = {0: 'a'}
+    out = simplify([call('dup'), ('lit', 0), call('drop')], values)
+    assert out == [call('dup')]
+
+
+@pytest.mark.parametrize('names', [
+    ['nop'],
+    ['swap', 'swap'],
+    ['dup', 'drop'],
+    ['over', 'drop'],
+    ['rot', 'rot', 'rot'],
+])
+def test_noops(names):
+    items = [call('.')] + [call(name) for name in names] + [call('.')]
+    assert simplify(items, {}) == [call('.'), call('.')]
+
+
+@pytest.mark.parametrize('pair', superinstructions)
+def test_superinstructions(pair):
+    items = [call('.')] + [call(name) for name in pair]
+    out = simplify(items, {})
+    assert out == [call('.'), call(superinstruction_name(pair))]
+
+
+def test_swap_drop_is_nip():
+    assert simplify([call('swap'), call('drop')], {}) == [call('nip')]
+
+
+@pytest.mark.parametrize('nargs', range(max_call_args + 1))
+def test_call_with_literal_nargs(nargs):
+    values = {0: nargs}
+    out = simplify([call('dup'), ('lit', 0), call('py::call')], values)
+    assert out == [call('dup'), call(call_word_name(nargs))]
+
+
+@pytest.mark.parametrize('nargs', [max_call_args + 1, 1.0, 'a'])
+def test_call_with_other_nargs(nargs):
+    values = {0: nargs}
+    items = [call('dup'), ('lit', 0), call('py::call')]
+    assert simplify(items, values) == items
+
+
+def test_literal_operator():
+    values = {0: 'key'}
+    out = simplify([call('dup'), ('lit', 0), call('py::getitem')], values)
+    assert out == [call('dup'), ('litop', 0, words['py::getitem'])]
+
+
+def test_compact_releases_the_end():
+    peephole = optimizer()
+    values = {10: 3, 11: 2, 12: 7}
+    out = peephole._compact([('lit', 10), ('lit', 12)], values, 13)
+    assert out == [('lit', 10), ('lit', 11)]
+    assert values == {10: 3, 11: 7, 12: _released}
+
+
+def test_compact_renumbers_literal_operators():
+    peephole = optimizer()
+    values = {10: 3, 11: 2, 12: 7}
+    out = peephole._compact(
+        [('lit', 12), ('litop', 10, words['+'])],
+        values,
+        13,
+    )
+    # the literals are numbered in the order they are used
+    assert out == [('lit', 10), ('litop', 11, words['+'])]
+    assert values == {10: 7, 11: 3, 12: _released}
+
+
+def test_compact_unchanged():
+    peephole = optimizer()
+    values = {10: 3, 11: 2}
+    items = [('lit', 11), ('lit', 10)]
+    assert peephole._compact(items, values, 12) is items
+    assert values == {10: 3, 11: 2}
+
+
+def test_compact_not_at_the_end():
+    peephole = optimizer()
+    values = {10: 3, 11: 2}
+    items = [('lit', 10)]
+    # another literal was added after the thread's literals
+    assert peephole._compact(items, values, 13) is items
+    assert values == {10: 3, 11: 2}
+
+
+def test_simplify():
+    frame, latest, here, items = thread(
+        [('lit', 0), ('lit', 1), call('+'), ('lit', 2), call('.')],
+        [1, 2, 'x'],
+    )
+    base = frame.base
+    start, decoded, out, values = optimizer().simplify(frame, latest, here)
+
+    assert start == latest.addr + len(docol_header(words['__docol'].addr))
+    assert decoded == items
+    # the folded sum reuses the first slot and 'x' moves down to the second
+    assert out == [('lit', base), ('lit', base + 1), call('.')]
+    assert values == {base: 3, base + 1: 'x', base + 2: _released}
+
+
+def test_simplify_other_literals():
+    frame, latest, here, items = thread(
+        [('lit', 0), ('lit', 1), call('+')],
+        [1, 2],
+        extra_literals=['y'],
+    )
+    base = frame.base
+    _, _, out, values = optimizer().simplify(frame, latest, here)
+
+    # only the end of the literal table can be released so the slot of the
+    # second argument is kept
+    assert out == [('lit', base)]
+    assert values == {base: 3, base + 1: 2}
+
+
+def test_simplify_memo_header():
+    frame, latest, here, items = thread(
+        [call('dup'), call('*')],
+        [],
+        offset=memo_docol_offset,
+    )
+    _, decoded, out, _ = optimizer().simplify(frame, latest, here)
+    assert decoded == items
+    assert out == [call(superinstruction_name(('dup', '*')))]
+
+
+def test_simplify_disabled():
+    frame, latest, here, items = thread(
+        [('lit', 0), ('lit', 1), call('+')],
+        [1, 2],
+    )
+    _, decoded, out, _ = optimizer(enabled=False).simplify(
+        frame,
+        latest,
+        here,
+    )
+    assert out is decoded
+
+
+def test_simplify_unsafe():
+    frame, latest, here, _ = thread([call('branch'), call('dup')], [])
+    assert optimizer().simplify(frame, latest, here) is None
+
+
+def test_simplify_no_header():
+    frame, latest, here, _ = thread([call('dup')], [], offset=1)
+    assert optimizer().simplify(frame, latest, here) is None
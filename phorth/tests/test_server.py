@@ -0,0 +1,55 @@
+import pytest
+
+from phorth.server import LatencyMetrics
+
+
+def test_empty():
+    assert LatencyMetrics().snapshot() == {
+        'requests': 0,
+        'errors': 0,
+        'latency': None,
+    }
+
+
+def test_record():
+    metrics = LatencyMetrics()
+    for n in range(1, 101):
+        metrics.record(n / 100, error=n % 10 == 0)
+
+    snapshot = metrics.snapshot()
+    assert snapshot['requests'] == 100
+    assert snapshot['errors'] == 10
+    assert snapshot['latency'] == {
+        'mean': pytest.approx(0.505),
+        'p50': 0.51,
+        'p90': 0.91,
+        'p99': 1.0,
+        'max': 1.0,
+    }
+
+
+def test_single_request():
+    metrics = LatencyMetrics()
+    metrics.record(0.25, error=False)
+    latency = metrics.snapshot()['latency']
+    assert latency == {
+        'mean': 0.25,
+        'p50': 0.25,
+        'p90': 0.25,
+        'p99': 0.25,
+        'max': 0.25,
+    }
+
+
+def test_window():
+    metrics = LatencyMetrics(window=2)
+    metrics.record(10.0, error=True)
+    metrics.record(1.0, error=False)
+    metrics.record(3.0, error=False)
+
+    snapshot = metrics.snapshot()
+    # the counters cover every request but the latencies only the window
+    assert snapshot['requests'] == 3
+    assert snapshot['errors'] == 1
+    assert snapshot['latency']['max'] == 3.0
+    assert snapshot['latency']['mean'] == 2.0
@@ -0,0 +1,102 @@
+import io
+
+import pytest
+
+from phorth.stream import (
+    fixed_records,
+    line_records,
+    mapped,
+    mmap_fixed_records,
+    mmap_line_records,
+)
+
+
+class Unbuffered:
+    """A file without ``read1`` which returns at most ``limit`` bytes from
+    each read.
+    """
+    def __init__(self, data, limit):
+        self._file = io.BytesIO(data)
+        self._limit = limit
+
+    def read(self, size):
+        return self._file.read(min(size, self._limit))
+
+
+line_cases = [
+    (b'', []),
+    (b'\n', [b'']),
+    (b'a', [b'a']),
+    (b'a\n', [b'a']),
+    (b'a\nbc\n\nd', [b'a', b'bc', b'', b'd']),
+    (b'abc\ndef\n', [b'abc', b'def']),
+]
+
+
+@pytest.mark.parametrize('data,expected', line_cases)
+@pytest.mark.parametrize('buffer_size', [1, 2, 3, 1 << 20])
+def test_line_records(data, expected, buffer_size):
+    records = line_records(io.BytesIO(data), buffer_size=buffer_size)
+    assert list(records) == expected
+
+
+@pytest.mark.parametrize('data,expected', line_cases)
+def test_line_records_short_reads(data, expected):
+    assert list(line_records(Unbuffered(data, 1), buffer_size=4)) == expected
+
+
+@pytest.mark.parametrize('data,expected', line_cases)
+def test_mmap_line_records(data, expected, tmpdir):
+    path = tmpdir.join('input')
+    path.write_binary(data)
+    with open(str(path), 'rb') as f, mapped(f) as memory:
+        assert list(mmap_line_records(memory)) == expected
+
+
+fixed_cases = [
+    (b'', 3, []),
+    (b'abc', 3, [b'abc']),
+    (b'abcdef', 3, [b'abc', b'def']),
+    (b'abcdefg', 3, [b'abc', b'def', b'g']),
+    (b'abcdefg', 1, [b'a', b'b', b'c', b'd', b'e', b'f', b'g']),
+]
+
+
+@pytest.mark.parametrize('data,record_size,expected', fixed_cases)
+@pytest.mark.parametrize('buffer_size', [1, 2, 4, 1 << 20])
+def test_fixed_records(data, record_size, expected, buffer_size):
+    records = fixed_records(
+        io.BytesIO(data),
+        record_size,
+        buffer_size=buffer_size,
+    )
+    assert list(records) == expected
+
+
+@pytest.mark.parametrize('data,record_size,expected', fixed_cases)
+def test_fixed_records_short_reads(data, record_size, expected):
+    records = fixed_records(Unbuffered(data, 2), record_size, buffer_size=4)
+    assert list(records) == expected
+
+
+@pytest.mark.parametrize('data,record_size,expected', fixed_cases)
+def test_mmap_fixed_records(data, record_size, expected, tmpdir):
+    path = tmpdir.join('input')
+    path.write_binary(data)
+    with open(str(path), 'rb') as f, mapped(f) as memory:
+        assert list(mmap_fixed_records(memory, record_size)) == expected
+
+
+@pytest.mark.parametrize('record_size', [0, -1])
+def test_fixed_records_invalid_size(record_size):
+    with pytest.raises(ValueError):
+        list(fixed_records(io.BytesIO(b'abc'), record_size))
+    with pytest.raises(ValueError):
+        list(mmap_fixed_records(b'abc', record_size))
+
+
+def test_mapped_not_a_regular_file():
+    with open('/dev/null', 'rb') as f:
+        with pytest.raises(ValueError):
+            with mapped(f):
+                pass
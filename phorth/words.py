@@ -7,13 +7,29 @@ class Done(Exception):
     """
 
 
-def repl_word_impl(*, stdlib):
+def stdlib_words():
+    """Read the words of ``stdlib.fs``.
+
+    Yields
+    ------
+    word : str
+        The next word in the stdlib.
+    """
+    with open(pth.join(pth.dirname(__file__), 'stdlib.fs')) as f:
+        for line in f:
+            for word in line.split():
+                yield word.lower()
+
+
+def repl_word_impl(*, stdlib, output=None):
     """Create the function that will read each word from stdin.
 
     Parameters
     ----------
     stdlib : bool
         Include ``stdlib.fs`` in the default vocabulary?
+    output : Output, optional
+        The context's output, this is flushed before each line is read.
 
     Returns
     -------
@@ -27,13 +43,12 @@ def repl_word_impl(*, stdlib):
     """
     def read_words(*, input=input):
         if stdlib:
-            with open(pth.join(pth.dirname(__file__), 'stdlib.fs')) as f:
-                for line in f:
-                    for word in line.split():
-                        yield word.lower()
+            yield from stdlib_words()
 
         try:
             while True:
+                if output is not None:
+                    output.end_line()
                 for word in input('> ').split():
                     yield word.lower()
         except (EOFError, KeyboardInterrupt):